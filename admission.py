@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Admission control for free-text searches, so a traffic spike doesn't have
+every session running the full exact + stem + fuzzy pipeline at once.
+
+At most LEXAI_MATCH_CONCURRENCY searches (default: 2 per core, at least 2)
+run the full pipeline at a time, each with a budget of
+LEXAI_MATCH_BUDGET_MS (default 250) for the fuzzy stage. Further searches
+wait up to LEXAI_MATCH_WAIT_MS (default 100) in a queue of at most
+LEXAI_MATCH_QUEUE (default 4x concurrency) for a slot:
+
+    full      got a slot; fuzzy runs within the budget
+    degraded  the wait ran out; exact + stem only, fuzzy skipped
+    shed      the queue was full; nothing runs, the caller asks to retry
+
+A full search whose fuzzy stage hit the budget is degraded too (see
+triage.admitted_match). Degraded results may miss rows, so an empty one is
+not a "no match".
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from shards import available_cores
+
+
+class AdmissionController:
+    def __init__(self, concurrency: int = None, queue: int = None, wait_ms: float = None, budget_ms: float = None):
+        env = os.environ.get
+        self.concurrency = concurrency or int(env("LEXAI_MATCH_CONCURRENCY", 0)) or max(2, 2 * available_cores())
+        self.queue       = queue if queue is not None else int(env("LEXAI_MATCH_QUEUE", 4 * self.concurrency))
+        self.wait_s      = (wait_ms if wait_ms is not None else float(env("LEXAI_MATCH_WAIT_MS", 100))) / 1000
+        budget_ms        = budget_ms if budget_ms is not None else float(env("LEXAI_MATCH_BUDGET_MS", 250))
+        self.budget_s    = budget_ms / 1000 if budget_ms > 0 else None
+        self.running     = 0
+        self.waiting     = 0
+        self._cond       = threading.Condition()
+        self._counts     = dict.fromkeys(("admitted", "queued", "degraded_wait", "degraded_budget", "shed"), 0)
+
+    @contextmanager
+    def slot(self):
+        """Yields "full", "degraded" or "shed"; holds a concurrency slot only for "full"."""
+        with self._cond:
+            if self.running < self.concurrency:
+                mode = "full"
+            elif self.waiting >= self.queue:
+                mode = "shed"
+            else:
+                self.waiting += 1
+                self._counts["queued"] += 1
+                deadline = time.monotonic() + self.wait_s
+                while self.running >= self.concurrency:
+                    left = deadline - time.monotonic()
+                    if left <= 0 or not self._cond.wait(left):
+                        break
+                self.waiting -= 1
+                mode = "full" if self.running < self.concurrency else "degraded"
+            if mode == "full":
+                self.running += 1
+                self._counts["admitted"] += 1
+            else:
+                self._counts["degraded_wait" if mode == "degraded" else "shed"] += 1
+        try:
+            yield mode
+        finally:
+            if mode == "full":
+                with self._cond:
+                    self.running -= 1
+                    self._cond.notify()
+
+    def count(self, name: str, n: int = 1):
+        with self._cond:
+            self._counts[name] += n
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            out = dict(self._counts)
+            out.update(running=self.running, waiting=self.waiting, concurrency=self.concurrency,
+                       queue=self.queue, wait_ms=self.wait_s * 1000,
+                       budget_ms=self.budget_s * 1000 if self.budget_s else 0)
+        return out
+
+    def reset(self):
+        with self._cond:
+            for k in self._counts:
+                self._counts[k] = 0
+
+
+ADMISSION = AdmissionController()
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""
+Async JSON triage API for partner backends, served next to the Streamlit UI
+from the same workbook snapshots (ASGI, no framework):
+
+    uvicorn api:app --host 0.0.0.0 --port 8600 --workers 4
+
+Every request needs the partner's api_key, as an X-API-Key header or
+?api_key=. Keys are the "api_keys" of a tenant in tenants.json (that tenant's
+workbook is used) or LEXAI_API_KEYS (comma-separated, default workbook).
+
+  POST /v1/match       {"text", "gender"?, "age"?}
+  POST /v1/conditions  {"primary_category", "subcategory"?}   (no subcategory → list them)
+  POST /v1/recommend   {"primary_category", "subcategory",
+                        "clarifying_answers"?, "symptoms"?, "risk_flags"?, "row"?}
+  POST /v1/suggest     {"text", "limit"?}   as-you-type completions of the last comma-separated part
+  GET  /healthz      process is up
+  GET  /readyz       200 once the workbooks and indexes are built (503 before)
+  GET  /metrics      free-text admission counters (admitted/degraded/shed) and matcher stage stats
+
+/v1/match is admission-controlled (admission.py): under overload it answers
+503 (shed) or returns exact + stem matches only with "degraded": true.
+
+A JSON object body gets a JSON response. A JSON array or NDJSON body is a
+batch: results stream back as NDJSON, one line per input and in input order,
+each carrying the input's "id" if it had one. Bad input is a 400 with
+{"error"} (in a batch: an error line for that item, the rest still run); an
+unexpected failure is a 500 the same way.
+
+The operations, and resolving the tenant's snapshot (which may stat, parse
+or revalidate a workbook), run on a bounded thread pool (LEXAI_API_THREADS,
+default 16), never on the event loop, so one slow request doesn't stall
+the other connections.
+"""
+
+import asyncio
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import numpy as np
+
+from admission import ADMISSION
+from decisions import build_decision_table, decide
+from matcher import STATS as MATCHER_STATS, normalize_free_text
+from recommend import build_recommendations, evaluate_rule
+from suggest import build_suggest_index, complete
+from triage import (admitted_match, age_band, build_subcategories, build_symptom_masks, build_vocabularies,
+                    choose_condition, pathway_rows, risk_flags_of, symptom_options, symptom_scores)
+from warmup import warm
+from workbook import DEFAULT_TENANT, default_registry
+
+
+MAX_BODY_BYTES   = int(os.environ.get("LEXAI_API_MAX_BODY", 8 * 1024 * 1024))
+MATCH_CACHE_SIZE = int(os.environ.get("LEXAI_API_MATCH_CACHE", 10000))
+BATCH_FLUSH      = 64   # NDJSON lines per body chunk (and per trip to the thread pool)
+
+registry = default_registry()
+ENV_KEYS = {k.strip() for k in os.environ.get("LEXAI_API_KEYS", "").split(",") if k.strip()}
+
+_match_cache = OrderedDict()
+_match_cache_lock = threading.Lock()
+_pool = ThreadPoolExecutor(int(os.environ.get("LEXAI_API_THREADS", 16)), thread_name_prefix="api")
+_warmup = {"ready": False, "artifacts": []}
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _json_default(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, float) and obj != obj:
+        return None
+    raise TypeError(f"not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(obj) -> bytes:
+    return json.dumps(obj, default=_json_default, ensure_ascii=False).encode("utf-8")
+
+
+def _clean(value):
+    """NaN cells → None, numpy scalars → Python."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def _optional(req: dict, name: str, types, what: str):
+    """req[name] if it is one of types (bool never counts as a number), None if absent, else 400."""
+    value = req.get(name)
+    if value is None:
+        return None
+    if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+        raise ApiError(400, f"{name} must be {what}")
+    return value
+
+
+def _strings(req: dict, name: str) -> list:
+    """A list of non-empty, stripped strings (other items are ignored)."""
+    values = _optional(req, name, (list,), "a list of strings") or []
+    return [v.strip() for v in values if isinstance(v, str) and v.strip()]
+
+
+def _recommendations(snapshot) -> dict:
+    return snapshot.derived("recommendations", build_recommendations)
+
+
+def _row_summaries(snapshot) -> dict:
+    """Row label → the JSON-ready summary /v1/match returns for it."""
+    return {
+        _clean(idx): {"row": _clean(idx), "condition": _clean(r["Condition"]),
+                      "primary_category": _clean(r["Primary Category"]),
+                      "subcategory": _clean(r["SubCategory"])}
+        for idx, r in snapshot.db.iterrows()
+    }
+
+
+# --- Operations (pure, synchronous; one snapshot per HTTP request) ---
+
+def op_match(snapshot, req: dict) -> dict:
+    text = req.get("text")
+    if not isinstance(text, str) or not text.strip():
+        raise ApiError(400, "text is required")
+    gender = _optional(req, "gender", (str,), "a string")
+    age = _optional(req, "age", (int, float), "a number")
+    normalized = normalize_free_text(text, snapshot.ft_map)
+
+    key = (snapshot.version, gender, age_band(age), normalized)
+    with _match_cache_lock:
+        rows, status = _match_cache.get(key), "ok"
+        if rows is not None:
+            _match_cache.move_to_end(key)
+    if rows is None:
+        rows, status = admitted_match(snapshot, normalized, gender, age)
+        if status == "shed":
+            raise ApiError(503, "overloaded, retry later")
+        if status == "ok":   # degraded results may be missing rows: don't cache them
+            with _match_cache_lock:
+                _match_cache[key] = rows
+                if len(_match_cache) > MATCH_CACHE_SIZE:
+                    _match_cache.popitem(last=False)
+
+    summaries = snapshot.derived("api_row_summaries", _row_summaries)
+    matches = [summaries[idx] for idx in rows]
+    return {
+        "normalized": normalized,
+        "categories": sorted({m["primary_category"] for m in matches if m["primary_category"] is not None}),
+        "matches": matches,
+        "degraded": status == "degraded",
+    }
+
+
+def op_conditions(snapshot, req: dict) -> dict:
+    primary = _optional(req, "primary_category", (str,), "a string")
+    sub = _optional(req, "subcategory", (str,), "a string")
+    if not primary:
+        raise ApiError(400, "primary_category is required")
+    if not sub:
+        return {"subcategories": snapshot.derived("subcategories", build_subcategories).get(primary, [])}
+    subset = pathway_rows(snapshot.db, primary, sub)
+    risk_flags = snapshot.derived("vocabularies", build_vocabularies)["risk_flags"]
+    return {
+        "symptoms": symptom_options(snapshot, subset.index),
+        "clarifying_questions_1": list(subset["Clarifying Questions 1"].dropna().unique()),
+        "clarifying_questions_2": list(subset["Clarifying Questions2"].dropna().unique()),
+        "conditions": [
+            {"row": idx, "condition": r["Condition"], "acuity": _clean(r["Acuity Level"]),
+             "risk_flags": list(risk_flags.get(idx, ()))}
+            for idx, r in subset.iterrows()
+        ],
+    }
+
+
+def op_recommend(snapshot, req: dict) -> dict:
+    primary = _optional(req, "primary_category", (str,), "a string")
+    sub = _optional(req, "subcategory", (str,), "a string")
+    answers = _optional(req, "clarifying_answers", (dict,), 'an object of question → "Yes"/"No"') or {}
+    risk_flags = _strings(req, "risk_flags")
+    symptoms = _strings(req, "symptoms")
+    row = _optional(req, "row", (int,), "an integer row number")
+
+    if row is not None:
+        if row not in snapshot.db.index:
+            raise ApiError(404, f"unknown row {row}")
+    else:
+        masks = snapshot.derived("symptom_masks", build_symptom_masks)
+        scores = symptom_scores(masks.get((primary, sub)), symptoms)
+        decision = decide(snapshot.derived("decision_table", build_decision_table), primary, sub, answers,
+                          scores=scores)
+        if decision is not None:
+            row = decision[0]
+        else:
+            subset = pathway_rows(snapshot.db, primary, sub)
+            if subset.empty:
+                raise ApiError(404, "no conditions for this primary_category/subcategory")
+            row = choose_condition(subset, answers, scores)
+
+    condition = snapshot.db.loc[row]
+    compiled = _recommendations(snapshot)[row]
+    card_escalated = (compiled.acuity == 3) or bool(risk_flags)
+    return {
+        "row": row,
+        "condition": compiled.name,
+        "acuity": _clean(compiled.acuity),
+        "escalated": compiled.is_escalated(risk_flags),
+        "card": "escalated" if card_escalated else "ok",
+        "rule_matched": evaluate_rule(compiled.rule, condition.fillna("").to_dict(),
+                                      {"clarifying_answers": answers}),
+        "recommendation": compiled.recommendation(risk_flags),
+        "emergency": compiled.emergency or None,
+        "referral": compiled.referral or None,
+        "risk_flags": risk_flags_of(condition),
+    }
+
+
+def op_suggest(snapshot, req: dict) -> dict:
+    text, limit = req.get("text"), req.get("limit", 8)
+    if not isinstance(text, str):
+        raise ApiError(400, "text is required")
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+        raise ApiError(400, "limit must be a positive integer")
+    suggestions = snapshot.derived("suggest_index", build_suggest_index).suggest(text, limit)
+    return {"suggestions": suggestions, "completions": [complete(text, s) for s in suggestions]}
+
+
+OPS = {
+    "/v1/match": op_match,
+    "/v1/conditions": op_conditions,
+    "/v1/recommend": op_recommend,
+    "/v1/suggest": op_suggest,
+}
+
+
+def run_one(op, snapshot, req) -> dict:
+    if not isinstance(req, dict):
+        raise ApiError(400, "each request must be a JSON object")
+    out = op(snapshot, req)
+    if "id" in req:
+        out = {"id": req["id"], **out}
+    return out
+
+
+def run_lines(op, snapshot, items) -> bytes:
+    """NDJSON lines for a chunk of batch items; a failing item becomes its own error line."""
+    lines = []
+    for req in items:
+        try:
+            line = run_one(op, snapshot, req)
+        except ApiError as e:
+            line = {"error": str(e), "status": e.status}
+        except Exception as e:
+            line = {"error": f"internal error: {type(e).__name__}", "status": 500}
+        if "error" in line:
+            line = {"id": req.get("id") if isinstance(req, dict) else None, **line}
+        lines.append(dumps(line) + b"\n")
+    return b"".join(lines)
+
+
+async def off_loop(fn, *args):
+    """fn(*args) on the API thread pool."""
+    return await asyncio.get_running_loop().run_in_executor(_pool, fn, *args)
+
+
+# --- ASGI plumbing ---
+
+def parse_body(body: bytes):
+    """(is_batch, items) from a JSON object, JSON array or NDJSON body."""
+    try:
+        text = body.decode("utf-8").strip()
+    except UnicodeDecodeError:
+        raise ApiError(400, "body must be UTF-8 JSON")
+    if not text:
+        raise ApiError(400, "empty body")
+    try:
+        data = json.loads(text)
+        if isinstance(data, list):
+            return True, data
+        return False, [data]
+    except json.JSONDecodeError:
+        pass
+    try:
+        return True, [json.loads(line) for line in text.splitlines() if line.strip()]
+    except json.JSONDecodeError as e:
+        raise ApiError(400, f"invalid JSON: {e}")
+
+
+def authenticate(scope, headers: dict) -> str:
+    """Tenant for the request's api_key, or raise 401."""
+    key = headers.get(b"x-api-key", b"").decode()
+    if not key:
+        key = (parse_qs(scope.get("query_string", b"").decode()).get("api_key") or [""])[0]
+    if key:
+        tenant = registry.tenant_for_api_key(key)
+        if tenant:
+            return tenant
+        if key in ENV_KEYS:
+            return DEFAULT_TENANT
+    raise ApiError(401, "missing or invalid api_key")
+
+
+async def read_body(receive) -> bytes:
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            raise ApiError(413, "request body too large")
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def send_json(send, status: int, payload):
+    body = dumps(payload)
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"),
+                            (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def stream_ndjson(send, op, snapshot, items):
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"application/x-ndjson")]})
+    for start in range(0, len(items), BATCH_FLUSH):
+        chunk = await off_loop(run_lines, op, snapshot, items[start:start + BATCH_FLUSH])
+        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # Parse every tenant's workbook and build its indexes before taking traffic
+            _warmup["artifacts"] = await asyncio.to_thread(warm, registry)
+            _warmup["ready"] = True
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    path, method = scope["path"], scope["method"]
+    try:
+        if path == "/healthz" and method == "GET":
+            return await send_json(send, 200, {"status": "ok"})
+        if path == "/readyz" and method == "GET":
+            return await send_json(send, 200 if _warmup["ready"] else 503, _warmup)
+        if path == "/metrics" and method == "GET":
+            return await send_json(send, 200, {"admission": ADMISSION.snapshot(),
+                                               "matcher": {"queries": MATCHER_STATS.queries,
+                                                           "stages": MATCHER_STATS.rows()}})
+
+        op = OPS.get(path)
+        if op is None:
+            raise ApiError(404, "not found")
+        if method != "POST":
+            raise ApiError(405, "use POST")
+
+        tenant = authenticate(scope, dict(scope.get("headers", [])))
+        is_batch, items = parse_body(await read_body(receive))
+        snapshot = await off_loop(registry.snapshot, tenant)
+
+        if is_batch:
+            return await stream_ndjson(send, op, snapshot, items)
+        return await send_json(send, 200, await off_loop(run_one, op, snapshot, items[0]))
+    except ApiError as e:
+        return await send_json(send, e.status, {"error": str(e)})
+    except Exception as e:   # never a bare 500: the partner gets JSON either way
+        return await send_json(send, 500, {"error": f"internal error: {type(e).__name__}"})
@@ -9,17 +9,40 @@ Original file is located at
 
 import streamlit as st
 import pandas as pd
-from PIL import Image
-import re
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from difflib import SequenceMatcher
 import os
+import functools
 import csv
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from recommend import CompiledCondition, build_recommendations, compile_recommendations
+from reindex import recent_changes
+from workbook import Snapshot, WorkbookRegistry, default_registry
+from warmup import REPORT as WARMUP_REPORT, load_logo
+from grid import display_grid, shown_items
+from suggest import build_suggest_index
+from decisions import build_decision_table, decide, summary as decision_summary
+from profiling import RerunMeter, RerunProfiler
+from tracing import FunnelTracer
+from traffic import TrafficRecorder
+from shadow import ShadowRunner
+from memory import MemoryMonitor, session_states, state_sizes, streamlit_cache_stats
+from admission import ADMISSION
+from prefetch import Prefetcher, SessionCache
+from matcher import STATS as MATCHER_STATS, TIMINGS, explain_free_text, normalize_free_text
+from triage import (admitted_match, age_band, build_partitions, build_subcategories, build_symptom_masks,
+                    build_vocabularies, choose_condition, gender_allowed, match_rows, pathway_rows,
+                    symptom_options, symptom_scores)
+
 
 LOG_PATH = "failure_log.csv"
+PROGRESS_POLL_S = 0.25   # how often a pending free-text search is polled (partial rerun)
+FRAGMENTS = os.environ.get("LEXAI_FRAGMENTS", "1") != "0"   # 0 = full reruns everywhere (for before/after)
+PROPOSALS_PATH = "alias_proposals.csv"   # written offline by clusters.py
 
-GENERIC_TOKENS = {"pain", "ache", "aches", "soreness", "discomfort"}
 
 def log_failure(record: dict):
     file_exists = os.path.isfile(LOG_PATH)
@@ -31,25 +54,188 @@ def log_failure(record: dict):
 
 def analytics_page():
     st.header("📊 App Failure Report")
+    if st.button("🧠 Memory usage →"):
+        st.session_state.page = "memory"
+        st.rerun()
     if not os.path.isfile(LOG_PATH):
         st.info("No failures logged yet.")
-        return
-
-    df = pd.read_csv(LOG_PATH, parse_dates=["timestamp"])
-    st.subheader("Recent Failures")
-    st.dataframe(df.sort_values("timestamp", ascending=False).head(20))
-
-    st.subheader("Failures by Reason")
-    counts = df["reason"].value_counts().reset_index()
-    counts.columns = ["Reason","Count"]
-    st.table(counts)
-
-def stem(word: str) -> str:
-    w = word.lower().strip()
-    for suf in ("ing", "ion", "ed", "s", "ness", "able"):
-        if w.endswith(suf):
-            return w[: -len(suf)]
-    return w
+    else:
+        df = pd.read_csv(LOG_PATH, parse_dates=["timestamp"])
+        st.subheader("Recent Failures")
+        st.dataframe(df.sort_values("timestamp", ascending=False).head(20))
+
+        st.subheader("Failures by Reason")
+        counts = df["reason"].value_counts().reset_index()
+        counts.columns = ["Reason","Count"]
+        st.table(counts)
+
+    st.subheader("FreeTextMap Proposals")
+    if not os.path.isfile(PROPOSALS_PATH):
+        st.caption(f"Cluster the unmatched searches offline: `python clusters.py {LOG_PATH}` "
+                   f"writes {PROPOSALS_PATH} for review.")
+    else:
+        st.caption(f"{PROPOSALS_PATH}, updated {datetime.fromtimestamp(os.path.getmtime(PROPOSALS_PATH)):%Y-%m-%d %H:%M}")
+        st.dataframe(pd.read_csv(PROPOSALS_PATH, keep_default_na=False).head(100))
+
+    st.subheader("Workbooks by Tenant")
+    registry = get_registry()
+    st.dataframe(pd.DataFrame(registry.metrics()))
+    remotes = registry.remotes()
+    if remotes:
+        st.caption("Remote workbooks (local copy, revalidated with conditional GETs)")
+        st.dataframe(pd.DataFrame(remotes))
+    for snap in registry.snapshots():
+        st.caption(f"{snap.source} @ {snap.version} — {snap.nbytes / 1024:.0f} KiB resident")
+        st.table(pd.DataFrame(snap.artifacts()))
+        table = snap.derived("decision_table", build_decision_table)
+        size = decision_summary(table)
+        st.caption(f"Decision table: {size['tabled']}/{size['pathways']} pathways tabled, "
+                   f"{size['reachable_answer_sheets']} reachable answer sheets → {size['entries']} entries")
+
+    st.subheader("Workbook Changes")
+    changes = recent_changes()
+    if not changes:
+        st.caption("No workbook edits seen yet — when a workbook file changes, only the edited rows are reindexed.")
+    else:
+        st.dataframe(pd.DataFrame([{
+            "time": c["time"], "workbook": c["source"], "version": f"{c['from_version']} → {c['to_version']}",
+            "rows": c["rows"], "changed_rows": c["changed_rows"], "moved_rows": c["moved_rows"],
+            "pathways_rebuilt": c["pathways_rebuilt"],
+            "freetext": "+{} -{} ~{}".format(*(len(c["freetext"][k]) for k in ("added", "removed", "changed"))),
+            "reindex_s": round(sum(v for k, v in c["seconds"].items() if k != "parse"), 3),
+        } for c in changes]))
+        latest = changes[0]
+        edited = ([{"change": "added", **r} for r in latest["added"]]
+                  + [{"change": "removed", **r} for r in latest["removed"]]
+                  + [{"change": "modified", **r, "columns": ", ".join(r["columns"])} for r in latest["modified"]])
+        if edited:
+            st.caption(f"Latest: {latest['source']} @ {latest['to_version']}")
+            st.table(pd.DataFrame(edited))
+
+    if WARMUP_REPORT:
+        st.subheader("Server Warmup")
+        st.dataframe(pd.DataFrame(WARMUP_REPORT))
+
+    st.subheader("Patient Funnel")
+    funnel = get_tracer().funnel()
+    if not funnel:
+        st.info("No page visits traced yet.")
+    else:
+        st.dataframe(pd.DataFrame(funnel))
+
+    st.subheader("Free-text Matcher")
+    st.caption(f"{MATCHER_STATS.queries} queries matched by this process")
+    st.dataframe(pd.DataFrame(MATCHER_STATS.rows()))
+    st.caption("Progressive search: exact/stem results first, fuzzy merged in when done")
+    st.table(pd.DataFrame(TIMINGS.rows()))
+    query = st.text_input("Explain a query", key="explain_query")
+    if query:
+        normalized = normalize_free_text(query, FT_MAP)
+        explained = explain_free_text(normalized, PARTITIONS[None]["index"])
+        st.caption(f"Normalized: “{normalized}” — {len(explained['rows'])} rows matched")
+        st.table(pd.DataFrame(explained["stages"]))
+        if explained["rows"]:
+            rows = pd.DataFrame(explained["rows"])
+            rows.insert(1, "condition", [db.at[r, "Condition"] for r in rows["row"]])
+            st.dataframe(rows)
+
+    st.subheader("Shadow Matcher")
+    shadow = get_shadow()
+    if not shadow.enabled:
+        st.caption("Off — set LEXAI_SHADOW_ENGINE to a candidate matcher (module or .py path) to compare it on live searches.")
+    else:
+        st.caption(f"{shadow.engine_spec}: {shadow.sample_pct:g}% of searches, CPU budget {shadow.cpu_pct:g}% — "
+                   + ", ".join(f"{k} {v}" for k, v in shadow.counts.items()))
+        if shadow.last_error:
+            st.caption(f"Last error: {shadow.last_error}")
+        st.dataframe(pd.DataFrame(shadow.summary()))
+        diffs = shadow.diffs()
+        if diffs:
+            st.dataframe(pd.DataFrame(diffs))
+
+    st.subheader("Admission Control")
+    admission = ADMISSION.snapshot()
+    st.caption(f"{admission['concurrency']} concurrent full searches, queue of {admission['queue']}, "
+               f"{admission['wait_ms']:.0f} ms wait, {admission['budget_ms']:.0f} ms fuzzy budget — "
+               f"{admission['running']} running, {admission['waiting']} waiting now")
+    st.table(pd.DataFrame([{k: admission[k] for k in
+                            ("admitted", "queued", "degraded_wait", "degraded_budget", "shed")}]))
+
+    st.subheader("Reruns per Completed Triage")
+    reruns = get_rerun_meter().summary()
+    st.caption(f"Fragment-scoped widget reruns {'on' if FRAGMENTS else 'off (LEXAI_FRAGMENTS=0)'} — "
+               f"{reruns['triages']} triages completed in this process, {reruns['abandoned']} abandoned "
+               f"(idle over {get_rerun_meter().idle_s:.0f} s)")
+    st.table(pd.DataFrame([reruns]))
+
+    st.subheader("Speculative Prefetch")
+    prefetcher = get_prefetcher()
+    st.caption("Next-page data computed while the patient reads — "
+               + (f"{prefetcher.workers} workers, up to {prefetcher.max_entries} entries per session"
+                  if prefetcher.enabled else "off (LEXAI_PREFETCH=0)"))
+    prefetched = prefetcher.summary()
+    if prefetched:
+        st.table(pd.DataFrame(prefetched))
+
+    st.subheader("CPU Profiles")
+    profiler = get_profiler()
+    profiler.sample_pct = st.slider(
+        "Profile this % of reruns (all sessions)", 0, 100, int(profiler.sample_pct), key="profile_pct"
+    )
+    recent = profiler.recent(20)
+    if not recent:
+        st.info("No profiles recorded yet.")
+    else:
+        st.dataframe(pd.DataFrame(recent).drop(columns="file"))
+        pages = sorted({r["page"] for r in recent})
+        page = st.selectbox("Hot functions for", ["All pages"] + pages, key="profile_page")
+        top = profiler.top_functions(limit=25, page=None if page == "All pages" else page)
+        st.dataframe(pd.DataFrame(top))
+
+def memory_page():
+    st.header("🧠 Memory Usage")
+    if st.button("← Analytics"):
+        st.session_state.page = "analytics"
+        st.rerun()
+    monitor = get_memory_monitor()
+
+    st.subheader("Process RSS")
+    history = monitor.rss_history()
+    if history:
+        rss = pd.DataFrame(history)
+        rss["time"] = pd.to_datetime(rss["time"], unit="s")
+        st.metric("RSS now", f"{rss['rss_mb'].iloc[-1]:.0f} MiB", f"{rss['rss_mb'].iloc[-1] - rss['rss_mb'].iloc[0]:+.0f} MiB since {rss['time'].iloc[0]:%H:%M}")
+        st.line_chart(rss.set_index("time")["rss_mb"])
+
+    st.subheader("Session State by Session")
+    sessions = pd.DataFrame(state_sizes(session_states(session_id(), st.session_state)))
+    if not sessions.empty:
+        st.caption(f"{len(sessions)} active sessions, {sessions['bytes'].sum() / 2**20:.1f} MiB in total (approximate deep sizes)")
+    st.dataframe(sessions)
+
+    st.subheader("Cached Artifacts")
+    cached = [{"cache": f"{snap.source}@{snap.version}:{a['artifact']}", "bytes": a["bytes"]}
+              for snap in get_registry().snapshots() for a in snap.artifacts()]
+    cached.append({"cache": "logo", "bytes": len(logo)})
+    st.dataframe(pd.DataFrame(cached + streamlit_cache_stats()))
+
+    st.subheader("Largest Allocation Sites")
+    st.caption(f"tracemalloc runs {monitor.trace_window_s:.0f}s windows"
+               + (f" every {monitor.trace_every_s / 60:.0f} min" if monitor.trace_every_s > 0 else " on demand only")
+               + "; every request in the process runs several times slower while a window is open")
+    if monitor.tracing:
+        st.info("Tracing allocations now…")
+    elif st.button("Sample allocations now"):
+        monitor.sample_allocations_async()
+        st.info(f"Tracing for {monitor.trace_window_s:.0f}s — reload this page afterwards.")
+    windows = monitor.windows()
+    if not windows:
+        st.info("No allocation samples yet.")
+    else:
+        st.caption(f"Latest window, {datetime.fromtimestamp(windows[-1]['started']):%H:%M:%S}")
+        st.dataframe(pd.DataFrame(windows[-1]["sites"]))
+        st.caption(f"Across the last {len(windows)} windows")
+        st.dataframe(pd.DataFrame(monitor.top_sites()))
 
 st.set_page_config(page_title="LEXY... LexMedical AI Triage System", page_icon="🩺", layout="centered")
 
@@ -117,123 +303,177 @@ if 'matched_conditions' not in st.session_state:
 if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
 
-@st.cache_data
-def load_data():
-    df = pd.read_excel("SymptomBotDB.xlsx")
-    # ── Normalize every header: remove leading/trailing whitespace ──
-    df.columns = df.columns.str.strip()
-    return df
-# --- Free-text normalization driven by Excel (FreeTextMap sheet) ---
-
-@st.cache_data
-def load_freetext_map() -> dict:
+@st.cache_resource
+def get_registry() -> WorkbookRegistry:
+    """Process-wide tenant → workbook snapshot registry (see workbook.py), prebuilt by warmup.py."""
+    return default_registry()
+
+@st.cache_resource
+def get_profiler() -> RerunProfiler:
+    """Process-wide rerun profiler; off unless LEXAI_PROFILE_SAMPLE or the admin slider turns it on."""
+    return RerunProfiler()
+
+@st.cache_resource
+def get_rerun_meter() -> RerunMeter:
+    """Process-wide full/fragment rerun counts and CPU per completed triage."""
+    return RerunMeter()
+
+def metered(fn):
+    """fn counted as a fragment rerun when Streamlit runs it on its own."""
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        with get_rerun_meter().measure(session_id(), "fragment"):
+            return fn(*args, **kwargs)
+    return run
+
+def partial_rerun(fn):
     """
-    Reads SymptomBotDB.xlsx -> sheet 'FreeTextMap' with columns:
-      from_phrase, to_phrase  (case-insensitive)
-    Returns dict {from_phrase_lower: to_phrase_lower}.
-    If the sheet is missing, returns {} (no-op).
+    Widget changes inside fn rerun only fn (st.fragment), not the whole
+    script; navigation still calls st.rerun() for a full rerun.
     """
-    try:
-        df_map = pd.read_excel("SymptomBotDB.xlsx", sheet_name="FreeTextMap")
-        df_map.columns = df_map.columns.str.strip().str.lower()
-        if not {"from_phrase","to_phrase"}.issubset(df_map.columns):
-            return {}
-        # build lowercase map, drop blanks
-        m = {}
-        for _, r in df_map.iterrows():
-            fp = str(r["from_phrase"]).strip().lower()
-            tp = str(r["to_phrase"]).strip().lower()
-            if fp and tp and fp != "nan" and tp != "nan":
-                m[fp] = tp
-        return m
-    except Exception:
-        return {}
-
-FT_MAP = load_freetext_map()
-
-# c) fuzzy-stem match across token pairs (safer)
-def ok_pair(us, ds):
-    # ignore very short tokens for fuzzy; exact/substring already handled earlier
-    if len(us) < 4 or len(ds) < 4:
-        return False
-    # require same starting letter OR substring relation to avoid heart≈ear/hurt
-    if not (us[0] == ds[0] or us in ds or ds in us):
-        return False
-    return SequenceMatcher(None, us, ds).ratio() >= 0.80  # was 0.65
-
-
-def normalize_free_text(raw: str) -> str:
+    return st.fragment(metered(fn)) if FRAGMENTS else fn
+
+# Main path through the triage flow, in order (free-text pages are side branches)
+FUNNEL_STEPS = [
+    "welcome", "user_info", "symptom_category", "symptom_subcategory",
+    "symptom_selection", "clarifying_questions", "risk_flag_selection", "results",
+]
+
+@st.cache_resource
+def get_tracer() -> FunnelTracer:
+    """Process-wide page-visit tracer; spans are written by a background thread."""
+    return FunnelTracer(steps=FUNNEL_STEPS)
+
+@st.cache_resource
+def get_memory_monitor() -> MemoryMonitor:
+    """Process-wide RSS sampler and windowed tracemalloc (see memory.py)."""
+    return MemoryMonitor()
+
+@st.cache_resource
+def get_search_pool() -> ThreadPoolExecutor:
+    """Background threads for the full (fuzzy) free-text pass; admission.py decides how many run at once."""
+    return ThreadPoolExecutor(ADMISSION.concurrency + ADMISSION.queue, thread_name_prefix="free-text-search")
+
+@st.cache_resource
+def get_shadow() -> ShadowRunner:
+    """Candidate-matcher shadow runner; off unless LEXAI_SHADOW_ENGINE is set."""
+    return ShadowRunner()
+
+@st.cache_resource
+def get_prefetcher() -> Prefetcher:
+    """Process-wide pool for speculative next-page work; the futures live in each session (prefetch.py)."""
+    return Prefetcher()
+
+def prefetch_cache() -> SessionCache:
+    if "prefetch" not in st.session_state:
+        st.session_state.prefetch = SessionCache()
+    return st.session_state.prefetch
+
+def prefetch(jobs: dict):
+    """Start {key: fn} for the pages this one may lead to (fn runs off the script thread: no st.* calls)."""
+    get_prefetcher().prefetch(prefetch_cache(), st.session_state.page, jobs)
+
+def next_page_data(key: tuple, compute):
+    """This page's data for key: prefetched on the previous page if it was guessed, else compute()."""
+    return get_prefetcher().take(prefetch_cache(), st.session_state.page, key, compute)
+
+@st.cache_resource
+def get_recorder() -> TrafficRecorder:
+    """Free-text traffic recorder; off unless LEXAI_RECORD_SAMPLE is set."""
+    return TrafficRecorder()
+
+def session_id() -> str:
+    """The partner's ?session_id= if given, else Streamlit's own session id."""
+    sid = st.query_params.get("session_id") if hasattr(st, "query_params") else None
+    if sid:
+        return sid
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else "local"
+
+def load_snapshot() -> Snapshot:
     """
-    Minimal, safe normalization:
-      - lowercase + trim
-      - unify curly quotes
-      - apply FreeTextMap replacements (longest-first)
-      - a couple high-impact typo/alias fixes
-    Returns a SINGLE normalized string you feed into your existing matcher.
+    Workbook snapshot for this session's tenant. The tenant is resolved once per
+    session from the iframe params (?tenant= / ?api_key=) or the embedding origin.
     """
-    if not raw:
-        return ""
-    text = raw.strip().lower()
+    registry = get_registry()
+    if "tenant" not in st.session_state:
+        params  = st.query_params.to_dict() if hasattr(st, "query_params") else {}
+        headers = dict(st.context.headers) if hasattr(st, "context") else {}
+        st.session_state.tenant = registry.resolve_tenant(params, headers)
+    return registry.snapshot(st.session_state.tenant)
 
-    # normalize curly quotes to ascii to avoid miss matches
-    text = (text
-            .replace("’", "'")
-            .replace("‘", "'")
-            .replace("“", '"')
-            .replace("”", '"'))
-
-    # tiny typo fix that bites often
-    text = text.replace("heatbeat", "heartbeat")
-
-    # Apply Excel-driven phrase replacements, longest keys first to avoid partial shadowing
-    if FT_MAP:
-        for k in sorted(FT_MAP.keys(), key=len, reverse=True):
-            if k in text:
-                text = text.replace(k, FT_MAP[k])
-
-    return text
+# --- Free-text normalization driven by Excel (FreeTextMap sheet) ---
 
+SNAPSHOT = load_snapshot()
+FT_MAP = SNAPSHOT.ft_map
 
-def load_logo():
-    return Image.open("logo.png")
+def log_template_problems(snapshot: Snapshot) -> bool:
+    """
+    Placeholder typos found when the templates were compiled go to the failure
+    log (and the analytics page) once per snapshot, instead of raising KeyError
+    on a patient's results page.
+    """
+    problems = snapshot.derived("template_problems", lambda s: compile_recommendations(s.db)[1])
+    for p in problems:
+        log_failure({
+            "timestamp": datetime.utcnow().isoformat(),
+            "step":      "template_compile",
+            "input":     f"[{snapshot.version}] {p['condition']} / {p['column']}",
+            "reason":    p["error"],
+        })
+    return True
 
-db = load_data()
+db = SNAPSHOT.db
 logo = load_logo()
+RECS = SNAPSHOT.derived("recommendations", build_recommendations)
+SNAPSHOT.derived("template_problems_logged", log_template_problems)
 
 # --- UTILITY FUNCTIONS ---
 
 
 def is_gender_allowed(primary_category, gender, suppress_error=False):
-    primary_category = primary_category.replace("’", "'")
-    WOMEN_SPECIFIC = {
-        "Women's Health", "Pelvic Inflammatory Disease", "Breast Lump",
-        "Cervical Cancer", "Menopause", "Fibroids", "Heavy Menstrual Bleeding",
-        "Yeast Infection", "Bacterial Vaginosis", "Endometriosis", "PCOS",
-        "Pelvic Organ Prolapse", "Ovarian Cyst", "Ectopic Pregnancy"
-    }
-    MEN_SPECIFIC = {
-        "Men's Health", "Prostatitis", "Testicular Torsion",
-        "Benign Prostatic Hyperplasia", "Varicocele", "Balanitis"
-    }
-    if gender == "Male" and primary_category in WOMEN_SPECIFIC:
-        if not suppress_error:
-            st.error("This category is not available for your selected gender")
-        return False
-    if gender == "Female" and primary_category in MEN_SPECIFIC:
-        if not suppress_error:
-            st.error("This category is not available for your selected gender")
-        return False
-    return True
+    if gender_allowed(primary_category, gender):
+        return True
+    if not suppress_error:
+        st.error("This category is not available for your selected gender")
+    return False
+
+PARTITIONS    = SNAPSHOT.derived("partitions", build_partitions)
+SUBCATEGORIES = SNAPSHOT.derived("subcategories", build_subcategories)
+VOCAB         = SNAPSHOT.derived("vocabularies", build_vocabularies)
+DECISIONS     = SNAPSHOT.derived("decision_table", build_decision_table)
+SUGGEST       = SNAPSHOT.derived("suggest_index", build_suggest_index)
+SYMPTOM_MASKS = SNAPSHOT.derived("symptom_masks", build_symptom_masks)
+
+def patient_partition() -> dict:
+    """The partition for this session's gender and age band (unfiltered if unknown)."""
+    user = st.session_state.user_data
+    return PARTITIONS.get((user.get("gender"), age_band(user.get("age"))), PARTITIONS[None])
+
+# --- Pathway page data (computed on click, or ahead of it by the prefetcher) ---
+
+def pathway_source() -> pd.DataFrame:
+    """The rows the pathway pages filter: this session's free-text matches, or the whole workbook."""
+    return st.session_state.matched_conditions if st.session_state.get("free_input_mode", False) else db
+
+def pathway_key(page: str, *parts) -> tuple:
+    """Prefetch key: target page, workbook version, which free-text match set, then parts."""
+    source = pathway_source()
+    return (page, SNAPSHOT.version, None if source is db else id(source), *parts)
 
-def display_grid(items, cols=3):
-    rows = [items[i:i + cols] for i in range(0, len(items), cols)]
-    for row in rows:
-        columns = st.columns(len(row))
-        for col, item in zip(columns, row):
-            with col:
-                if st.button(item, use_container_width=True):
-                    return item
-    return None
+def symptom_page_data(snapshot, source, primary, sub) -> dict:
+    subset = pathway_rows(source, primary, sub)
+    return {"subset": subset, "options": symptom_options(snapshot, subset.index)}
+
+def question_page_data(source, primary, sub) -> dict:
+    subset = pathway_rows(source, primary, sub)
+    return {"subset": subset,
+            "cq1": list(subset["Clarifying Questions 1"].dropna().unique()),
+            "cq2": list(subset["Clarifying Questions2"].dropna().unique())}
+
+def risk_page_data(masks, source, primary, sub, selected) -> dict:
+    return {"subset": pathway_rows(source, primary, sub),
+            "scores": symptom_scores(masks.get((primary, sub)), selected)}
 
 def generate_report():
     condition = st.session_state.current_condition
@@ -453,21 +693,11 @@ def symptom_category_page():
         st.error("Gender not selected. Please go back.")
         return
     
-    # ─── 2b) Age-aware category list (hide Pediatrics for 15+) ───
-    current_age = st.session_state.user_data.get('age')
-
-    valid_categories = []
-    for cat in db["Primary Category"].unique():
-
-        # Hide Pediatrics for ages 15+
-        if (current_age is not None) and (current_age >= 15) and str(cat).strip().lower() == "pediatrics":
-            continue
-        if is_gender_allowed(cat, current_gender, suppress_error=True):
-            valid_categories.append(cat)
+    # ─── 2b) Age-aware category list (hide Pediatrics for 15+), precomputed per snapshot ───
+    valid_categories = patient_partition()["categories"]
 
-   
-    # ─── 3) Render your 3-col grid via display_grid ───
-    selected = display_grid(valid_categories, cols=3)
+    # ─── 3) Render your 3-col grid via display_grid (searchable/paged when long) ───
+    selected = display_grid(valid_categories, cols=3, key="category_grid")
 
     # ─── 4) Handle a valid selection ───
     if selected and is_gender_allowed(selected, current_gender):
@@ -487,6 +717,118 @@ def symptom_category_page():
         st.session_state.page = "user_info"
         st.rerun()
 
+def _search_job(snapshot, text: str, gender, age) -> tuple:
+    """Pool job: admitted_match() and the matcher's own time in ms (no queue, polling or rerun)."""
+    t0 = time.perf_counter()
+    rows, status = admitted_match(snapshot, text, gender, age)
+    return rows, status, (time.perf_counter() - t0) * 1000
+
+
+def _start_free_search(raw_input: str, text: str, t0: float) -> list:
+    """
+    Exact + stem matches right away; the full pipeline (fuzzy included,
+    admission-controlled) runs on the search pool and is picked up by
+    _finish_free_search() from a polling fragment.
+    """
+    user = st.session_state.user_data
+    gender, age = user.get("gender"), user.get("age")
+    fast, _ = match_rows(SNAPSHOT, text, gender, age, fuzzy=False, record=False)
+    st.session_state.free_search = {
+        "raw": raw_input, "text": text, "t0": t0, "fast": fast,
+        "first_ms": (time.perf_counter() - t0) * 1000 if fast else None,
+        # a sampled rerun's profile also gets the matcher's time on the pool (profiling.py)
+        "future": get_search_pool().submit(get_profiler().job(_search_job), SNAPSHOT, text, gender, age),
+    }
+    return fast
+
+
+def _finish_free_search(wait: bool = False):
+    """(rows, status, search) once the background search is done, else None."""
+    search = st.session_state.get("free_search")
+    if search is None or not (wait or search["future"].done()):
+        return None
+    del st.session_state["free_search"]
+    try:
+        rows, status, match_ms = search["future"].result()
+    except Exception as e:
+        # e.g. a shard worker or the pool died: log it, the patient gets "busy, try again"
+        log_failure({
+            "timestamp": datetime.utcnow().isoformat(),
+            "step":      "free_text_match",
+            "input":     search["text"],
+            "reason":    f"search_error: {type(e).__name__}: {e}",
+        })
+        rows, status, match_ms = [], "error", None
+    complete_ms = (time.perf_counter() - search["t0"]) * 1000
+    if status != "ok":
+        # overloaded: keep what the fast pass already found
+        rows = sorted(set(rows) | set(search["fast"]))
+        status = "degraded" if rows else status
+    TIMINGS.add(search["first_ms"], complete_ms, len(rows) > len(search["fast"]))
+
+    if status == "ok":
+        # replay and shadow compare matcher time against matcher time, not poll + rerun
+        user = st.session_state.user_data
+        # Opt-in, anonymized capture for replay.py regression runs (full results only)
+        recorder = get_recorder()
+        if recorder.should_record():
+            recorder.record(
+                SNAPSHOT.version, user.get("gender"), age_band(user.get("age")),
+                search["raw"], search["text"], rows, db.loc[rows, "Condition"].tolist(), match_ms,
+            )
+        # Shadow run of a candidate matcher (LEXAI_SHADOW_ENGINE), off the request path
+        get_shadow().submit(SNAPSHOT, user.get("gender"), user.get("age"),
+                            search["raw"], search["text"], rows, match_ms)
+    return rows, status, search
+
+
+def _apply_free_matches(rows: list, text: str, degraded: bool = False):
+    st.session_state.free_input_mode            = True
+    st.session_state.matched_conditions         = db.loc[sorted(rows)]
+    st.session_state.user_data['free_symptoms'] = text
+    st.session_state.user_data['free_degraded'] = degraded
+    st.session_state.pop("did_you_mean", None)
+
+
+def _free_search_progress():
+    # 🔹 Partial-rerun region: polls the background search, full rerun once it is done
+    done = _finish_free_search()
+    if done is None:
+        st.caption("🔎 Searching for close spellings…")
+        return
+    rows, status, search = done
+    if rows:
+        _apply_free_matches(rows, search["text"], status == "degraded")
+        st.session_state.page = "symptom_primary_category_freeinput"
+    else:
+        st.session_state.free_outcome = {"status": status, "text": search["text"]}
+    st.rerun()
+
+
+def _corrections(raw: str, limit: int = 6) -> list:
+    """The input with one part replaced by a close workbook phrase (suggest.py), for "Did you mean"."""
+    parts = [p.strip() for p in raw.replace(";", ",").split(",") if p.strip()]
+    options = []
+    for i, part in enumerate(parts):
+        found = SUGGEST.suggest(part, 3)
+        if found and found[0] != part.lower():
+            options += [", ".join(parts[:i] + [s] + parts[i + 1:]) for s in found]
+    return options[:limit]
+
+
+def _did_you_mean():
+    # 🔹 One-click corrections instead of retyping; kept until the next search so the click lands
+    options = st.session_state.get("did_you_mean")
+    if not options:
+        return
+    st.markdown("**Did you mean:**")
+    for n, text in enumerate(options):
+        if st.button(text, key=f"did_you_mean_{n}"):
+            st.session_state.pop("free_search", None)
+            st.session_state.free_retry = text
+            st.rerun()
+
+
 def symptom_free_input_page():
     st.image(logo, width=80)
     st.subheader("What are your symptoms?")
@@ -497,176 +839,126 @@ def symptom_free_input_page():
         symptom_input = st.text_input("Your symptoms:")
         search = st.form_submit_button("Search Symptoms")
 
+    retry = st.session_state.pop("free_retry", None)   # a "Did you mean" pick
+    if retry:
+        symptom_input, search = retry, True
+
     if search:
         if not symptom_input.strip():
             st.warning("Please enter at least one symptom to search.")
         else:
 
+            raw_input = symptom_input
+            t0 = time.perf_counter()
+            st.session_state.pop("did_you_mean", None)
+
             # 🔹 Normalize once using the Excel FreeTextMap (and tiny typo fixes)
-            symptom_input = normalize_free_text(symptom_input)
-
-            # st.caption(f"normalized: {symptom_input}")
-
-            # 1) Normalize & split on commas
-            inputs = [p.strip().lower() for p in symptom_input.split(",") if p.strip()]
-
-            # 2) Tokenize the entire free-text into words ≥3 letters
-            user_tokens = re.findall(r"[A-Za-z]{3,}", symptom_input.lower())
-            user_stems = [stem(tok) for tok in user_tokens]
-            user_stems += [
-                                        s[:-1] + ("y" if s.endswith("i") else "i")
-                                       for s in user_stems
-                                       if s.endswith(("i","y"))
-                              ]
-            user_stems = list(set(user_stems))
-
-            matches   = set()
-            threshold = 0.65
-
-            # 3) Scan every DB row
-            for idx, row in db.iterrows():
-                # consider each symptom entry, splitting on commas or semicolons
-                for raw_sym in re.split(r"[,;]", str(row["Symptoms"])):
-                    sym_clean = raw_sym.strip().lower()
-                    if not sym_clean:
-                        continue
-
-                    
-                    # split into words ≥3 letters and stem each
-                    sym_tokens = re.findall(r"[A-Za-z]{3,}", sym_clean)
-                                                  # generate stems + alternate i<->y forms for dizzy↔dizzi
-                    sym_stems = [stem(tok) for tok in sym_tokens]
-                    sym_stems += [
-                                                           s[:-1] + ("y" if s.endswith("i") else "i")
-                                                           for s in sym_stems
-                                                          if s.endswith(("i","y"))
-                                                  ]
-                    sym_stems = list(set(sym_stems))
-
-                    # Remove generic stems for fallback matching
-                    generic_stems = {stem(t) for t in GENERIC_TOKENS}
-                    filtered_user_tokens = [t for t in user_tokens if t not in GENERIC_TOKENS]
-                    filtered_user_stems  = [s for s in user_stems if s not in generic_stems]
-
-
-                    # a) substring match: require either a specific token, or generic+specific together
-                    has_specific = any(tok in sym_clean for tok in filtered_user_tokens)
-                    has_generic  = any(tok in sym_clean for tok in GENERIC_TOKENS)
-                    user_used_generic = any(t in GENERIC_TOKENS for t in user_tokens)
-
-                    if user_used_generic and filtered_user_tokens:
-                        # Require BOTH specific and generic in the same phrase (e.g., 'back' + 'pain')
-                        if has_specific and has_generic:
-                            matches.add(idx)
-                            break
-                    else:
-                        # If user didn’t type a generic, allow matching on specifics alone.
-                        # If the user typed ONLY a generic (e.g., "pain"), still allow that generic match.
-                        if has_specific or (not filtered_user_tokens and has_generic):
-                            matches.add(idx)
-                            break
-
-                    # b) exact stem match: require generic co-occurrence if user typed a generic+specific
-                    if user_used_generic and filtered_user_tokens and not has_generic:
-                        pass  # skip this phrase; no generic here
-                    elif any(us == ds for us in filtered_user_stems for ds in sym_stems):
-                        matches.add(idx)
-                        break
-
-                    # c) fuzzy-stem match across token pairs (safer)
-                    def ok_pair(us, ds):
-                        # ignore very short tokens for fuzzy; exact/substring were checked earlier
-                        if len(us) < 4 or len(ds) < 4:
-                            return False
-                        # avoid heart≈ear/hurt: require same first letter OR substring relation
-                        if not (us[0] == ds[0] or us in ds or ds in us):
-                            return False
-                        # tighter similarity threshold
-                        return SequenceMatcher(None, us, ds).ratio() >= 0.80
-
-                    # keep your co-occurrence guard: if user typed a generic+specific but this phrase
-                    # lacks the generic term, don't allow fuzzy to pull it in
-                    if user_used_generic and filtered_user_tokens and not has_generic:
-                        pass
-                    elif any(ok_pair(us, ds) for us in filtered_user_stems for ds in sym_stems):
-                        matches.add(idx)
-                        break
-
-                # end raw_sym loop
-                # if we matched this row, stop checking it
-                if idx in matches:
-                    continue
-
-            # 4) Build subset and handle no-matches
-            subset = db.loc[sorted(matches)]
-            if subset.empty:
-                from datetime import datetime
-                log_failure({
-                    "timestamp": datetime.utcnow().isoformat(),
-                    "step":      "free_text_match",
-                    "input":     symptom_input,
-                    "reason":    "no_symptom_match"
-                })
-                st.warning(
-                    "❗️ No matches found. Check spelling, try again, or speak to a doctor."
-                )
-                if st.button("Try Again"):
-                    st.rerun()
-                if st.button("Speak to a Doctor"):
-                    st.session_state.page = "fallback_page"
-                    st.rerun()
-                if st.button("Start Over"):
-                    st.session_state.clear()
-                    st.session_state.page = "welcome"
-                    st.rerun()
-                return
-
-            # 5) Save matches & advance
-            st.session_state.free_input_mode            = True
-            st.session_state.matched_conditions         = subset
-            st.session_state.user_data['free_symptoms'] = symptom_input
-            st.session_state.page                       = "symptom_primary_category_freeinput"
+            symptom_input = normalize_free_text(symptom_input, FT_MAP)
+
+            # 1) Match only against rows this patient can be shown (demographic partition):
+            #    exact/stem matches now, fuzzy ones are merged in when the background pass ends
+            fast = _start_free_search(raw_input, symptom_input, t0)
+            if fast:
+                _apply_free_matches(fast, symptom_input)
+                st.session_state.page = "symptom_primary_category_freeinput"
+                st.rerun()
+            # nothing exact: offer close vocabulary phrases while the fuzzy pass runs
+            st.session_state.did_you_mean = _corrections(raw_input)
+
+    _did_you_mean()
+
+    # 2) Nothing exact: wait here for the fuzzy pass
+    if st.session_state.get("free_search"):
+        st.fragment(metered(_free_search_progress), run_every=PROGRESS_POLL_S)()
+
+    outcome = st.session_state.pop("free_outcome", None)
+    if outcome and outcome["status"] != "ok":
+        # 🔹 Overloaded: an empty result isn't a real "no match", so ask for a retry
+        st.warning("⏳ We're busy right now and couldn't finish your search. Please try again in a moment.")
+        if st.button("Try Again"):
+            st.rerun()
+    elif outcome:
+        from datetime import datetime
+        log_failure({
+            "timestamp": datetime.utcnow().isoformat(),
+            "step":      "free_text_match",
+            "input":     outcome["text"],
+            "reason":    "no_symptom_match"
+        })
+        st.warning(
+            "❗️ No matches found. Check spelling, try again, or speak to a doctor."
+        )
+        if st.button("Try Again"):
+            st.rerun()
+        if st.button("Speak to a Doctor"):
+            st.session_state.page = "fallback_page"
+            st.rerun()
+        if st.button("Start Over"):
+            st.session_state.clear()
+            st.session_state.page = "welcome"
             st.rerun()
 
     # — Back button outside the form —
     if st.button("← Back"):
+        st.session_state.pop("free_search", None)
+        st.session_state.pop("did_you_mean", None)
         st.session_state.page = "symptom_category"
         st.rerun()
 
 
-def symptom_primary_category_freeinput_page():
-    # ── Guard: only allow free-text category pick when we actually have matches ──
-    if not st.session_state.get("free_input_mode") or st.session_state.matched_conditions.empty:
-        # fall back to the normal category picker
-        st.session_state.page = "symptom_category"
-        st.rerun()
-
-    st.image(logo, width=80)
-    st.subheader("What feels closest to how you’re feeling?")
+def _freeinput_categories():
+    # 🔹 Partial-rerun region while the fuzzy pass is still running
+    pending = st.session_state.get("free_search")
+    if pending:
+        done = _finish_free_search()
+        if done is not None:
+            rows, status, search = done
+            _apply_free_matches(rows, search["text"], status == "degraded")
+            st.rerun()
 
     # now safe: we know matched_conditions exists and has columns
     subset = st.session_state.matched_conditions
-    current_gender = st.session_state.user_data.get('gender')
-    current_age    = st.session_state.user_data.get('age')
+    if pending:
+        st.caption("🔎 Looking for more matches…")
+    elif st.session_state.user_data.get("free_degraded"):
+        st.caption("Showing quick matches only — some close spellings may be missing. Search again for full results.")
 
-    # Hide Pediatrics for ages 15+
+    # Hide Pediatrics for ages 15+ and respect gender gating (precomputed allow-list)
+    allowed = set(patient_partition()["categories"])
     primaries = [
         cat for cat in sorted(subset["Primary Category"].dropna().unique())
-        if (
-            # keep Pediatrics only if age < 15
-            not ((current_age is not None) and (current_age >= 15) and str(cat).strip().lower() == "pediatrics")
-            # still respect gender gating
-            and is_gender_allowed(cat, current_gender, suppress_error=True)
-        )
+        if cat in allowed
     ]
-    choice = display_grid(primaries, cols=2)
+    choice = display_grid(primaries, cols=2, key="freeinput_category_grid")
     if choice:
+        # picked before the fuzzy pass ended: merge it in first, the next pages filter on it
+        done = _finish_free_search(wait=True)
+        if done is not None:
+            rows, status, search = done
+            _apply_free_matches(rows, search["text"], status == "degraded")
         st.session_state.user_data['primary_category'] = choice
         st.session_state.page = "symptom_subcategory"
         st.rerun()
 
+
+def symptom_primary_category_freeinput_page():
+    # ── Guard: only allow free-text category pick when we actually have matches ──
+    if not st.session_state.get("free_input_mode") or st.session_state.matched_conditions.empty:
+        # fall back to the normal category picker
+        st.session_state.page = "symptom_category"
+        st.rerun()
+
+    st.image(logo, width=80)
+    st.subheader("What feels closest to how you’re feeling?")
+
+    if st.session_state.get("free_search"):
+        st.fragment(metered(_freeinput_categories), run_every=PROGRESS_POLL_S)()
+    else:
+        _freeinput_categories()
+
     if st.button("← Back"):
         # Back one step in the free-text flow
+        st.session_state.pop("free_search", None)
         st.session_state.page = "symptom_free_input"
         st.rerun()
 
@@ -696,14 +988,22 @@ def symptom_subcategory_page():
         else db
     )
     filtered = source[source["Primary Category"] == primary]
-    subcats = sorted(filtered["SubCategory"].dropna().unique())
-    choice = display_grid(subcats, cols=2)
+    if st.session_state.get("free_input_mode", False):
+        subcats = sorted(filtered["SubCategory"].dropna().unique())
+    else:
+        subcats = SUBCATEGORIES.get(primary, [])
+    choice = display_grid(subcats, cols=2, key="subcategory_grid")
     if choice:
         st.session_state.user_data["subcategory"] = choice
         st.session_state.current_condition = filtered[filtered["SubCategory"] == choice].iloc[0]
         st.session_state.page = "symptom_selection"
         st.rerun()
 
+    # 🔹 While they read: the symptom menu behind every visible button, ahead of the click
+    prefetch({pathway_key("symptom_selection", primary, sub):
+              functools.partial(symptom_page_data, SNAPSHOT, source, primary, sub)
+              for sub in shown_items("subcategory_grid")})
+
     if st.button("← Back"):
         st.session_state.page = (
             "symptom_primary_category_freeinput"
@@ -727,22 +1027,23 @@ def symptom_selection_page():
         return
 
     # 1) Decide source: full DB for normal, matched_conditions for free-text
-    source = st.session_state.matched_conditions if st.session_state.get("free_input_mode") else db
+    source = pathway_source()
 
-    # 2) Filter to your chosen subcategory
-    subset = source[
-        (source["Primary Category"] == primary) &
-        (source["SubCategory"]      == subcat)
-    ]
+    # 2)+3) Filter to your chosen subcategory and aggregate **all** symptoms across those rows
+    #       (usually prefetched while the subcategory menu was shown)
+    data = next_page_data(pathway_key("symptom_selection", primary, subcat),
+                          lambda: symptom_page_data(SNAPSHOT, source, primary, subcat))
+    options = data["options"]
 
-    # 3) Aggregate **all** symptoms across those rows
-    options = sorted({
-        s.strip()
-        for row in subset["Symptoms"].dropna()
-        for s   in row.split(",")
-    })
+    # 4) Render them (changing the selection reruns only this part)
+    _symptom_picker(options)
 
-    # 4) Render them
+    # 🔹 Next up: this pathway's clarifying questions
+    prefetch({pathway_key("clarifying_questions", primary, subcat):
+              functools.partial(question_page_data, source, primary, subcat)})
+
+@partial_rerun
+def _symptom_picker(options):
     selected = st.multiselect("Select all that apply:", options)
 
     # 5) Navigation
@@ -766,13 +1067,12 @@ def clarifying_questions_page():
     subcat  = st.session_state.user_data.get("subcategory")
 
     # pick source: full DB if normal, else your matched free-text subset
-    source = db if not st.session_state.get("free_input_mode", False) else st.session_state.matched_conditions
+    source = pathway_source()
 
-    # filter to the chosen primary/subcategory
-    subset = source[
-        (source["Primary Category"] == primary) &
-        (source["SubCategory"]      == subcat)
-    ]
+    # filter to the chosen primary/subcategory (prefetched on the symptom page)
+    data = next_page_data(pathway_key("clarifying_questions", primary, subcat),
+                          lambda: question_page_data(source, primary, subcat))
+    subset = data["subset"]
     if subset.empty:
         st.error("No conditions found here—please start over.")
         if st.button("Start Over"):
@@ -781,9 +1081,14 @@ def clarifying_questions_page():
             st.rerun()
         return
 
+    # 🔹 Next up: symptom scores and candidate rows for the risk-flag page
+    selected = st.session_state.user_data.get("selected_symptoms")
+    prefetch({pathway_key("risk_flag_selection", primary, subcat, tuple(selected or ())):
+              functools.partial(risk_page_data, SYMPTOM_MASKS, source, primary, subcat, selected)})
+
     # 2️⃣ Stage 1: ask every unique CQ1 in this subset
     if not st.session_state.get("cq1_done"):
-        cq1s    = list(subset["Clarifying Questions 1"].dropna().unique())
+        cq1s    = data["cq1"]
         answers1 = {}
         with st.form("cq1_form"):
             for i, q in enumerate(cq1s, 1):
@@ -806,7 +1111,7 @@ def clarifying_questions_page():
     # 3️⃣ Stage 2: only if any CQ1 was “Yes”
     answers1 = st.session_state.user_data.get("answers1", {})
     if any(v == "Yes" for v in answers1.values()):
-        cq2s     = list(subset["Clarifying Questions2"].dropna().unique())
+        cq2s     = data["cq2"]
         answers2 = {}
         with st.form("cq2_form"):
             for j, q in enumerate(cq2s, 1):
@@ -834,49 +1139,41 @@ def risk_flag_selection_page():
     st.image(logo, width=80)
     st.subheader("These factors can affect your care. Select any that apply, or “None.”")
 
-    # ── 1) Build the subset of candidate conditions ──
-    cat    = st.session_state.user_data.get("primary_category")
-    sub    = st.session_state.user_data.get("subcategory")
-    source = (
-        st.session_state.matched_conditions
-        if st.session_state.get("free_input_mode", False)
-        else db
-    )
-    subset = source[
-        (source["Primary Category"] == cat) &
-        (source["SubCategory"]      == sub)
-    ]
-    if subset.empty:
-        st.error("No conditions found here—please start over.")
-        return
-
-    # ── 2) Map CQ2 “Yes” answers back to rows ──
+    cat     = st.session_state.user_data.get("primary_category")
+    sub     = st.session_state.user_data.get("subcategory")
     answers = st.session_state.user_data.get("clarifying_answers", {})
-    flagged = []
-    for idx, row in subset.iterrows():
-        q2 = row["Clarifying Questions2"]
-        if pd.notna(q2) and answers.get(q2) == "Yes":
-            flagged.append(idx)
-
-    # ── 3) Triaging logic, always run ──
-    if len(flagged) == 1:
-        chosen_idx = flagged[0]
-    elif len(flagged) > 1:
-        df_flagged = subset.loc[flagged].copy()
-        df_flagged["Acuity Level"] = df_flagged["Acuity Level"].astype(int)
-        chosen_idx = df_flagged["Acuity Level"].idxmax()
+    # 🔹 How well each condition of the pathway fits the symptoms ticked earlier (bitmasks),
+    #    usually prefetched while the clarifying questions were answered
+    selected = st.session_state.user_data.get("selected_symptoms")
+    source   = pathway_source()
+    data     = next_page_data(pathway_key("risk_flag_selection", cat, sub, tuple(selected or ())),
+                              lambda: risk_page_data(SYMPTOM_MASKS, source, cat, sub, selected))
+    scores   = data["scores"]
+
+    # ── 1) Category mode: look the outcome up in the precompiled decision table ──
+    decision = (None if st.session_state.get("free_input_mode", False)
+                else decide(DECISIONS, cat, sub, answers, scores=scores))
+    if decision is not None:
+        chosen_idx = decision[0]
+        st.session_state.current_condition = db.loc[chosen_idx]
     else:
-        subset["Acuity Level"] = subset["Acuity Level"].astype(int)
-        chosen_idx = subset["Acuity Level"].idxmax()
+        # ── 2) Free text (or an untabled pathway): the subset of candidate conditions ──
+        subset = data["subset"]
+        if subset.empty:
+            st.error("No conditions found here—please start over.")
+            return
 
-    # ── 4) Save the final condition ──
-    st.session_state.current_condition = subset.loc[chosen_idx]
+        # Triaging logic: CQ2 “Yes” answers, then highest acuity (symptom matches only break ties)
+        chosen_idx = choose_condition(subset, answers, scores)
 
-    # ── 5) Render its RiskFlags ──
-    cond = st.session_state.current_condition
-    raw = str(cond.get("RiskFlags", "") or "")
-    flags = [f.strip() for f in raw.split(",") if f.strip()]
+        # ── 3) Save the final condition ──
+        st.session_state.current_condition = subset.loc[chosen_idx]
 
+    # ── 4) Render its RiskFlags (ticking a box reruns only the checklist) ──
+    _risk_flag_checklist(VOCAB["risk_flags"].get(chosen_idx, ()))
+
+@partial_rerun
+def _risk_flag_checklist(flags):
     selected = []
     for flag in flags:
         if st.checkbox(flag, key=f"rf_{flag}"):
@@ -886,7 +1183,7 @@ def risk_flag_selection_page():
     if none and selected:
         st.warning("“None” cannot be combined with other selections; only “None” will be used.")
 
-    # ── 6) Continue → record and go to Results ──
+    # ── 5) Continue → record and go to Results ──
     if st.button("Continue"):
         st.session_state.user_data["confirmed_risks"] = [] if none else selected
         st.session_state.page = "results"
@@ -899,120 +1196,6 @@ def risk_flag_selection_page():
 
 
 
-import re
-
-def evaluate_rule(rule_str: str, condition: dict, user_data: dict) -> bool:
-    """
-    Evaluate a rule like:
-      (symptom == itchy eyes AND cq1 == yes)
-      OR risk_flag == Chronic (>6 weeks)
-    by checking:
-      - whether 'itchy eyes' is listed in condition['Symptoms']
-      - whether user_data['clarifying_answers']['cq1'] == 'Yes'
-      - whether 'Chronic (>6 weeks)' is listed in condition['RiskFlags']
-    """
-    # Pre-split the human lists
-    syms = [s.strip().lower() for s in condition.get("Symptoms", "").split(",")]
-    rfs  = [r.strip().lower() for r in condition.get("RiskFlags", "").split(",")]
-
-    # Helper to evaluate a single atom
-    def eval_atom(atom: str) -> bool:
-        atom = atom.strip()
-
-        # symptom == X
-        m = re.match(r"^symptom\s*==\s*(.+)$", atom, re.IGNORECASE)
-        if m:
-            value = m.group(1).strip().lower()
-            return value in syms
-
-        # risk_flag == Y
-        m = re.match(r"^risk_flag\s*==\s*(.+)$", atom, re.IGNORECASE)
-        if m:
-            value = m.group(1).strip().lower()
-            return value in rfs
-
-        # cqN == yes → just check answer for question N
-        m = re.match(r"^cq(\d+)\s*==\s*yes$", atom, re.IGNORECASE)
-        if m:
-            idx = int(m.group(1))
-            return user_data.get("clarifying_answers", {})\
-                            .get(f"cq{idx}", "").strip().lower() == "yes"
-
-        # Unknown atom → False
-        return False
-
-    # Tokenize rule_str into parentheses, AND, OR, or atoms
-    parts = re.split(r"(\bAND\b|\bOR\b|\(|\))", rule_str, flags=re.IGNORECASE)
-    expr = ""
-    for part in parts:
-        part_strip = part.strip()
-        if re.fullmatch(r"AND", part_strip, re.IGNORECASE):
-            expr += " and "
-        elif re.fullmatch(r"OR", part_strip, re.IGNORECASE):
-            expr += " or "
-        elif part_strip in ("(", ")"):
-            expr += part_strip
-        elif part_strip:
-            # It's an atom
-            expr += str(eval_atom(part_strip))
-
-    # Finally, eval the boolean Python expression
-    try:
-        return bool(eval(expr))
-    except Exception:
-        return False
-
-
-def make_recommendation(condition: dict, user_flags: dict, risk_flags: list) -> str:
-    # Determine escalation
-    acuity = condition.get("Acuity Level", 0)
-    is_esc = bool(risk_flags) or (acuity == 3)
-
-    # Confidence guard
-    conf = condition.get("Labeling Confidence", "Low")
-    if conf == "Low":
-        return ""
-
-    # Rule match guard (allow escalation)
-    rule_ok = evaluate_rule(
-                    condition["Labeling Rule"],
-                    condition,
-                    st.session_state.user_data
-    )
-
-    # Certainty phrase
-    certainty = "very likely" if conf == "High" else "symptoms suggest"
-
-    # Pick templates
-    if is_esc:
-        base_tmpl = condition.get("Escalated Narrative Template (Risk Flags Present)", "")
-        rec_text = condition.get("Escalated Recommendation", "")
-    else:
-        base_tmpl = condition.get("Default Narrative Template", "")
-        rec_text = condition.get("Default Recommendation", "")
-
-    # Render base with placeholders
-    base = base_tmpl.format(
-        certainty=certainty,
-        risk_flags=", ".join(risk_flags),
-        default_rec=condition.get("Default Recommendation", ""),
-        escalated_rec=condition.get("Escalated Recommendation", "")
-    )
-
-    # Build recommendation without duplication
-    if ('{default_rec}' in base_tmpl) or ('{escalated_rec}' in base_tmpl):
-        recommendation = base
-    else:
-        recommendation = f"{base} {rec_text}".strip()
-
-     #Append emergency note marker
-    note = condition.get("Emergency Narrative (If Applicable)", "").strip()
-    if note:
-        recommendation += f"\n\n🚨 Important: {note}"
-
-    return recommendation
-
-
 def results_page():
     # Header and Title
     st.image(logo, width=80)
@@ -1042,63 +1225,22 @@ def results_page():
     raw_flags  = st.session_state.user_data.get("confirmed_risks", [])
     risk_flags = [rf.strip() for rf in raw_flags if isinstance(rf, str) and rf.strip()]
 
-    # ——— Assemble user_flags with normalized keys ———
-    user_data  = st.session_state.user_data
-    user_flags = {}
+    # Your escalation rule for card color:
+    is_esc = (baseline_rank == 3) or bool(risk_flags)
 
-    # 1) Symptoms from selected_symptom
-    for sym in user_data.get("selected_symptoms", []):
-        key = sym.strip().lower().replace(" ", "_")
-        user_flags[key] = True
-
-    # 2) Clarifiers from clarifying_answers
-    for question, ans in user_data.get("clarifying_answers", {}).items():
-        if ans == "Yes":
-            key = question.strip().lower().replace(" ", "_")
-            user_flags[key] = True
-
-    # 3) Risk flags
-    for rf in risk_flags:
-        key = rf.strip().lower().replace(" ", "_")
-        user_flags[key] = True
-
-    # Generate recommendation (string may include an appended emergency line in older builds)
-    recommendation = make_recommendation(condition, user_flags, risk_flags)
+    # Precompiled row → cached (card, emergency) HTML; compile on the fly only
+    # if this row isn't in the table (e.g. the workbook changed under the session)
+    compiled = RECS.get(condition.name)
+    if compiled is None or compiled.name != str(condition.get("Condition", "")):
+        compiled = CompiledCondition(condition)
+    card_html, emergency_html = compiled.fragments(risk_flags, is_esc)
 
     # Display recommendation or fallback with styled blocks
-    if recommendation:
-        # Your escalation rule for card color:
-        is_esc = (baseline_rank == 3) or bool(risk_flags)
-        block_class = "report-block" if is_esc else "report-block report-block--ok"
-
-        # If the recommendation string contains an appended emergency line,
-        # strip it from the main text to avoid duplication (we render emergency separately).
-        parts = recommendation.split('\n\n🚨 Important: ')
-        main_text = parts[0].strip()
-
-        # MAIN CARD (mobile-friendly class)
-        safe_text = main_text.replace('\n', '<br>')
-        html = (
-            f"<div class='{block_class}'>"
-            f"{safe_text}"
-            "</div>"
-        )
-
-
-        # Optional referral line below the card
-        ref_text = (condition.get("Referral", "") or "").strip()
-        if ref_text:
-            html += f"<p><strong>{ref_text}</strong></p>"
-
-        st.markdown(html, unsafe_allow_html=True)
-
-        # EMERGENCY NOTE — render once, as a separate block
-        emergency = (condition.get("Emergency Narrative (If Applicable)", "") or "").strip()
-        if emergency:
-            st.markdown(
-                f"<div class='emergency-block'>🚨 Important: {emergency}</div>",
-                unsafe_allow_html=True
-            )
+    if card_html:
+        # MAIN CARD (+ optional referral line) and the EMERGENCY NOTE, rendered once
+        st.markdown(card_html, unsafe_allow_html=True)
+        if emergency_html:
+            st.markdown(emergency_html, unsafe_allow_html=True)
 
     else:
         # Fallback amber (mobile-friendly)
@@ -1179,10 +1321,30 @@ PAGES = {
     "results": results_page,
     "fallback_page": fallback_page,
     "analytics": analytics_page,
+    "memory": memory_page,
 }
 # ---- Auth gate: show login until authenticated ----
 if not st.session_state.get("logged_in", False):
     login_page()
     st.stop()
 
-PAGES[st.session_state.page]()
\ No newline at end of file
+# ---- Dispatch (optionally under the sampled CPU profiler) ----
+get_memory_monitor()
+get_tracer().observe(session_id(), st.session_state.page)
+METER = get_rerun_meter()
+if st.session_state.page != "results":
+    st.session_state.pop("triage_metered", None)
+elif not st.session_state.get("triage_metered"):
+    # reached the results: everything run for this session so far was one triage
+    st.session_state.triage_metered = True
+    METER.complete(session_id())
+    get_tracer().complete(session_id())
+PROFILER = get_profiler()
+with METER.measure(session_id(), "full"):
+    if PROFILER.should_profile():
+        PROFILER.run(PAGES[st.session_state.page], page=st.session_state.page,
+                     session=session_id(), version=SNAPSHOT.version)
+    else:
+        PAGES[st.session_state.page]()
+# the page rendered (no st.rerun()): whatever an earlier page prefetched is stale now
+get_prefetcher().settle(prefetch_cache(), st.session_state.page)
\ No newline at end of file
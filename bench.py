@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Ad-hoc benchmarks for the triage app.
+
+    python bench.py grid        # button grid payload / render time at 50, 500, 5,000 options
+    python bench.py api         # in-process JSON API throughput (single requests and NDJSON batch)
+    python bench.py categorical # object vs categorical key columns: memory and pathway filter time
+    python bench.py shards      # free-text query latency, in-process vs sharded over 2..N worker processes
+    python bench.py suggest     # autocomplete lookup latency at 1k..100k vocabulary phrases
+
+Each benchmark prints a small table; nothing is written to disk.
+"""
+
+import statistics
+import sys
+import time
+
+
+def _elements(node):
+    yield node
+    children = getattr(node, "children", None)
+    if isinstance(children, dict):
+        for child in children.values():
+            yield from _elements(child)
+
+
+def _payload(at):
+    """(element count, serialized bytes) of everything the run sent to the browser."""
+    count = size = 0
+    for node in _elements(at._tree):
+        proto = getattr(node, "proto", None)
+        if proto is not None and hasattr(proto, "ByteSize"):
+            count += 1
+            size += proto.ByteSize()
+    return count, size
+
+
+GRID_SCRIPT = """
+import streamlit as st
+from grid import display_grid
+
+def legacy_grid(items, cols=3):
+    rows = [items[i:i + cols] for i in range(0, len(items), cols)]
+    for row in rows:
+        columns = st.columns(len(row))
+        for col, item in zip(columns, row):
+            with col:
+                if st.button(item, use_container_width=True):
+                    return item
+    return None
+
+items = [f"Subcategory option {{i}}" for i in range({n})]
+if {legacy}:
+    legacy_grid(items, cols=3)
+else:
+    display_grid(items, cols=3, key="bench")
+"""
+
+
+def bench_grid(sizes=(50, 500, 5000), runs=5):
+    from streamlit.testing.v1 import AppTest
+
+    print(f"{'options':>8} {'mode':>7} {'elements':>9} {'bytes':>10} {'median ms':>10}")
+    for n in sizes:
+        for legacy in (True, False):
+            at = AppTest.from_string(GRID_SCRIPT.format(n=n, legacy=legacy), default_timeout=120)
+            timings = []
+            for _ in range(runs):
+                t0 = time.perf_counter()
+                at.run()
+                timings.append((time.perf_counter() - t0) * 1000)
+            count, size = _payload(at)
+            print(f"{n:>8} {'legacy' if legacy else 'paged':>7} {count:>9} {size:>10} "
+                  f"{statistics.median(timings):>10.1f}")
+
+
+def _sample_queries(db, n, seed=7):
+    """Free-text queries built from the workbook's own symptom words (some repeated)."""
+    import random
+    import re
+
+    rng = random.Random(seed)
+    words = sorted({w for s in db["Symptoms"].dropna() for w in re.findall(r"[a-z]{3,}", s.lower())})
+    return [", ".join(rng.choice(words) for _ in range(rng.randint(1, 3))) for _ in range(n)]
+
+
+def bench_api(n=2000):
+    import asyncio
+    import json
+    import os
+
+    os.environ.setdefault("LEXAI_API_KEYS", "bench")
+    import api
+
+    snapshot = api.registry.snapshot()
+    queries = _sample_queries(snapshot.db, n)
+    headers = [(b"x-api-key", os.environ["LEXAI_API_KEYS"].split(",")[0].encode())]
+
+    async def call(path, body):
+        sent = []
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+        async def send(message):
+            sent.append(message)
+        scope = {"type": "http", "method": "POST", "path": path, "headers": headers, "query_string": b""}
+        await api.app(scope, receive, send)
+        return sent
+
+    async def singles():
+        for q in queries:
+            await call("/v1/match", json.dumps({"text": q, "gender": "Female", "age": 35}).encode())
+
+    async def concurrent(clients=32):
+        # the event loop stays free while requests run on the API pool
+        async def client(k):
+            for q in queries[k::clients]:
+                await call("/v1/match", json.dumps({"text": q, "gender": "Female", "age": 35}).encode())
+        await asyncio.gather(*(client(k) for k in range(clients)))
+
+    async def batch():
+        body = "\n".join(json.dumps({"id": i, "text": q}) for i, q in enumerate(queries)).encode()
+        await call("/v1/match", body)
+
+    print(f"{'mode':>22} {'requests':>9} {'req/s':>9}")
+    for label, fn in (("single, cold cache", singles), ("single, warm cache", singles),
+                      ("32 clients, cold cache", concurrent), ("ndjson batch", batch)):
+        if "cold" in label:
+            api._match_cache.clear()
+        t0 = time.perf_counter()
+        asyncio.run(fn())
+        elapsed = time.perf_counter() - t0
+        print(f"{label:>22} {n:>9} {n / elapsed:>9.0f}")
+
+
+def _synthetic(db, copies):
+    """db repeated `copies` times, as a bigger workbook would grow: more subcategories, new questions."""
+    import pandas as pd
+
+    parts = []
+    for k in range(copies):
+        part = db.copy()
+        part["SubCategory"] = part["SubCategory"] + f" {k % 10}"
+        for col in ("Clarifying Questions 1", "Clarifying Questions2", "Symptoms", "Condition"):
+            part[col] = part[col] + f" ({k})"
+        parts.append(part)
+    return pd.concat(parts, ignore_index=True)
+
+
+def bench_categorical(workbook="SymptomBotDB-3.xlsx", runs=5):
+    import tracemalloc
+
+    import pandas as pd
+
+    from triage import pathway_rows
+    from workbook import encode_columns
+
+    plain = pd.read_excel(workbook)
+    plain.columns = plain.columns.str.strip()
+
+    print(f"{'rows':>7} {'columns':>12} {'table MiB':>10} {'copy KiB':>9} {'filter ms':>10}")
+    for copies in (1, 100):
+        base = _synthetic(plain, copies) if copies > 1 else plain
+        pathways = list(base[["Primary Category", "SubCategory"]].drop_duplicates().itertuples(index=False))
+        for label, df in (("object", base), ("categorical", encode_columns(base.copy()))):
+            table = df.memory_usage(deep=True).sum() / 2**20
+            # a per-session matched_conditions slice: bytes newly allocated for half the rows
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            copy = df.iloc[::2].copy()
+            copy_kib = (tracemalloc.get_traced_memory()[0] - before) / 1024
+            tracemalloc.stop()
+            del copy
+            timings = []
+            for _ in range(runs):
+                t0 = time.perf_counter()
+                for primary, sub in pathways:
+                    pathway_rows(df, primary, sub)
+                timings.append((time.perf_counter() - t0) * 1000)
+            print(f"{len(df):>7} {label:>12} {table:>10.2f} {copy_kib:>9.0f} {statistics.median(timings):>10.1f}")
+        print(f"{'':>7} ({len(pathways)} pathways filtered per run)")
+
+
+def bench_shards(workbook="SymptomBotDB-3.xlsx", sizes=(30, 150), n=40):
+    import pandas as pd
+
+    from matcher import MatcherIndex, match_free_text
+    from shards import ShardedMatcher, available_cores, phrase_count
+    from workbook import encode_columns
+
+    plain = pd.read_excel(workbook)
+    plain.columns = plain.columns.str.strip()
+    queries = _sample_queries(plain, n)
+    cores = available_cores()
+    counts = sorted({2, 4, cores} - {0, 1})
+    print(f"{cores} cores available")
+    print(f"{'rows':>7} {'phrases':>8} {'mode':>12} {'ms/query':>9} {'speedup':>8}")
+    for copies in sizes:
+        index = MatcherIndex.from_db(encode_columns(_synthetic(plain, copies)))
+        t0 = time.perf_counter()
+        for q in queries:
+            match_free_text(q, index)
+        base = (time.perf_counter() - t0) * 1000 / n
+        print(f"{len(index):>7} {phrase_count(index):>8} {'in-process':>12} {base:>9.1f} {1.0:>8.2f}")
+        for workers in counts:
+            sharded = ShardedMatcher(index, workers=workers)
+            sharded.match(queries[0])   # wait for the workers to load their shards
+            t0 = time.perf_counter()
+            for q in queries:
+                sharded.match(q)
+            ms = (time.perf_counter() - t0) * 1000 / n
+            sharded.close()
+            print(f"{'':>7} {'':>8} {f'{workers} workers':>12} {ms:>9.1f} {base / ms:>8.2f}")
+
+
+def bench_suggest(workbook="SymptomBotDB-3.xlsx", sizes=(1_000, 10_000, 100_000), n=2000, seed=7):
+    import random
+
+    from suggest import SuggestIndex, build_suggest_index
+    from workbook import snapshot_from_file
+
+    real = build_suggest_index(snapshot_from_file(workbook)).phrases
+    words = sorted({w for p in real for w in p.split()})
+    rng = random.Random(seed)
+
+    def typo(s):
+        i = rng.randrange(len(s))
+        return s[:i] + rng.choice("abcdefghijklmnopqrstuvwxyz") + s[i + 1:]
+
+    print(f"{'phrases':>8} {'build s':>8} {'kind':>7} {'p50 µs':>8} {'p99 µs':>8} {'max µs':>8}")
+    for size in sizes:
+        weights = dict.fromkeys(real, 1)
+        while len(weights) < size:
+            phrase = " ".join(rng.choice(words) for _ in range(rng.randint(1, 4)))
+            weights[typo(phrase) if rng.random() < 0.5 else phrase] = rng.randint(1, 50)
+        t0 = time.perf_counter()
+        index = SuggestIndex(weights)
+        build = time.perf_counter() - t0
+        phrases = list(weights)
+        kinds = {
+            "prefix": [p[:rng.randint(1, len(p))] for p in rng.choices(phrases, k=n)],
+            "typo":   [typo(p[:rng.randint(3, max(3, len(p)))]) for p in rng.choices(phrases, k=n) if len(p) >= 3],
+        }
+        for kind, queries in kinds.items():
+            timings = []
+            for q in queries:
+                t0 = time.perf_counter()
+                index.suggest(q)
+                timings.append((time.perf_counter() - t0) * 1e6)
+            timings.sort()
+            print(f"{len(index):>8} {build:>8.2f} {kind:>7} {statistics.median(timings):>8.0f} "
+                  f"{timings[int(len(timings) * 0.99)]:>8.0f} {timings[-1]:>8.0f}")
+
+
+BENCHMARKS = {
+    "grid": bench_grid,
+    "api": bench_api,
+    "categorical": bench_categorical,
+    "shards": bench_shards,
+    "suggest": bench_suggest,
+}
+
+
+if __name__ == "__main__":
+    name = sys.argv[1] if len(sys.argv) > 1 else ""
+    if name not in BENCHMARKS:
+        sys.exit(f"usage: python bench.py [{'|'.join(BENCHMARKS)}]")
+    BENCHMARKS[name]()
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Group the free-text searches that matched nothing (failure_log.csv rows with
+reason "no_symptom_match") into near-duplicate clusters and propose
+FreeTextMap rows for them.
+
+    python clusters.py failure_log.csv --workbook SymptomBotDB-3.xlsx
+    python clusters.py failure_log.csv --out alias_proposals.csv --json clusters.json --top 1000
+
+1) The log is streamed once. Each input is split into its comma/semicolon
+   separated parts and the parts are counted with lossy counting: at most
+   --capacity distinct parts (default 200,000) are held; when the table
+   overflows, the less frequent half is dropped and the largest dropped
+   count is reported as the error bound. Memory stays flat however long the
+   log is (10M rows: ~80 s on one core, < 300 MB at the default capacity).
+2) The surviving parts are normalized with the workbook's FreeTextMap
+   (matcher.normalize_free_text) and merged again.
+3) Each part gets a MinHash signature over its character bigrams; LSH
+   banding finds candidates, and parts join the most frequent similar part
+   (estimated Jaccard similarity at least --threshold, default 0.5).
+4) Clusters are ranked by total count. For the --top clusters (default 500)
+   the most frequent variant is the proposed from_phrase and the closest
+   symptom phrase of the workbook (by the same bigram similarity) is the
+   to_phrase if it is at least --min-similarity alike (default 0.4).
+   Spelling variants get a to_phrase; synonyms ("bellyache") need a
+   reviewer, who sees the nearest phrase either way. Clusters whose
+   representative matches the current workbook already are skipped (an
+   alias was added since the failures were logged).
+
+--out is a CSV with from_phrase,to_phrase first, so reviewed rows can be
+pasted into the FreeTextMap sheet as they are.
+"""
+
+import argparse
+import csv
+import json
+import re
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from matcher import _PHRASE_RE, MatcherIndex, match_free_text, normalize_free_text
+
+
+REASON       = "no_symptom_match"
+NUM_PERM     = 64
+BANDS        = 16            # 16 bands x 4 rows: pairs at J≈0.5 collide with p≈0.65, J≈0.7 with p≈0.99
+SHINGLE      = 2            # character bigrams: short typo'd words (woozy/wooy) still overlap
+CAPACITY     = 200_000
+MIN_SIMILARITY = 0.4        # below this the nearest phrase is shown but not proposed
+CHUNK_SHINGLES = 50_000     # shingles hashed per numpy batch (~100 MB of temporaries)
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+def _clean(part: str) -> str:
+    return _SPACE_RE.sub(" ", part.strip().lower()).strip(" .!?\"'")
+
+
+# --- 1) streaming, bounded counting ---
+
+class LossyCounter:
+    """Counts with at most `capacity` keys; prune() drops the less frequent half."""
+
+    def __init__(self, capacity: int = CAPACITY):
+        self.capacity = capacity
+        self.counts   = {}
+        self.error    = 0        # largest count ever dropped: any kept count may be short by this much
+        self.pruned   = 0
+
+    def add(self, key: str, n: int = 1):
+        self.counts[key] = self.counts.get(key, 0) + n
+        if len(self.counts) > self.capacity:
+            self.prune()
+
+    def prune(self):
+        keep = self.capacity // 2
+        ranked = sorted(self.counts.items(), key=lambda kv: -kv[1])
+        self.error = max(self.error, ranked[keep][1])
+        self.pruned += len(ranked) - keep
+        self.counts = dict(ranked[:keep])
+
+
+def count_failures(path: str, capacity: int = CAPACITY, reason: str = REASON) -> dict:
+    counter, rows, inputs = LossyCounter(capacity), 0, 0
+    with open(path, newline="", encoding="utf-8", errors="replace") as f:
+        for rec in csv.DictReader(f):
+            rows += 1
+            if rec.get("reason") != reason or not rec.get("input"):
+                continue
+            inputs += 1
+            for part in _PHRASE_RE.split(rec["input"]):
+                part = _clean(part)
+                if part:
+                    counter.add(part)
+    return {"counts": counter.counts, "rows": rows, "inputs": inputs,
+            "error": counter.error, "pruned": counter.pruned}
+
+
+# --- 3) MinHash / LSH ---
+
+def _shingles(text: str) -> np.ndarray:
+    padded = f" {text} "
+    grams = {padded[i:i + SHINGLE] for i in range(max(1, len(padded) - SHINGLE + 1))}
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+def minhash(texts: list, num_perm: int = NUM_PERM, seed: int = 1) -> np.ndarray:
+    """(len(texts), num_perm) uint32 signatures, multiply-shift hashing of the shingle CRCs."""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2**63, num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2**63, num_perm, dtype=np.uint64)
+    sigs = np.empty((len(texts), num_perm), dtype=np.uint32)
+    start = 0
+    while start < len(texts):
+        shingles, offsets, n = [], [], 0
+        end = start
+        while end < len(texts) and (n < CHUNK_SHINGLES or end == start):
+            s = _shingles(texts[end])
+            offsets.append(n)
+            shingles.append(s)
+            n += len(s)
+            end += 1
+        x = np.concatenate(shingles)
+        with np.errstate(over="ignore"):
+            h = ((x[:, None] * a + b) >> np.uint64(32)).astype(np.uint32)
+        sigs[start:end] = np.minimum.reduceat(h, offsets, axis=0)
+        start = end
+    return sigs
+
+
+def lsh_clusters(sigs: np.ndarray, counts: np.ndarray, threshold: float = 0.5, bands: int = BANDS) -> np.ndarray:
+    """
+    Leader index per signature. Parts are visited most frequent first; each
+    joins the most similar existing leader it shares an LSH bucket with (if
+    at least `threshold` alike) or becomes a leader itself. Comparing with
+    leaders only keeps clusters from chaining into each other.
+    """
+    n, num_perm = sigs.shape
+    rows_per_band = num_perm // bands
+    buckets = np.empty((n, bands), dtype=np.int64)
+    for band in range(bands):
+        chunk = np.ascontiguousarray(sigs[:, band * rows_per_band:(band + 1) * rows_per_band])
+        keys = chunk.view(np.dtype((np.void, chunk.dtype.itemsize * rows_per_band))).ravel()
+        buckets[:, band] = np.unique(keys, return_inverse=True)[1].ravel()
+
+    # leaders per (band, bucket) as linked lists in flat arrays: head[band, bucket] → leader,
+    # following[leader, band] → the next leader in that bucket (-1 ends)
+    head = np.full((bands, n), -1, dtype=np.int64)
+    following = np.full((n, bands), -1, dtype=np.int64)
+    labels = np.empty(n, dtype=np.int64)
+    for i in np.argsort(-counts, kind="stable"):
+        row = buckets[i].tolist()
+        candidates = set()
+        for band, bucket in enumerate(row):
+            c = head[band, bucket]
+            while c >= 0:
+                candidates.add(int(c))
+                c = following[c, band]
+        best, best_sim = i, threshold
+        for c in candidates:
+            sim = np.count_nonzero(sigs[c] == sigs[i]) / num_perm
+            if sim >= best_sim:
+                best, best_sim = c, sim
+        labels[i] = best
+        if best == i:
+            for band, bucket in enumerate(row):
+                following[i, band] = head[band, bucket]
+                head[band, bucket] = i
+    return labels
+
+
+# --- 4) ranking and proposals ---
+
+def cluster_failures(path: str, db, ft_map: dict, top: int = 500, threshold: float = 0.5,
+                     capacity: int = CAPACITY, min_similarity: float = MIN_SIMILARITY) -> dict:
+    t0 = time.perf_counter()
+    counted = count_failures(path, capacity)
+    t_count = time.perf_counter() - t0
+
+    normalized = {}
+    for part, n in counted["counts"].items():
+        key = _clean(normalize_free_text(part, ft_map))
+        if key:
+            normalized[key] = normalized.get(key, 0) + n
+    texts = list(normalized)
+    counts = np.fromiter(normalized.values(), dtype=np.int64, count=len(texts))
+
+    sigs = minhash(texts)
+    labels = lsh_clusters(sigs, counts, threshold) if texts else np.array([], dtype=np.int64)
+
+    clusters = {}
+    for i, label in enumerate(labels):
+        clusters.setdefault(label, []).append(i)
+    ranked = sorted(clusters.values(), key=lambda m: -counts[m].sum())
+
+    index = MatcherIndex.from_db(db)
+    phrases = sorted({p.text for _, row in index.rows for p in row})
+    phrase_sigs = minhash(phrases)
+
+    proposals, already = [], 0
+    for members in ranked:
+        if len(proposals) >= top:
+            break
+        members = sorted(members, key=lambda i: -counts[i])
+        rep = texts[members[0]]
+        if match_free_text(rep, index):
+            already += 1
+            continue
+        sims = (phrase_sigs == sigs[members[0]]).mean(axis=1) if phrases else np.zeros(1)
+        best = int(sims.argmax())
+        nearest = phrases[best] if phrases and sims[best] > 0 else ""
+        proposals.append({
+            "from_phrase": rep,
+            "to_phrase": nearest if sims[best] >= min_similarity else "",
+            "nearest_phrase": nearest,
+            "similarity": round(float(sims[best]), 3),
+            "count": int(counts[members].sum()),
+            "variants": len(members),
+            "examples": [texts[i] for i in members[:5]],
+        })
+
+    return {
+        "log_rows": counted["rows"],
+        "unmatched_inputs": counted["inputs"],
+        "distinct_parts": len(texts),
+        "count_error_bound": counted["error"],
+        "pruned_parts": counted["pruned"],
+        "clusters": len(ranked),
+        "skipped_now_matching": already,
+        "seconds": {"count": round(t_count, 2), "total": round(time.perf_counter() - t0, 2)},
+        "proposals": proposals,
+    }
+
+
+def write_proposals(report: dict, path: str):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["from_phrase", "to_phrase", "nearest_phrase", "similarity", "count", "variants", "examples"])
+        for p in report["proposals"]:
+            writer.writerow([p["from_phrase"], p["to_phrase"], p["nearest_phrase"], p["similarity"],
+                             p["count"], p["variants"], " | ".join(p["examples"])])
+
+
+def main(argv=None):
+    from workbook import snapshot_from_file
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("log", nargs="?", default="failure_log.csv")
+    ap.add_argument("--workbook", default="SymptomBotDB.xlsx")
+    ap.add_argument("--out", default="alias_proposals.csv")
+    ap.add_argument("--json", help="also write the full report (with cluster examples) here")
+    ap.add_argument("--top", type=int, default=500, help="clusters to propose aliases for")
+    ap.add_argument("--threshold", type=float, default=0.5, help="estimated Jaccard to join a cluster")
+    ap.add_argument("--capacity", type=int, default=CAPACITY, help="distinct parts held while counting")
+    ap.add_argument("--min-similarity", type=float, default=MIN_SIMILARITY,
+                    help="leave to_phrase empty below this similarity to the nearest phrase")
+    ap.add_argument("--show", type=int, default=20)
+    args = ap.parse_args(argv)
+
+    snapshot = snapshot_from_file(args.workbook)
+    report = cluster_failures(args.log, snapshot.db, snapshot.ft_map, args.top, args.threshold,
+                              args.capacity, args.min_similarity)
+    print(f"{report['log_rows']} log rows, {report['unmatched_inputs']} unmatched searches, "
+          f"{report['distinct_parts']} distinct parts → {report['clusters']} clusters "
+          f"in {report['seconds']['total']:.1f} s")
+    if report["pruned_parts"]:
+        print(f"  counts may be short by up to {report['count_error_bound']} "
+              f"({report['pruned_parts']} rare parts dropped while counting)")
+    if report["skipped_now_matching"]:
+        print(f"  {report['skipped_now_matching']} top clusters already match the current workbook")
+    for p in report["proposals"][:args.show]:
+        print(f"  {p['count']:>8}  {p['from_phrase']!r} → {p['to_phrase'] or '?'!r} "
+              f"(nearest {p['nearest_phrase']!r} ~{p['similarity']:.2f}, {p['variants']} variants)")
+
+    write_proposals(report, args.out)
+    print(f"  {len(report['proposals'])} proposals written to {args.out}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
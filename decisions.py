@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Precomputed triage decisions for the menu-driven flow.
+
+In category mode the reported condition depends only on the pathway
+(Primary Category, SubCategory), on which of the pathway's distinct
+"Clarifying Questions2" were answered Yes and on the selected symptoms (see
+triage.choose_condition); the CQ1 answers only decide whether the CQ2 form
+is shown. So without symptoms there are at most 2**n2 outcomes per pathway,
+and the compiler stores them as a flat tuple indexed by the Yes-bitmask of
+those questions:
+
+    (primary, subcategory) → {"questions": (q2, …), "rows": (row label per mask, …),
+                              "candidates": ((row, CQ2 bit or -1, acuity), …)}
+
+"rows" is the answer when the patient selected no symptoms. With selected
+symptoms, decide() re-runs the choice from "candidates" with the
+pathway's symptom scores (triage.symptom_scores), still without pandas.
+The scores only break ties within the highest Acuity Level, so a symptom
+selection never reports a lower-acuity row; --check verifies that.
+
+The recommendation key is (row, escalated): a row with Acuity Level 3 is
+always escalated, any other row only when risk flags were selected.
+
+Pathways whose table would exceed LEXAI_DECISION_MAX_ENTRIES (default 4096,
+i.e. 12 distinct CQ2 questions), or with a row missing its Acuity Level, are
+left out and evaluated live; --check lists the latter.
+
+    python decisions.py SymptomBotDB.xlsx              # size report
+    python decisions.py SymptomBotDB.xlsx --write      # also write decisions/<version>.json
+    python decisions.py SymptomBotDB.xlsx --check      # decide() against choose_condition(), symptoms vs acuity
+
+At startup build_decision_table() loads decisions/<version>.json when one was
+written for the snapshot's workbook version, and compiles it otherwise.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from triage import choose_condition, rank_candidates
+
+
+DECISIONS_DIR = os.environ.get("LEXAI_DECISIONS_DIR", "decisions")
+MAX_ENTRIES   = int(os.environ.get("LEXAI_DECISION_MAX_ENTRIES", 4096))
+
+
+def _label(value):
+    return value.item() if hasattr(value, "item") else value
+
+
+def compile_decision_table(db, max_entries: int = MAX_ENTRIES) -> dict:
+    """
+    {"pathways": {(primary, sub): {"questions", "rows", "candidates"}}, "escalated":
+    set of Acuity 3 rows, "report": [per-pathway sizes]}.
+    """
+    pathways, report = {}, []
+    for (primary, sub), subset in db.groupby(["Primary Category", "SubCategory"], sort=False, observed=True):
+        entry, size = compile_pathway(primary, sub, subset, max_entries)
+        report.append(size)
+        if entry is not None:
+            pathways[(primary, sub)] = entry
+    return {"pathways": pathways, "escalated": escalated_rows(db), "report": report}
+
+
+def compile_pathway(primary, sub, subset, max_entries: int = MAX_ENTRIES) -> tuple:
+    """
+    (table entry, or None if it would exceed max_entries or a row has no
+    Acuity Level; report row) for one pathway's rows.
+    """
+    cq1 = subset["Clarifying Questions 1"].dropna().unique()
+    cq2 = tuple(subset["Clarifying Questions2"].dropna().unique())
+    entries = 2 ** len(cq2)
+    # answer sheets a patient can submit: all-No CQ1 skips the CQ2 form
+    reachable = (2 ** len(cq1) - 1) * entries + 1
+    missing_acuity = int(subset["Acuity Level"].isna().sum())
+    tabled = entries <= max_entries and not missing_acuity
+    size = {"primary": primary, "subcategory": sub, "rows": len(subset),
+            "cq1": len(cq1), "cq2": len(cq2), "reachable": reachable,
+            "entries": entries if tabled else 0, "live": not tabled, "missing_acuity": missing_acuity}
+    if not tabled:
+        return None, size
+    rows = []
+    for mask in range(entries):
+        answers = {q: "Yes" if mask >> bit & 1 else "No" for bit, q in enumerate(cq2)}
+        rows.append(_label(choose_condition(subset, answers)))
+    bit_of = {q: bit for bit, q in enumerate(cq2)}
+    candidates = tuple(
+        (_label(idx), bit_of.get(q2, -1), int(acuity))
+        for idx, q2, acuity in zip(subset.index, subset["Clarifying Questions2"], subset["Acuity Level"])
+    )
+    return {"questions": cq2, "rows": tuple(rows), "candidates": candidates}, size
+
+
+def escalated_rows(db) -> set:
+    """Row labels with Acuity Level 3 (always escalated)."""
+    acuity = db["Acuity Level"].fillna(0).astype(int)
+    return {_label(idx) for idx in acuity.index[acuity == 3]}
+
+
+def decide(table: dict, primary, sub, answers: dict, risk_flags=(), scores: dict = None):
+    """
+    (row, escalated) for a pathway and answer sheet, or None if the pathway
+    isn't tabled. scores: the selected symptoms' triage.symptom_scores.
+    """
+    entry = table["pathways"].get((primary, sub))
+    if entry is None:
+        return None
+    mask = 0
+    for bit, q in enumerate(entry["questions"]):
+        if answers.get(q) == "Yes":
+            mask |= 1 << bit
+    row = entry["rows"][mask]
+    if scores:
+        flagged = [(r, acuity) for r, bit, acuity in entry["candidates"] if bit >= 0 and mask >> bit & 1]
+        if len(flagged) != 1:
+            row = rank_candidates(flagged or [(r, acuity) for r, _, acuity in entry["candidates"]], scores)
+    return row, bool(risk_flags) or row in table["escalated"]
+
+
+def summary(table: dict) -> dict:
+    report = table["report"]
+    return {
+        "pathways": len(report),
+        "tabled": len(table["pathways"]),
+        "live": sum(r["live"] for r in report),
+        "reachable_answer_sheets": sum(r["reachable"] for r in report),
+        "entries": sum(r["entries"] for r in report),
+        "max_cq2": max((r["cq2"] for r in report), default=0),
+    }
+
+
+# --- on-disk form (JSON; tuple keys become lists) ---
+
+def table_path(version: str) -> str:
+    return os.path.join(DECISIONS_DIR, f"{version}.json")
+
+
+def dump_table(table: dict, version: str, path: str = None) -> str:
+    path = path or table_path(version)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "version": version,
+            "pathways": [[p, s, list(e["questions"]), list(e["rows"]), [list(c) for c in e["candidates"]]]
+                         for (p, s), e in table["pathways"].items()],
+            "escalated": sorted(table["escalated"]),
+            "report": table["report"],
+        }, f, ensure_ascii=False, default=_label)
+    return path
+
+
+def load_table(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    return {
+        "pathways": {(p, s): {"questions": tuple(q), "rows": tuple(r), "candidates": tuple(map(tuple, c))}
+                     for p, s, q, r, c in raw["pathways"]},
+        "escalated": set(raw["escalated"]),
+        "report": raw["report"],
+    }
+
+
+def build_decision_table(snapshot) -> dict:
+    """Snapshot builder: the precompiled table for this workbook version if present, else compile now."""
+    path = table_path(snapshot.version)
+    if os.path.isfile(path):
+        try:
+            return load_table(path)
+        except (OSError, ValueError, KeyError):
+            pass
+    return compile_decision_table(snapshot.db)
+
+
+def check_table(snapshot, table: dict, pairs: bool = True) -> list:
+    """
+    Problems (strings) found by replaying every tabled answer mask with no
+    symptoms, each single symptom and (if pairs) each pair of the pathway's
+    symptoms: decide() must agree with choose_condition(), and no selection
+    may report a lower Acuity Level than no selection does. Pathways left
+    live for a missing Acuity Level are reported too.
+    """
+    from itertools import combinations
+
+    from triage import build_symptom_masks, symptom_scores
+
+    db, masks, problems = snapshot.db, snapshot.derived("symptom_masks", build_symptom_masks), []
+    for r in table["report"]:
+        if r.get("missing_acuity"):
+            problems.append(f"{r['primary']} / {r['subcategory']}: {r['missing_acuity']} rows without "
+                            "an Acuity Level (evaluated live)")
+    acuity = db["Acuity Level"].fillna(0).astype(int)
+    groups = db.groupby(["Primary Category", "SubCategory"], sort=False, observed=True)
+    for (primary, sub), entry in table["pathways"].items():
+        subset = groups.get_group((primary, sub))
+        vocab = list(masks[(primary, sub)]["bits"])
+        selections = [()] + [(s,) for s in vocab] + (list(combinations(vocab, 2)) if pairs else [])
+        for mask in range(len(entry["rows"])):
+            answers = {q: "Yes" if mask >> bit & 1 else "No" for bit, q in enumerate(entry["questions"])}
+            baseline = acuity[entry["rows"][mask]]
+            for selected in selections:
+                scores = symptom_scores(masks[(primary, sub)], selected)
+                row, _ = decide(table, primary, sub, answers, scores=scores)
+                live = _label(choose_condition(subset, answers, scores))
+                if row != live:
+                    problems.append(f"{primary} / {sub} mask {mask} {list(selected)}: table {row}, live {live}")
+                if acuity[row] < baseline:
+                    problems.append(f"{primary} / {sub} mask {mask} {list(selected)}: acuity {acuity[row]} "
+                                    f"< {baseline} without symptoms")
+    return problems
+
+
+def main(argv=None):
+    from workbook import snapshot_from_file
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("workbook")
+    ap.add_argument("--write", action="store_true", help=f"write {DECISIONS_DIR}/<version>.json")
+    ap.add_argument("--max-entries", type=int, default=MAX_ENTRIES)
+    ap.add_argument("--check", action="store_true",
+                    help="replay every tabled answer sheet with symptom selections (see check_table)")
+    args = ap.parse_args(argv)
+
+    snapshot = snapshot_from_file(args.workbook)
+    table = compile_decision_table(snapshot.db, args.max_entries)
+    s = summary(table)
+    print(f"{args.workbook} @ {snapshot.version}")
+    print(f"  {s['pathways']} pathways, {s['tabled']} tabled, {s['live']} evaluated live "
+          f"(max {s['max_cq2']} CQ2 questions in one pathway)")
+    print(f"  {s['reachable_answer_sheets']} reachable answer sheets → {s['entries']} table entries")
+    for r in sorted(table["report"], key=lambda r: -r["reachable"])[:5]:
+        print(f"    {r['primary']} / {r['subcategory']}: cq1={r['cq1']} cq2={r['cq2']} "
+              f"reachable={r['reachable']} entries={r['entries']}")
+    if args.write:
+        print(f"  written to {dump_table(table, snapshot.version)}")
+    if args.check:
+        problems = check_table(snapshot, table)
+        print(f"  check: {len(problems)} problems")
+        for p in problems[:20]:
+            print(f"    {p}")
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,32 @@
 if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
 
-@st.cache_data
-def load_data():
-    # For local development
-    try:
-        df = pd.read_excel("SymptomBotDB.xlsx")
-    except:
-        # For Streamlit Cloud deployment
-        excel_url = "https://github.com/emmsdan/streamlit-test/raw/refs/heads/main/SymptomBotDB.xlsx"
-        df = pd.read_excel(excel_url)
-
-#    df = pd.read_excel("SymptomBotDB.xlsx")
+import os
+from remote import RemoteWorkbook
+
+# For Streamlit Cloud deployment: a local copy of the workbook on GitHub,
+# revalidated with conditional GETs (ETag / Last-Modified, see remote.py)
+EXCEL_URL = os.environ.get("LEXAI_WORKBOOK_URL",
+                           "https://github.com/emmsdan/streamlit-test/raw/refs/heads/main/SymptomBotDB.xlsx")
+REMOTE = RemoteWorkbook(EXCEL_URL)
+
+@st.cache_data(max_entries=1)
+def read_data(path, fetched_at=None):
+    # fetched_at only changes when the remote sent a new body (not on a 304);
+    # max_entries=1 drops the previous version's DataFrame when it does
+    df = pd.read_excel(path)
 # ── Normalize every header: remove leading/trailing whitespace ──
     df.columns = df.columns.str.strip()
     return df
 
+def load_data():
+    # For local development
+    if os.path.isfile("SymptomBotDB.xlsx"):
+        return read_data("SymptomBotDB.xlsx")
+    # Falls back to the last good copy if GitHub is unreachable
+    path = REMOTE.path()
+    return read_data(path, REMOTE.meta.get("fetched_at"))
+
 def login_page():
     st.title("LexAI Symptom Checker Login")
 
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Button grid used by the category / subcategory pages.
+
+Short lists render exactly as before: every item as a button, `cols` per row.
+Long lists get a server-side search box and pagination, so each rerun sends
+only the buttons on the visible page instead of the whole element tree.
+"""
+
+import math
+
+import streamlit as st
+
+
+# Lists up to this size render in full (no search / pager)
+GRID_PAGE_SIZE = 24
+
+
+def shown_items(key="grid") -> list:
+    """The items the grid `key` put on screen in its last render."""
+    return st.session_state.get(f"{key}_shown", [])
+
+
+def _set_page(page_key, page):
+    st.session_state[page_key] = page
+
+
+def display_grid(items, cols=3, key="grid", page_size=GRID_PAGE_SIZE):
+    """
+    Render `items` as a grid of buttons and return the clicked item (or None).
+    `key` namespaces the search box and page number in session state, so two
+    grids on different pages keep independent positions. The items on screen
+    are left in st.session_state[f"{key}_shown"] (see shown_items()).
+    """
+    page_key  = f"{key}_page"
+    query_key = f"{key}_search"
+    pages     = 1
+    page      = 0
+
+    if len(items) > page_size:
+        query = st.text_input("Search", key=query_key, placeholder="Type to filter…").strip().lower()
+        if query:
+            items = [it for it in items if query in str(it).lower()]
+
+        # a new search starts again from the first page
+        if st.session_state.get(f"{key}_last_query") != query:
+            st.session_state[f"{key}_last_query"] = query
+            st.session_state[page_key] = 0
+
+        pages = max(1, math.ceil(len(items) / page_size))
+        page  = min(st.session_state.get(page_key, 0), pages - 1)
+        items = items[page * page_size:(page + 1) * page_size]
+        if not items:
+            st.info("Nothing matches your search.")
+
+    st.session_state[f"{key}_shown"] = list(items)
+    rows = [items[i:i + cols] for i in range(0, len(items), cols)]
+    for row in rows:
+        columns = st.columns(len(row))
+        for col, item in zip(columns, row):
+            with col:
+                if st.button(item, use_container_width=True):
+                    return item
+
+    if pages > 1:
+        prev_col, label_col, next_col = st.columns([1, 2, 1])
+        with prev_col:
+            st.button("‹ Prev", key=f"{key}_prev", disabled=page == 0,
+                      on_click=_set_page, args=(page_key, page - 1))
+        with label_col:
+            st.caption(f"Page {page + 1} of {pages}")
+        with next_col:
+            st.button("Next ›", key=f"{key}_next", disabled=page >= pages - 1,
+                      on_click=_set_page, args=(page_key, page + 1))
+    return None
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+Free-text symptom matcher.
+
+The per-phrase work that does not depend on the query (splitting each row's
+Symptoms on commas/semicolons, tokenizing, stemming, the generic-term check)
+is done once per workbook snapshot in MatcherIndex. A query then only
+tokenizes the patient's text and walks the precomputed phrases, applying the
+same stages, thresholds and GENERIC_TOKENS gating the page always used:
+
+  a) substring      – a specific token (or generic+specific together) inside the phrase
+  b) exact stem     – a patient stem equals a phrase stem
+  c) fuzzy stem     – ok_pair() on stem pairs (SequenceMatcher ≥ 0.80)
+
+Stages run one after the other over the rows still unmatched, and every query
+adds each stage's matched rows, phrases checked and time to the process-wide
+STATS. explain_free_text() reports, per matched row, the deciding stage,
+phrase and token pair.
+"""
+
+import re
+import threading
+import time
+from collections import deque
+from difflib import SequenceMatcher
+
+
+GENERIC_TOKENS = {"pain", "ache", "aches", "soreness", "discomfort"}
+
+_WORD_RE  = re.compile(r"[A-Za-z]{3,}")
+_PHRASE_RE = re.compile(r"[,;]")
+
+
+def stem(word: str) -> str:
+    w = word.lower().strip()
+    for suf in ("ing", "ion", "ed", "s", "ness", "able"):
+        if w.endswith(suf):
+            return w[: -len(suf)]
+    return w
+
+
+GENERIC_STEMS = {stem(t) for t in GENERIC_TOKENS}
+
+
+def stems_of(tokens) -> set:
+    """Stems plus the alternate i<->y forms (dizzy↔dizzi)."""
+    stems = [stem(tok) for tok in tokens]
+    stems += [
+        s[:-1] + ("y" if s.endswith("i") else "i")
+        for s in stems
+        if s.endswith(("i", "y"))
+    ]
+    return set(stems)
+
+
+# c) fuzzy-stem match across token pairs (safer)
+def ok_pair(us, ds):
+    # ignore very short tokens for fuzzy; exact/substring already handled earlier
+    if len(us) < 4 or len(ds) < 4:
+        return False
+    # require same starting letter OR substring relation to avoid heart≈ear/hurt
+    if not (us[0] == ds[0] or us in ds or ds in us):
+        return False
+    return SequenceMatcher(None, us, ds).ratio() >= 0.80  # was 0.65
+
+
+def normalize_free_text(raw: str, ft_map: dict = None) -> str:
+    """
+    Minimal, safe normalization:
+      - lowercase + trim
+      - unify curly quotes
+      - apply FreeTextMap replacements (longest-first)
+      - a couple high-impact typo/alias fixes
+    Returns a SINGLE normalized string you feed into the matcher.
+    """
+    if not raw:
+        return ""
+    text = raw.strip().lower()
+
+    # normalize curly quotes to ascii to avoid miss matches
+    text = (text
+            .replace("’", "'")
+            .replace("‘", "'")
+            .replace("“", '"')
+            .replace("”", '"'))
+
+    # tiny typo fix that bites often
+    text = text.replace("heatbeat", "heartbeat")
+
+    # Apply Excel-driven phrase replacements, longest keys first to avoid partial shadowing
+    if ft_map:
+        for k in sorted(ft_map.keys(), key=len, reverse=True):
+            if k in text:
+                text = text.replace(k, ft_map[k])
+
+    return text
+
+
+class Phrase:
+    """One symptom phrase of a row, pre-tokenized for matching."""
+    __slots__ = ("text", "stems", "has_generic")
+
+    def __init__(self, text: str):
+        self.text        = text
+        self.stems       = frozenset(stems_of(_WORD_RE.findall(text)))
+        self.has_generic = any(tok in text for tok in GENERIC_TOKENS)
+
+
+def phrases_of(symptoms) -> tuple:
+    """The Phrases of one Symptoms cell."""
+    phrases = []
+    for raw_sym in _PHRASE_RE.split(str(symptoms)):
+        sym_clean = raw_sym.strip().lower()
+        if sym_clean:
+            phrases.append(Phrase(sym_clean))
+    return tuple(phrases)
+
+
+class MatcherIndex:
+    """
+    Row label → tuple of Phrase, in workbook order. slice(row_ids) returns a
+    view over a subset of rows sharing the same Phrase objects.
+    """
+
+    def __init__(self, rows: list):
+        self.rows = rows   # [(row label, (Phrase, ...)), ...]
+
+    @classmethod
+    def from_db(cls, db):
+        return cls([(idx, phrases_of(symptoms)) for idx, symptoms in db["Symptoms"].items()])
+
+    def slice(self, row_ids):
+        keep = set(row_ids)
+        return MatcherIndex([(idx, phrases) for idx, phrases in self.rows if idx in keep])
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class Query:
+    """The patient's (already normalized) text, tokenized once."""
+
+    def __init__(self, text: str):
+        self.text   = text
+        self.tokens = _WORD_RE.findall(text.lower())
+        self.stems  = stems_of(self.tokens)
+        self.specific_tokens = [t for t in self.tokens if t not in GENERIC_TOKENS]
+        self.specific_stems  = [s for s in self.stems if s not in GENERIC_STEMS]
+        self.used_generic    = any(t in GENERIC_TOKENS for t in self.tokens)
+        # user typed generic+specific → every stage needs the generic in the phrase too
+        self.needs_generic   = self.used_generic and bool(self.specific_tokens)
+
+
+STAGES = ("generic+specific substring", "substring", "stem", "fuzzy")
+
+
+def _substring_stage(q: Query, ph: Phrase):
+    """a) (stage, token pair) if the phrase matches on substrings, else None."""
+    # require either a specific token, or generic+specific together
+    tok = next((t for t in q.specific_tokens if t in ph.text), None)
+    if q.needs_generic:
+        # Require BOTH specific and generic in the same phrase (e.g., 'back' + 'pain')
+        if tok and ph.has_generic:
+            return "generic+specific substring", (tok, _generic_in(ph.text))
+        return None
+    # If user didn’t type a generic, allow matching on specifics alone.
+    # If the user typed ONLY a generic (e.g., "pain"), still allow that generic match.
+    if tok:
+        return "substring", (tok, tok)
+    if not q.specific_tokens and ph.has_generic:
+        return "substring", (next((t for t in q.tokens if t in GENERIC_TOKENS), ""), _generic_in(ph.text))
+    return None
+
+
+def _generic_in(text: str) -> str:
+    return next((g for g in sorted(GENERIC_TOKENS) if g in text), "")
+
+
+def _stem_stage(q: Query, ph: Phrase):
+    """b) exact stem match."""
+    us = next((us for us in q.specific_stems if us in ph.stems), None)
+    return ("stem", (us, us)) if us else None
+
+
+def _fuzzy_stage(q: Query, ph: Phrase):
+    """c) fuzzy-stem match across token pairs."""
+    for us in q.specific_stems:
+        for ds in ph.stems:
+            if ok_pair(us, ds):
+                return "fuzzy", (us, ds)
+    return None
+
+
+def phrase_matches(q: Query, ph: Phrase) -> bool:
+    if _substring_stage(q, ph):
+        return True
+    if q.needs_generic and not ph.has_generic:
+        return False   # co-occurrence guard also blocks stem/fuzzy for this phrase
+    return bool(_stem_stage(q, ph) or _fuzzy_stage(q, ph))
+
+
+class MatcherStats:
+    """
+    Process-wide counters: per stage, how many rows it decided, how many
+    phrases it checked and the time spent in it. Cheap enough to stay on.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.queries = 0
+            self.stages  = {s: {"rows": 0, "phrases": 0, "seconds": 0.0} for s in STAGES}
+
+    def add(self, per_stage: dict):
+        with self._lock:
+            self.queries += 1
+            for stage, (rows, phrases, seconds) in per_stage.items():
+                c = self.stages[stage]
+                c["rows"]    += rows
+                c["phrases"] += phrases
+                c["seconds"] += seconds
+
+    def rows(self) -> list:
+        """[{stage, rows, share, phrases, ms_total, us_per_query}] in stage order."""
+        with self._lock:
+            decided = sum(c["rows"] for c in self.stages.values()) or 1
+            return [{
+                "stage": stage, "rows": c["rows"], "share": c["rows"] / decided,
+                "phrases": c["phrases"], "ms_total": c["seconds"] * 1000,
+                "us_per_query": c["seconds"] * 1e6 / self.queries if self.queries else 0.0,
+            } for stage, c in self.stages.items()]
+
+
+STATS = MatcherStats()
+
+
+class SearchTimings:
+    """
+    Latencies of progressive free-text searches (app.py): time to the first,
+    exact/stem result the patient can act on, and time until the full
+    pipeline (with fuzzy) has completed, over the last `keep` searches.
+    """
+
+    def __init__(self, keep: int = 2000):
+        self._lock = threading.Lock()
+        self._runs = deque(maxlen=keep)   # (first_ms or None, complete_ms, fuzzy added rows)
+
+    def add(self, first_ms, complete_ms: float, added: bool):
+        with self._lock:
+            self._runs.append((first_ms, complete_ms, added))
+
+    def rows(self) -> list:
+        with self._lock:
+            runs = list(self._runs)
+
+        def pct(values, p):
+            values = sorted(values)
+            return values[min(len(values) - 1, int(p / 100 * len(values)))] if values else None
+
+        first = [f for f, _, _ in runs if f is not None]
+        complete = [c for _, c, _ in runs]
+        return [
+            {"measure": "time to first result", "searches": len(first),
+             "p50_ms": pct(first, 50), "p95_ms": pct(first, 95)},
+            {"measure": "time to complete", "searches": len(complete),
+             "p50_ms": pct(complete, 50), "p95_ms": pct(complete, 95)},
+            {"measure": "fuzzy added matches", "searches": sum(a for _, _, a in runs),
+             "p50_ms": None, "p95_ms": None},
+        ]
+
+
+TIMINGS = SearchTimings()
+
+
+def _run(text: str, index: MatcherIndex, record: bool = True, fuzzy: bool = True, budget_s: float = None):
+    """
+    Evaluate the stages one at a time over the rows still undecided: a row is
+    matched by the cheapest stage any of its phrases passes (same result set
+    as checking each phrase through all stages, but fuzzy scoring only runs on
+    rows nothing cheaper matched). Returns (decided, per_stage, complete) where
+    decided is {row: (stage, phrase, pair)}.
+
+    fuzzy=False skips the fuzzy stage; with budget_s the fuzzy stage stops
+    once the query has run that long. Either way complete is False.
+    """
+    q = Query(text)
+    decided, per_stage = {}, {}
+    perf = time.perf_counter
+    deadline = perf() + budget_s if budget_s is not None else None
+    complete = True
+
+    # a) substring (the generic+specific variant when the user typed both)
+    t0, checked, open_rows = perf(), 0, []
+    for idx, phrases in index.rows:
+        for ph in phrases:
+            checked += 1
+            hit = _substring_stage(q, ph)
+            if hit:
+                decided[idx] = (hit[0], ph.text, hit[1])
+                break
+        else:
+            # co-occurrence guard: phrases without a generic can't match later stages
+            rest = [ph for ph in phrases if ph.has_generic] if q.needs_generic else phrases
+            if rest and q.specific_stems:
+                open_rows.append((idx, rest))
+    substring_stage = STAGES[0] if q.needs_generic else STAGES[1]
+    per_stage[substring_stage] = [len(decided), checked, perf() - t0]
+
+    # b) exact stem, c) fuzzy stem – each only on rows still open
+    for stage, fn in (("stem", _stem_stage), ("fuzzy", _fuzzy_stage)):
+        if stage == "fuzzy" and not fuzzy:
+            complete = complete and not open_rows
+            break
+        t0, checked, still_open, before = perf(), 0, [], len(decided)
+        for idx, phrases in open_rows:
+            if stage == "fuzzy" and deadline is not None and perf() > deadline:
+                complete = False
+                break
+            for ph in phrases:
+                checked += 1
+                hit = fn(q, ph)
+                if hit:
+                    decided[idx] = (stage, ph.text, hit[1])
+                    break
+            else:
+                still_open.append((idx, phrases))
+        per_stage[stage] = [len(decided) - before, checked, perf() - t0]
+        open_rows = still_open
+
+    if record:
+        STATS.add(per_stage)
+    return decided, per_stage, complete
+
+
+def match_free_text(text: str, index: MatcherIndex) -> list:
+    """Row labels (sorted) whose Symptoms match the normalized free text."""
+    decided, _, _ = _run(text, index)
+    return sorted(decided)
+
+
+def match_with_stages(text: str, index: MatcherIndex, fuzzy: bool = True, budget_s: float = None,
+                      record: bool = False) -> tuple:
+    """
+    (sorted row labels, per-stage [rows, phrases, seconds], complete); see _run.
+    Doesn't touch STATS unless record=True (shard workers report to the driver).
+    """
+    decided, per_stage, complete = _run(text, index, record, fuzzy, budget_s)
+    return sorted(decided), per_stage, complete
+
+
+def explain_free_text(text: str, index: MatcherIndex) -> dict:
+    """
+    What match_free_text(text, index) does, for the admin page:
+      rows    – [{row, stage, phrase, query_token, phrase_token}] for each matched row
+      stages  – [{stage, rows, phrases, ms}] in evaluation order
+    """
+    decided, per_stage, _ = _run(text, index, record=False)   # an admin's query isn't traffic
+    return {
+        "rows": [{"row": idx, "stage": stage, "phrase": phrase,
+                  "query_token": pair[0], "phrase_token": pair[1]}
+                 for idx, (stage, phrase, pair) in sorted(decided.items())],
+        "stages": [{"stage": stage, "rows": rows, "phrases": checked, "ms": seconds * 1000}
+                   for stage, (rows, checked, seconds) in per_stage.items()],
+    }
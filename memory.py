@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Memory accounting for the admin memory page: per-session state sizes, process
+RSS over time and the largest allocation sites.
+
+A daemon thread samples RSS every LEXAI_RSS_INTERVAL_S seconds (default 15)
+into a ring of LEXAI_RSS_HISTORY points (default 960, about 4 h).
+
+Allocation sites come from tracemalloc, run in short windows: tracing is
+switched on for LEXAI_TRACEMALLOC_WINDOW_S seconds (default 5, one frame per
+trace), then a snapshot of the memory still held by what was allocated
+during the window is kept and tracing is switched off again. Windows run on
+demand from the admin page, and every LEXAI_TRACEMALLOC_EVERY_S seconds if
+that is set (default 0, off). A window is not free: while it is on, every
+allocation in the process is traced, so live searches, reruns and filtering
+run several times slower for its duration. Only turn on periodic windows
+where that is acceptable (900 s gives a 0.6% duty cycle). The newest
+LEXAI_TRACEMALLOC_KEEP window results (default 12) are kept.
+
+Session sizes are approx_size() deep sizes: objects shared between sessions
+(workbook slices, interned strings) are counted once per session.
+"""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+from workbook import approx_size
+
+
+def rss_bytes() -> int:
+    """Current resident set size (Linux /proc), else the peak RSS from getrusage."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _active_sessions():
+    """
+    Streamlit's active sessions, or None. This reaches into runtime internals
+    (Runtime._session_mgr), so any change there just yields None.
+    """
+    try:
+        from streamlit.runtime import Runtime
+
+        manager = getattr(Runtime.instance(), "_session_mgr", None)
+        return list(manager.list_active_sessions()) if manager is not None else None
+    except Exception:
+        return None
+
+
+def session_states(current_id: str = None, current_state=None) -> dict:
+    """
+    session id → {key: value} for every active Streamlit session in this process.
+    Falls back to just the calling session when the runtime can't be inspected.
+    """
+    sessions = _active_sessions()
+    if sessions is not None:
+        try:
+            return {info.session.id: dict(info.session.session_state.filtered_state) for info in sessions}
+        except Exception:
+            pass
+    if current_state is None:
+        return {}
+    return {current_id or "current": {k: current_state[k] for k in current_state}}
+
+
+def streamlit_cache_stats() -> list:
+    """[{cache, bytes}] from Streamlit's own stats (st.cache_data / st.cache_resource, media, uploads)."""
+    try:
+        from streamlit.runtime import Runtime
+
+        stats = Runtime.instance().stats_mgr.get_stats()
+    except Exception:
+        return []
+    if isinstance(stats, dict):   # newer Streamlit: {family: [stats]}
+        stats = [s for family in stats.values() for s in family]
+    totals = {}
+    for s in stats:
+        name = f"{s.category_name}:{s.cache_name}" if s.cache_name else s.category_name
+        totals[name] = totals.get(name, 0) + s.byte_length
+    return [{"cache": k, "bytes": v} for k, v in sorted(totals.items(), key=lambda kv: -kv[1])]
+
+
+def state_sizes(states: dict) -> list:
+    """[{session, keys, bytes, largest_key, largest_bytes}] sorted by size, biggest first."""
+    rows = []
+    for sid, state in states.items():
+        sizes = {k: approx_size(v) for k, v in state.items()}
+        largest = max(sizes, key=sizes.get) if sizes else None
+        rows.append({
+            "session": sid, "keys": len(sizes), "bytes": sum(sizes.values()),
+            "largest_key": largest, "largest_bytes": sizes.get(largest, 0),
+        })
+    return sorted(rows, key=lambda r: -r["bytes"])
+
+
+class MemoryMonitor:
+    def __init__(self, interval_s: float = None, history: int = None, trace_every_s: float = None,
+                 trace_window_s: float = None, keep: int = None, top: int = 25):
+        env = os.environ.get
+        self.interval_s     = interval_s if interval_s is not None else float(env("LEXAI_RSS_INTERVAL_S", 15))
+        self.trace_every_s  = trace_every_s if trace_every_s is not None else float(env("LEXAI_TRACEMALLOC_EVERY_S", 0))
+        self.trace_window_s = trace_window_s if trace_window_s is not None else float(env("LEXAI_TRACEMALLOC_WINDOW_S", 5))
+        self.top            = top
+        self._rss           = deque(maxlen=history or int(env("LEXAI_RSS_HISTORY", 960)))
+        self._windows       = deque(maxlen=keep or int(env("LEXAI_TRACEMALLOC_KEEP", 12)))
+        self._trace_lock    = threading.Lock()
+        self._next_trace    = time.time() + self.trace_every_s
+        self._thread        = threading.Thread(target=self._loop, name="memory-monitor", daemon=True)
+        self._thread.start()
+
+    # --- RSS ---
+
+    def _loop(self):
+        while True:
+            self._rss.append((time.time(), rss_bytes()))
+            if self.trace_every_s > 0 and time.time() >= self._next_trace:
+                self._next_trace = time.time() + self.trace_every_s
+                self.sample_allocations()
+            time.sleep(self.interval_s)
+
+    def rss_history(self) -> list:
+        return [{"time": t, "rss_mb": b / 2**20} for t, b in list(self._rss)]
+
+    # --- Allocation sites ---
+
+    @property
+    def tracing(self) -> bool:
+        return self._trace_lock.locked()
+
+    def sample_allocations(self, window_s: float = None) -> bool:
+        """
+        Trace allocations for one window (blocking) and keep the top sites.
+        Returns False if a window is already running. If tracemalloc was already
+        on (PYTHONTRACEMALLOC), it is left on.
+        """
+        if not self._trace_lock.acquire(blocking=False):
+            return False
+        try:
+            window_s = self.trace_window_s if window_s is None else window_s
+            was_tracing = tracemalloc.is_tracing()
+            if not was_tracing:
+                tracemalloc.start(1)
+            t0 = time.time()
+            time.sleep(window_s)
+            snap = tracemalloc.take_snapshot()
+            if not was_tracing:
+                tracemalloc.stop()
+            snap = snap.filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            ))
+            sites = [{"site": str(s.traceback[0]), "kib": s.size / 1024, "blocks": s.count}
+                     for s in snap.statistics("lineno")[:self.top]]
+            self._windows.append({"started": t0, "seconds": window_s, "sites": sites})
+            return True
+        finally:
+            self._trace_lock.release()
+
+    def sample_allocations_async(self, window_s: float = None):
+        threading.Thread(target=self.sample_allocations, args=(window_s,), daemon=True).start()
+
+    def windows(self) -> list:
+        return list(self._windows)
+
+    def top_sites(self, limit: int = 25) -> list:
+        """Sites aggregated over the kept windows: in how many they showed up, peak and mean KiB held."""
+        agg = {}
+        for w in self._windows:
+            for s in w["sites"]:
+                a = agg.setdefault(s["site"], {"site": s["site"], "windows": 0, "peak_kib": 0.0, "total_kib": 0.0})
+                a["windows"] += 1
+                a["peak_kib"] = max(a["peak_kib"], s["kib"])
+                a["total_kib"] += s["kib"]
+        rows = sorted(agg.values(), key=lambda a: -a["peak_kib"])[:limit]
+        for a in rows:
+            a["mean_kib"] = a.pop("total_kib") / a["windows"]
+        return rows
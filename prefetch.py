@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Speculative prefetch of the next page's data, per session.
+
+The triage flow is predictable: subcategory → symptom selection →
+clarifying questions → risk flags. While the patient reads a page, the page
+hands prefetch() one job per likely next step (on the subcategory menu: the
+pathway rows and symptom options behind every visible button). Jobs run on a
+small process-wide thread pool (LEXAI_PREFETCH_WORKERS, default 2); their
+futures are kept in the session's SessionCache (in st.session_state), at
+most LEXAI_PREFETCH_MAX of them (default 12). After the click, the next page
+take()s its data instead of computing it:
+  hit    the job had finished
+  late   it was still running; the page waits for it (the work it would do anyway)
+  miss   nothing prefetched, or the job hadn't started (it is cancelled and
+         the data computed inline)
+Prefetched entries the next page doesn't use are discarded on navigation
+(settle(), after each page) and counted as wasted. Jobs must not call
+Streamlit: they run outside the script thread. LEXAI_PREFETCH=0 turns it
+off; take() then always computes inline.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+OUTCOMES = ("submitted", "hit", "late", "miss", "wasted", "errors")
+
+
+class SessionCache:
+    """
+    One session's prefetched futures (made on `page`) and the data taken for
+    the page being shown, so reruns of that page don't count again.
+    """
+
+    def __init__(self):
+        self.page       = None
+        self.entries    = OrderedDict()   # key → Future of (value, seconds)
+        self.shown_page = None
+        self.shown      = {}              # key → value
+
+
+def _timed(fn):
+    t0 = time.perf_counter()
+    value = fn()
+    return value, time.perf_counter() - t0
+
+
+class Prefetcher:
+    def __init__(self, workers: int = None, max_entries: int = None, enabled: bool = None):
+        env = os.environ.get
+        self.enabled     = enabled if enabled is not None else env("LEXAI_PREFETCH", "1") != "0"
+        self.workers     = workers or int(env("LEXAI_PREFETCH_WORKERS", 2))
+        self.max_entries = max_entries or int(env("LEXAI_PREFETCH_MAX", 12))
+        self._pool       = ThreadPoolExecutor(self.workers, thread_name_prefix="prefetch") if self.enabled else None
+        self._lock       = threading.Lock()
+        self._stats      = {}             # target page → counters
+
+    def _count(self, page: str, outcome: str, saved_s: float = 0.0):
+        with self._lock:
+            c = self._stats.setdefault(page, {**dict.fromkeys(OUTCOMES, 0), "saved_s": 0.0})
+            c[outcome] += 1
+            c["saved_s"] += saved_s
+
+    def prefetch(self, cache: SessionCache, page: str, jobs: dict):
+        """
+        Start jobs {key: fn} from `page`; key[0] names the page the data is for.
+        Entries from another page, or no longer among the jobs, are discarded first.
+        """
+        if not self.enabled:
+            return
+        if cache.page != page:
+            self.discard(cache)
+            cache.page = page
+        for key in [k for k in cache.entries if k not in jobs]:
+            self._drop(cache, key)
+        for key, fn in jobs.items():
+            if key in cache.entries:
+                continue
+            if len(cache.entries) >= self.max_entries:
+                break
+            cache.entries[key] = self._pool.submit(_timed, fn)
+            self._count(key[0], "submitted")
+
+    def take(self, cache: SessionCache, page: str, key: tuple, compute):
+        """The data for key on `page`: prefetched if possible, else compute()."""
+        if cache.shown_page != page:
+            cache.shown_page, cache.shown = page, {}
+        if key in cache.shown:
+            return cache.shown[key]
+
+        future = cache.entries.pop(key, None)
+        if future is not None and (future.done() or not future.cancel()):
+            outcome = "hit" if future.done() else "late"
+            try:
+                value, seconds = future.result()
+            except Exception:   # a failed guess: compute it for real
+                self._count(key[0], "errors")
+            else:
+                self._count(key[0], outcome, seconds if outcome == "hit" else 0.0)
+                cache.shown[key] = value
+                return value
+        value = compute()
+        self._count(key[0], "miss")
+        cache.shown[key] = value
+        return value
+
+    def settle(self, cache: SessionCache, page: str):
+        """After `page` rendered: drop what was prefetched on another page (navigation)."""
+        if cache.page != page:
+            self.discard(cache)
+            cache.page = page
+
+    def discard(self, cache: SessionCache):
+        for key in list(cache.entries):
+            self._drop(cache, key)
+
+    def _drop(self, cache: SessionCache, key):
+        cache.entries.pop(key).cancel()
+        self._count(key[0], "wasted")
+
+    def summary(self) -> list:
+        """Per target page: the outcome counts, hit rate and the compute time hits saved."""
+        with self._lock:
+            stats = {page: dict(c) for page, c in self._stats.items()}
+        rows = []
+        for page, c in stats.items():
+            taken = c["hit"] + c["late"] + c["miss"]
+            rows.append({
+                "page": page, **{k: c[k] for k in OUTCOMES},
+                "hit_rate": round(c["hit"] / taken, 3) if taken else None,
+                "saved_ms": round(c["saved_s"] * 1000, 1),
+            })
+        return rows
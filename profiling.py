@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+On-demand CPU profiling of individual reruns.
+
+A sampled percentage of reruns (LEXAI_PROFILE_SAMPLE, 0–100, or the admin
+slider on the analytics page) runs the page function under cProfile and
+writes a .prof file tagged with page, session and workbook version. Only the
+newest LEXAI_PROFILE_KEEP files are kept. When the sample rate is 0 the only
+cost per rerun is one float comparison.
+
+Profiles are standard pstats files:  python -m pstats profiles/<file>.prof
+
+cProfile only sees the thread it runs on, and free-text matching runs on
+the search pool. A sampled rerun therefore hands the jobs it submits through
+job(); each is profiled on its worker thread and merged into the rerun's
+.prof file when it finishes (the file name keeps the script thread's time).
+
+RerunMeter counts every script execution (full reruns and fragment-only
+reruns) and its CPU time, per completed triage.
+"""
+
+import collections
+import contextlib
+import cProfile
+import glob
+import os
+import pstats
+import random
+import re
+import threading
+import time
+
+
+PROFILE_DIR = os.environ.get("LEXAI_PROFILE_DIR", "profiles")
+
+
+def _safe(tag) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "-", str(tag))[:40] or "na"
+
+
+class RerunProfiler:
+    def __init__(self, sample_pct: float = None, keep: int = None, directory: str = PROFILE_DIR):
+        if sample_pct is None:
+            sample_pct = float(os.environ.get("LEXAI_PROFILE_SAMPLE", 0))
+        if keep is None:
+            keep = int(os.environ.get("LEXAI_PROFILE_KEEP", 50))
+        self.sample_pct = sample_pct
+        self.keep       = keep
+        self.directory  = directory
+        self._lock      = threading.Lock()
+        self._local     = threading.local()   # .run: the sampled _SampledRun on this thread
+
+    def should_profile(self) -> bool:
+        return self.sample_pct > 0 and random.random() * 100 < self.sample_pct
+
+    def run(self, fn, page: str, session: str, version: str):
+        """
+        Call fn() under cProfile and store the profile, even when fn exits via
+        st.rerun()/st.stop() (those raise control-flow exceptions).
+        """
+        prof = cProfile.Profile()
+        sampled = self._local.run = _SampledRun()
+        t0 = time.perf_counter()
+        prof.enable()
+        try:
+            return fn()
+        finally:
+            prof.disable()
+            self._local.run = None
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+            self._store(prof, page, session, version, elapsed_ms, sampled)
+
+    def job(self, fn):
+        """
+        fn, or, inside a sampled run(), fn wrapped to profile itself on the
+        pool thread it runs on and merge that into the run's profile.
+        """
+        sampled = getattr(self._local, "run", None)
+        if sampled is None:
+            return fn
+
+        def profiled(*args, **kwargs):
+            prof = cProfile.Profile()
+            try:
+                prof.enable()
+            except ValueError:   # another profiler is active on this thread
+                return fn(*args, **kwargs)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                prof.disable()
+                sampled.add(prof)
+        return profiled
+
+    def _store(self, prof, page, session, version, elapsed_ms, sampled=None):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%dT%H%M%S") + f"{time.time() % 1:.3f}"[1:]
+        name = (f"{stamp}__{_safe(page)}__{_safe(session)}__{_safe(version)}"
+                f"__{elapsed_ms:.0f}ms.prof")
+        path = os.path.join(self.directory, name)
+        if sampled is None:
+            prof.dump_stats(path)
+        else:
+            sampled.store(prof, path)
+        with self._lock:
+            for old in self.files()[self.keep:]:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+
+    def files(self) -> list:
+        """Profile paths, newest first."""
+        return sorted(glob.glob(os.path.join(self.directory, "*.prof")), reverse=True)
+
+    def recent(self, limit: int = 20) -> list:
+        """[{file, page, session, version, ms}] parsed from the newest file names."""
+        rows = []
+        for path in self.files()[:limit]:
+            parts = os.path.basename(path)[:-len(".prof")].split("__")
+            if len(parts) != 5:
+                continue
+            stamp, page, session, version, ms = parts
+            rows.append({"time": stamp, "page": page, "session": session,
+                         "version": version, "ms": float(ms.rstrip("ms")), "file": path})
+        return rows
+
+    def top_functions(self, limit: int = 20, recent: int = 20, page: str = None) -> list:
+        """Hot functions aggregated over the newest `recent` profiles (optionally one page)."""
+        paths = [r["file"] for r in self.recent(recent) if page in (None, r["page"])]
+        if not paths:
+            return []
+        stats = pstats.Stats(*paths)
+        rows = []
+        for (filename, line, func), (cc, nc, tt, ct, _callers) in stats.stats.items():
+            rows.append({
+                "function": f"{func} ({os.path.basename(filename)}:{line})",
+                "calls": nc,
+                "self_ms": tt * 1000,
+                "cumulative_ms": ct * 1000,
+            })
+        rows.sort(key=lambda r: r["self_ms"], reverse=True)
+        return rows[:limit]
+
+
+class _SampledRun:
+    """
+    Pool-job profiles of one sampled rerun: held until the rerun's own
+    profile is written, then merged into its file as they finish.
+    """
+
+    def __init__(self):
+        self._lock    = threading.Lock()
+        self._path    = None
+        self._pending = []
+
+    def add(self, prof):
+        with self._lock:
+            if self._path is None:
+                self._pending.append(prof)
+                return
+            try:
+                stats = pstats.Stats(self._path)
+            except (OSError, TypeError):   # already rotated out (or unreadable)
+                return
+            stats.add(prof)
+            stats.dump_stats(self._path)
+
+    def store(self, prof, path: str):
+        with self._lock:
+            stats = pstats.Stats(prof)
+            for job in self._pending:
+                stats.add(job)
+            stats.dump_stats(path)
+            self._path, self._pending = path, []
+
+
+class RerunMeter:
+    """
+    Script executions and their thread CPU time per session, split into full
+    reruns and fragment-only reruns, rolled up per completed triage (see
+    complete()). A fragment that runs inline as part of a full rerun is
+    counted with that rerun. Sessions that stop rerunning without reaching
+    complete() are dropped after idle_s seconds (LEXAI_RERUN_IDLE_S, default
+    1800), or oldest first beyond max_sessions, and counted as abandoned.
+    """
+
+    def __init__(self, keep: int = 1000, idle_s: float = None, max_sessions: int = 10000):
+        self.idle_s       = idle_s if idle_s is not None else float(os.environ.get("LEXAI_RERUN_IDLE_S", 1800))
+        self.max_sessions = max_sessions
+        self.abandoned    = 0
+        self._lock      = threading.Lock()
+        self._local     = threading.local()
+        self._sessions  = collections.OrderedDict()   # session → {"full", "fragment", "cpu_s", "seen"}, least recent first
+        self._completed = collections.deque(maxlen=keep)
+
+    @contextlib.contextmanager
+    def measure(self, session: str, kind: str):
+        if getattr(self._local, "active", False):
+            yield
+            return
+        self._local.active = True
+        cpu0 = time.thread_time()
+        try:
+            yield
+        finally:
+            self._local.active = False
+            cpu = time.thread_time() - cpu0
+            now = time.monotonic()
+            with self._lock:
+                c = self._sessions.setdefault(session, {"full": 0, "fragment": 0, "cpu_s": 0.0})
+                c[kind] += 1
+                c["cpu_s"] += cpu
+                c["seen"] = now
+                self._sessions.move_to_end(session)
+                self._prune(now)
+
+    def _prune(self, now: float):
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest["seen"] <= self.idle_s and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+            self.abandoned += 1
+
+    def complete(self, session: str):
+        """Close the session's current triage: its counters go to the completed list."""
+        with self._lock:
+            c = self._sessions.pop(session, None)
+            if c:
+                self._completed.append(c)
+
+    def summary(self) -> dict:
+        with self._lock:
+            self._prune(time.monotonic())
+            done = list(self._completed)
+            abandoned, in_progress = self.abandoned, len(self._sessions)
+        n = len(done) or 1
+        return {
+            "triages": len(done),
+            "abandoned": abandoned,
+            "in_progress": in_progress,
+            "full_reruns": sum(c["full"] for c in done) / n,
+            "fragment_reruns": sum(c["fragment"] for c in done) / n,
+            "cpu_ms": sum(c["cpu_s"] for c in done) * 1000 / n,
+        }
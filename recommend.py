@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Recommendation rendering for the results page.
+
+The narrative templates in SymptomBotDB.xlsx are compiled once per workbook
+load into CompiledTemplate objects that know their fields, so a results
+render is a dict lookup instead of str.format + substring scans + re-escaping.
+Placeholder typos are collected at compile time (see compile_recommendations)
+instead of surfacing as a KeyError for a patient.
+"""
+
+import re
+import string
+
+import pandas as pd
+
+
+# Placeholders the narrative templates are allowed to use
+TEMPLATE_FIELDS = {"certainty", "risk_flags", "default_rec", "escalated_rec"}
+
+EMERGENCY_MARKER = "\n\n🚨 Important: "
+
+DEFAULT_TEMPLATE_COL   = "Default Narrative Template"
+ESCALATED_TEMPLATE_COL = "Escalated Narrative Template (Risk Flags Present)"
+EMERGENCY_COL          = "Emergency Narrative (If Applicable)"
+
+_FORMATTER = string.Formatter()
+
+
+def evaluate_rule(rule_str: str, condition: dict, user_data: dict) -> bool:
+    """
+    Evaluate a rule like:
+      (symptom == itchy eyes AND cq1 == yes)
+      OR risk_flag == Chronic (>6 weeks)
+    by checking:
+      - whether 'itchy eyes' is listed in condition['Symptoms']
+      - whether user_data['clarifying_answers']['cq1'] == 'Yes'
+      - whether 'Chronic (>6 weeks)' is listed in condition['RiskFlags']
+    """
+    # Pre-split the human lists
+    syms = [s.strip().lower() for s in condition.get("Symptoms", "").split(",")]
+    rfs  = [r.strip().lower() for r in condition.get("RiskFlags", "").split(",")]
+
+    # Helper to evaluate a single atom
+    def eval_atom(atom: str) -> bool:
+        atom = atom.strip()
+
+        # symptom == X
+        m = re.match(r"^symptom\s*==\s*(.+)$", atom, re.IGNORECASE)
+        if m:
+            value = m.group(1).strip().lower()
+            return value in syms
+
+        # risk_flag == Y
+        m = re.match(r"^risk_flag\s*==\s*(.+)$", atom, re.IGNORECASE)
+        if m:
+            value = m.group(1).strip().lower()
+            return value in rfs
+
+        # cqN == yes → just check answer for question N
+        m = re.match(r"^cq(\d+)\s*==\s*yes$", atom, re.IGNORECASE)
+        if m:
+            idx = int(m.group(1))
+            return user_data.get("clarifying_answers", {})\
+                            .get(f"cq{idx}", "").strip().lower() == "yes"
+
+        # Unknown atom → False
+        return False
+
+    # Tokenize rule_str into parentheses, AND, OR, or atoms
+    parts = re.split(r"(\bAND\b|\bOR\b|\(|\))", rule_str, flags=re.IGNORECASE)
+    expr = ""
+    for part in parts:
+        part_strip = part.strip()
+        if re.fullmatch(r"AND", part_strip, re.IGNORECASE):
+            expr += " and "
+        elif re.fullmatch(r"OR", part_strip, re.IGNORECASE):
+            expr += " or "
+        elif part_strip in ("(", ")"):
+            expr += part_strip
+        elif part_strip:
+            # It's an atom
+            expr += str(eval_atom(part_strip))
+
+    # Finally, eval the boolean Python expression
+    try:
+        return bool(eval(expr))
+    except Exception:
+        return False
+
+
+def _cell(condition, col) -> str:
+    # Excel blanks come through as NaN; treat them as empty text
+    val = condition.get(col, "")
+    if val is None or (isinstance(val, float) and pd.isna(val)):
+        return ""
+    return str(val)
+
+
+class CompiledTemplate:
+    """
+    A narrative template parsed once into literal/field pieces.
+      - fields:  the placeholder names it uses
+      - errors:  unknown placeholders or malformed braces found at compile time
+    Unknown placeholders render as empty text; a malformed template renders
+    verbatim rather than raising.
+    """
+    __slots__ = ("source", "pieces", "fields", "errors")
+
+    def __init__(self, source: str):
+        self.source = source
+        self.pieces = []
+        self.fields = frozenset()
+        self.errors = []
+        try:
+            parsed = list(_FORMATTER.parse(source))
+        except ValueError as e:
+            self.errors.append(f"malformed template: {e}")
+            self.pieces = [(source.replace("{{", "{").replace("}}", "}"), None)]
+            return
+
+        fields = set()
+        for literal, field, _spec, _conv in parsed:
+            if field is not None:
+                if field not in TEMPLATE_FIELDS:
+                    self.errors.append(f"unknown placeholder {{{field}}}")
+                fields.add(field)
+            self.pieces.append((literal, field))
+        self.fields = frozenset(fields)
+
+    def render(self, values: dict) -> str:
+        return "".join(
+            literal + (values.get(field, "") if field is not None else "")
+            for literal, field in self.pieces
+        )
+
+
+class CompiledCondition:
+    """
+    Everything make_recommendation needs from one workbook row, with both
+    templates compiled and a per-row cache of finished HTML fragments.
+    """
+
+    def __init__(self, condition):
+        self.name          = _cell(condition, "Condition")
+        self.acuity        = condition.get("Acuity Level", 0)
+        self.confidence    = condition.get("Labeling Confidence", "Low")
+        self.rule          = _cell(condition, "Labeling Rule")
+        self.default_rec   = _cell(condition, "Default Recommendation")
+        self.escalated_rec = _cell(condition, "Escalated Recommendation")
+        self.emergency     = _cell(condition, EMERGENCY_COL).strip()
+        self.referral      = _cell(condition, "Referral").strip()
+        self.default_tmpl   = CompiledTemplate(_cell(condition, DEFAULT_TEMPLATE_COL))
+        self.escalated_tmpl = CompiledTemplate(_cell(condition, ESCALATED_TEMPLATE_COL))
+        self.certainty     = "very likely" if self.confidence == "High" else "symptoms suggest"
+        self._fragments    = {}
+
+    def is_escalated(self, risk_flags) -> bool:
+        return bool(risk_flags) or (self.acuity == 3)
+
+    def recommendation(self, risk_flags: list) -> str:
+        """Same text make_recommendation always produced, minus the str.format."""
+        # Confidence guard
+        if self.confidence == "Low":
+            return ""
+
+        if self.is_escalated(risk_flags):
+            tmpl, rec_text = self.escalated_tmpl, self.escalated_rec
+        else:
+            tmpl, rec_text = self.default_tmpl, self.default_rec
+
+        base = tmpl.render({
+            "certainty":     self.certainty,
+            "risk_flags":    ", ".join(risk_flags),
+            "default_rec":   self.default_rec,
+            "escalated_rec": self.escalated_rec,
+        })
+
+        # Build recommendation without duplication
+        if tmpl.fields & {"default_rec", "escalated_rec"}:
+            recommendation = base
+        else:
+            recommendation = f"{base} {rec_text}".strip()
+
+        if self.emergency:
+            recommendation += f"{EMERGENCY_MARKER}{self.emergency}"
+        return recommendation
+
+    def fragments(self, risk_flags: list, card_escalated: bool):
+        """
+        Returns (card_html, emergency_html) for the results page, cached per
+        (escalated, card colour, risk-flag set). card_html is "" when the
+        confidence guard rejects the row. Flags only join the key when the
+        chosen template actually prints them.
+        """
+        is_esc = self.is_escalated(risk_flags)
+        tmpl = self.escalated_tmpl if is_esc else self.default_tmpl
+        flags_key = tuple(risk_flags) if "risk_flags" in tmpl.fields else ()
+        key = (is_esc, bool(card_escalated), flags_key)
+
+        cached = self._fragments.get(key)
+        if cached is not None:
+            return cached
+
+        recommendation = self.recommendation(list(risk_flags))
+        card_html = ""
+        if recommendation:
+            main_text = recommendation.split(EMERGENCY_MARKER)[0].strip()
+            block_class = "report-block" if card_escalated else "report-block report-block--ok"
+            card_html = (
+                f"<div class='{block_class}'>"
+                f"{main_text.replace(chr(10), '<br>')}"
+                "</div>"
+            )
+            if self.referral:
+                card_html += f"<p><strong>{self.referral}</strong></p>"
+
+        emergency_html = ""
+        if recommendation and self.emergency:
+            emergency_html = (
+                f"<div class='emergency-block'>🚨 Important: {self.emergency}</div>"
+            )
+
+        self._fragments[key] = (card_html, emergency_html)
+        return card_html, emergency_html
+
+
+def compile_recommendations(db: pd.DataFrame):
+    """
+    Compile every row of the workbook.
+    Returns ({row index: CompiledCondition}, problems) where problems is a list
+    of {"row", "condition", "column", "error"} dicts for bad templates.
+    """
+    compiled = {}
+    problems = []
+    for idx, row in db.iterrows():
+        cc = CompiledCondition(row)
+        compiled[idx] = cc
+        problems += template_problems(idx, cc)
+    return compiled, problems
+
+
+def template_problems(idx, cc: CompiledCondition) -> list:
+    """The {"row", "condition", "column", "error"} problems of one compiled row."""
+    return [{"row": idx, "condition": cc.name, "column": col, "error": err}
+            for col, tmpl in ((DEFAULT_TEMPLATE_COL, cc.default_tmpl), (ESCALATED_TEMPLATE_COL, cc.escalated_tmpl))
+            for err in tmpl.errors]
+
+
+def build_recommendations(snapshot) -> dict:
+    """
+    Snapshot builder for the "recommendations" artifact. The template problems
+    found while compiling are kept as the "template_problems" artifact, so
+    whoever builds first (a session, the API or warmup.py) doesn't lose them.
+    """
+    compiled, problems = compile_recommendations(snapshot.db)
+    snapshot.derived("template_problems", lambda s: problems)
+    return compiled
+
+
+def make_recommendation(condition: dict, user_flags: dict, risk_flags: list,
+                        compiled: CompiledCondition = None) -> str:
+    """
+    Recommendation text for a condition row. Pass the precompiled row when
+    you have one; otherwise the row is compiled on the fly.
+    """
+    if compiled is None:
+        compiled = CompiledCondition(condition)
+    return compiled.recommendation(risk_flags)
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental rebuilds when a workbook is edited.
+
+Editors change a handful of rows at a time. When a workbook's content
+changes, the registry still parses the whole new file (an xlsx can't be
+read in part, and parsing is the cheap part), but the derived artifacts are
+no longer all rebuilt from scratch: reindex(old, new) compares the new
+snapshot with the previous one of the same workbook and seeds the new one
+with the previous artifacts, patched for what changed.
+
+  fingerprints  one 64-bit content hash per row over all its cells
+                (pandas.util.hash_pandas_object, categoricals by value).
+                Rows are paired by fingerprint, so inserting a row doesn't
+                make every row below it "changed".
+  delta         added, removed and modified rows (a removed and an added row
+                with the same Primary Category, SubCategory and Condition
+                are one modified row, with the columns that changed), and
+                FreeTextMap entries added, removed or changed.
+
+Artifacts carried over (only those the previous snapshot had built):
+  matcher_index    Phrases reused per Symptoms cell; only new cells are tokenized
+  vocabularies     symptom / risk-flag tuples reused per cell
+  recommendations  compiled rows and their template problems reused per fingerprint
+  symptom_masks    reused per pathway whose rows are all unchanged
+  decision_table   likewise; only edited pathways are recompiled
+Rows that only moved keep their artifacts under their new labels. The rest
+(partitions, menus, suggestions, shard workers) is rebuilt lazily from these
+as before. The FreeTextMap has no derived structure (normalize_free_text
+reads the dict), so its changes are only logged.
+
+Every reindex appends a changelog entry to LEXAI_CHANGELOG (default
+workbook_changelog.jsonl; CHANGELOG keeps the recent ones in memory):
+versions, the changed rows by condition, FreeTextMap changes and the time
+spent per artifact.
+
+    python reindex.py old.xlsx new.xlsx    # delta, and incremental vs full rebuild times
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+
+import pandas as pd
+
+from decisions import build_decision_table, compile_pathway, escalated_rows
+from matcher import MatcherIndex, phrases_of
+from recommend import CompiledCondition, build_recommendations, template_problems
+from triage import _split_interned, build_matcher_index, build_symptom_masks, build_vocabularies, pathway_masks
+
+
+CHANGELOG_PATH = os.environ.get("LEXAI_CHANGELOG", "workbook_changelog.jsonl")
+CHANGELOG = deque(maxlen=50)     # recent entries of this process, newest last
+PATHWAY_KEYS = ["Primary Category", "SubCategory"]
+SHOW_ROWS = 50                   # changed rows listed per changelog entry
+
+
+def row_fingerprints(db: pd.DataFrame) -> list:
+    return pd.util.hash_pandas_object(db, index=False).tolist()
+
+
+def _pathways(db: pd.DataFrame) -> dict:
+    """(primary, subcategory) → row labels, both in sheet order (as groupby(sort=False) yields them)."""
+    paths = {}
+    for label, primary, sub in zip(db.index, db[PATHWAY_KEYS[0]], db[PATHWAY_KEYS[1]]):
+        if not (pd.isna(primary) or pd.isna(sub)):
+            paths.setdefault((primary, sub), []).append(label)
+    return paths
+
+
+def _identity(db: pd.DataFrame, label) -> tuple:
+    return tuple(str(db.at[label, c]) if c in db.columns else "" for c in PATHWAY_KEYS + ["Condition"])
+
+
+def _changed_columns(old: pd.DataFrame, new: pd.DataFrame, old_label, new_label) -> list:
+    changed = []
+    for col in new.columns:
+        a = old.at[old_label, col] if col in old.columns else None
+        b = new.at[new_label, col]
+        if not ((pd.isna(a) and pd.isna(b)) if pd.api.types.is_scalar(a) and pd.api.types.is_scalar(b) else False) \
+                and str(a) != str(b):
+            changed.append(col)
+    return changed + [c for c in old.columns if c not in new.columns]
+
+
+class WorkbookDelta:
+    """
+    What changed between two snapshots of one workbook. same maps each
+    unchanged row's new label to its old label; added / removed / modified
+    hold labels (modified: (old label, new label, changed columns)).
+    """
+
+    def __init__(self, old, new):
+        pool = defaultdict(deque)
+        for label, fp in zip(old.db.index, row_fingerprints(old.db)):
+            pool[fp].append(label)
+        self.same, added = {}, []
+        for label, fp in zip(new.db.index, row_fingerprints(new.db)):
+            if pool.get(fp):
+                self.same[label] = pool[fp].popleft()
+            else:
+                added.append(label)
+        removed = sorted(label for labels in pool.values() for label in labels)
+
+        # a removed and an added row with the same identity are one edited row
+        by_identity = defaultdict(deque)
+        for label in removed:
+            by_identity[_identity(old.db, label)].append(label)
+        self.added, self.modified = [], []
+        for label in added:
+            match = by_identity.get(_identity(new.db, label))
+            if match:
+                o = match.popleft()
+                self.modified.append((o, label, _changed_columns(old.db, new.db, o, label)))
+            else:
+                self.added.append(label)
+        paired = {o for o, _, _ in self.modified}
+        self.removed = [label for label in removed if label not in paired]
+
+        old_paths, self.new_paths = _pathways(old.db), _pathways(new.db)
+        self.unchanged_pathways = {
+            key for key, rows in self.new_paths.items()
+            if len(rows) == len(old_paths.get(key, ()))
+            and all(self.same.get(n) == o for n, o in zip(rows, old_paths[key]))
+        }
+        self.moved = {o: n for n, o in self.same.items() if o != n}   # old label → new label
+
+        old_ft, new_ft = old.ft_map, new.ft_map
+        self.ft_added   = sorted(k for k in new_ft if k not in old_ft)
+        self.ft_removed = sorted(k for k in old_ft if k not in new_ft)
+        self.ft_changed = sorted(k for k in new_ft if k in old_ft and new_ft[k] != old_ft[k])
+        self.rows = len(new.db)
+
+    @property
+    def changed_rows(self) -> int:
+        return len(self.added) + len(self.removed) + len(self.modified)
+
+    def relabel(self, label):
+        return self.moved.get(label, label)
+
+
+# --- artifact updaters: (old value, old snapshot, new snapshot, delta) → new value ---
+
+def update_matcher_index(index, old, new, delta):
+    by_cell = {str(cell): phrases for cell, (_, phrases) in zip(old.db["Symptoms"], index.rows)}
+    rows = []
+    for idx, cell in new.db["Symptoms"].items():
+        phrases = by_cell.get(str(cell))
+        rows.append((idx, phrases if phrases is not None else phrases_of(cell)))
+    return MatcherIndex(rows)
+
+
+def update_vocabularies(vocab, old, new, delta):
+    out = {"symptoms": {}, "risk_flags": {}}
+    for key, col in (("symptoms", "Symptoms"), ("risk_flags", "RiskFlags")):
+        if col not in new.db.columns:
+            continue
+        by_cell = {}
+        if col in old.db.columns:
+            by_cell = {raw: vocab[key][idx] for idx, raw in old.db[col].dropna().items()}
+        out[key] = {idx: by_cell[raw] if raw in by_cell else _split_interned(raw)
+                    for idx, raw in new.db[col].dropna().items()}
+    return out
+
+
+def update_recommendations(compiled, old, new, delta):
+    old_problems = defaultdict(list)
+    for p in old.derived("template_problems", lambda s: []):
+        old_problems[p["row"]].append(p)
+    out, problems = {}, []
+    for idx in new.db.index:
+        o = delta.same.get(idx)
+        if o is not None and o in compiled:
+            out[idx] = compiled[o]
+            problems += [{**p, "row": idx} for p in old_problems.get(o, ())]
+        else:
+            out[idx] = cc = CompiledCondition(new.db.loc[idx])
+            problems += template_problems(idx, cc)
+    new.derived("template_problems", lambda s: problems)
+    return out
+
+
+def update_symptom_masks(masks, old, new, delta):
+    symptoms = new.derived("vocabularies", build_vocabularies)["symptoms"]
+    out = {}
+    for key, rows in delta.new_paths.items():
+        entry = masks.get(key) if key in delta.unchanged_pathways else None
+        if entry is not None:
+            out[key] = {**entry, "rows": tuple(delta.relabel(r) for r in entry["rows"])}
+        else:
+            out[key] = pathway_masks(rows, symptoms)
+    return out
+
+
+def update_decision_table(table, old, new, delta):
+    old_report = {(r["primary"], r["subcategory"]): r for r in table["report"]}
+    groups = None
+    pathways, report = {}, []
+    for key, rows in delta.new_paths.items():
+        if key in delta.unchanged_pathways and key in old_report:
+            entry, size = table["pathways"].get(key), old_report[key]
+            if entry is not None:
+                entry = {**entry, "rows": tuple(delta.relabel(r) for r in entry["rows"]),
+                         "candidates": tuple((delta.relabel(r), bit, a) for r, bit, a in entry["candidates"])}
+        else:
+            if groups is None:
+                groups = new.db.groupby(PATHWAY_KEYS, sort=False, observed=True)
+            entry, size = compile_pathway(*key, groups.get_group(key))
+        report.append(size)
+        if entry is not None:
+            pathways[key] = entry
+    return {"pathways": pathways, "escalated": escalated_rows(new.db), "report": report}
+
+
+# (artifact, full builder, updater) in dependency order
+UPDATERS = [
+    ("matcher_index",   build_matcher_index,   update_matcher_index),
+    ("vocabularies",    build_vocabularies,    update_vocabularies),
+    ("recommendations", build_recommendations, update_recommendations),
+    ("symptom_masks",   build_symptom_masks,   update_symptom_masks),
+    ("decision_table",  build_decision_table,  update_decision_table),
+]
+
+
+def reindex(old, new, log_path: str = None) -> dict:
+    """Seed new's artifacts from old's and record the changelog entry (returned)."""
+    t0 = time.perf_counter()
+    delta = WorkbookDelta(old, new)
+    diff_seconds = time.perf_counter() - t0
+
+    built = {a["artifact"] for a in old.artifacts()}
+    for name, _, update in UPDATERS:
+        if name in built:
+            value = old.derived(name, None)
+            new.derived(name, lambda s, value=value, update=update: update(value, old, s, delta))
+    seconds = {a["artifact"]: round(a["build_seconds"], 4) for a in new.artifacts()
+               if a["artifact"] in built and a["artifact"] != "workbook"}
+
+    entry = changelog_entry(old, new, delta)
+    entry["seconds"] = {"parse": round(new.load_seconds, 4), "diff": round(diff_seconds, 4), **seconds}
+    record(entry, log_path)
+    return entry
+
+
+def changelog_entry(old, new, delta) -> dict:
+    def condition(db, label):
+        return str(db.at[label, "Condition"]) if "Condition" in db.columns else str(label)
+
+    return {
+        "time": datetime.utcnow().isoformat(timespec="seconds"),
+        "source": new.source, "from_version": old.version, "to_version": new.version,
+        "rows": delta.rows, "changed_rows": delta.changed_rows,
+        "added": [{"row": n, "condition": condition(new.db, n)} for n in delta.added[:SHOW_ROWS]],
+        "removed": [{"row": o, "condition": condition(old.db, o)} for o in delta.removed[:SHOW_ROWS]],
+        "modified": [{"row": n, "condition": condition(new.db, n), "columns": cols}
+                     for _, n, cols in delta.modified[:SHOW_ROWS]],
+        "moved_rows": len(delta.moved),
+        "pathways_rebuilt": len(delta.new_paths) - len(delta.unchanged_pathways),
+        "freetext": {"added": delta.ft_added, "removed": delta.ft_removed, "changed": delta.ft_changed},
+    }
+
+
+def record(entry: dict, path: str = None):
+    CHANGELOG.append(entry)
+    path = path or CHANGELOG_PATH
+    if path:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+
+
+def recent_changes(limit: int = 20, path: str = None) -> list:
+    """The newest changelog entries, newest first (from the file if there is one)."""
+    path = path or CHANGELOG_PATH
+    if path and os.path.isfile(path):
+        with open(path, encoding="utf-8") as f:
+            lines = deque(f, maxlen=limit)
+        return [json.loads(line) for line in reversed(lines) if line.strip()]
+    return list(reversed(CHANGELOG))[:limit]
+
+
+def main(argv=None):
+    from workbook import snapshot_from_file
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("old")
+    ap.add_argument("new")
+    args = ap.parse_args(argv)
+
+    old = snapshot_from_file(args.old)
+    for name, build, _ in UPDATERS:
+        old.derived(name, build)
+
+    full = snapshot_from_file(args.new)
+    t0 = time.perf_counter()
+    for name, build, _ in UPDATERS:
+        full.derived(name, build)
+    full_s = time.perf_counter() - t0
+
+    entry = reindex(old, snapshot_from_file(args.new), log_path="")
+    print(f"{args.old} @ {old.version} → {args.new} @ {entry['to_version']}: {entry['rows']} rows, "
+          f"{entry['changed_rows']} changed ({len(entry['added'])} added, {len(entry['removed'])} removed, "
+          f"{len(entry['modified'])} modified), {entry['moved_rows']} moved, "
+          f"{entry['pathways_rebuilt']} pathways rebuilt")
+    for m in entry["modified"]:
+        print(f"  ~ {m['condition']}: {', '.join(m['columns'])}")
+    ft = entry["freetext"]
+    if any(ft.values()):
+        print(f"  FreeTextMap: +{len(ft['added'])} -{len(ft['removed'])} ~{len(ft['changed'])}")
+    incremental = sum(v for k, v in entry["seconds"].items() if k != "parse")
+    print(f"  artifacts: incremental {incremental:.3f} s (diff {entry['seconds']['diff']:.3f} s) vs full {full_s:.3f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
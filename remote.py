@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Workbooks served over HTTP(S), kept as a local on-disk copy.
+
+A tenant's "workbook" (see workbook.py) may be an http:// or https:// URL.
+The first use downloads it into LEXAI_REMOTE_CACHE (default .lexai_remote/)
+next to a small JSON file holding the response's ETag and Last-Modified.
+After that the copy is revalidated at most every LEXAI_REMOTE_REFRESH_S
+seconds (default 300) with a conditional GET, on a background thread: the
+request that finds the interval passed is served the current copy, and a
+new copy is picked up by the first snapshot() after it has been written.
+
+    304  nothing is written, so the registry sees the same file stamp and
+         neither re-hashes nor re-parses the workbook
+    200  the new body replaces the copy atomically
+    error / timeout (LEXAI_REMOTE_TIMEOUT_S, default 10)
+         the last good copy keeps being served; the next attempt waits
+         for the next interval
+
+Only a first download that fails raises. A copy left by an earlier process
+is reused after a restart and revalidated on first use.
+
+    python remote.py https://example.org/SymptomBotDB.xlsx    # fetch / revalidate once
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+CACHE_DIR = os.environ.get("LEXAI_REMOTE_CACHE", ".lexai_remote")
+REFRESH_S = float(os.environ.get("LEXAI_REMOTE_REFRESH_S", 300))
+TIMEOUT_S = float(os.environ.get("LEXAI_REMOTE_TIMEOUT_S", 10))
+
+
+def is_remote(source: str) -> bool:
+    return source.startswith(("http://", "https://"))
+
+
+class RemoteWorkbook:
+    """
+    One URL's local copy. path() returns the copy's path; when the refresh
+    interval has passed it also starts a revalidation in the background
+    (only the very first download is waited for). Safe to share between
+    threads: at most one revalidation runs at a time.
+    """
+
+    def __init__(self, url: str, cache_dir: str = None, refresh_s: float = None, timeout_s: float = None):
+        self.url       = url
+        self.cache_dir = cache_dir or CACHE_DIR
+        self.refresh_s = REFRESH_S if refresh_s is None else refresh_s
+        self.timeout_s = TIMEOUT_S if timeout_s is None else timeout_s
+        name = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+        ext = os.path.splitext(url.split("?", 1)[0])[1] or ".xlsx"
+        self.local     = os.path.join(self.cache_dir, name + ext)
+        self.meta_path = os.path.join(self.cache_dir, name + ".json")
+        self.meta      = self._read_meta()
+        self.counts    = {"fetched": 0, "not_modified": 0, "errors": 0}
+        self.last_error = None
+        self._next_check = 0.0
+        self._lock     = threading.Lock()
+
+    def _read_meta(self) -> dict:
+        try:
+            with open(self.meta_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_meta(self):
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp, self.meta_path)
+
+    @property
+    def has_copy(self) -> bool:
+        return os.path.isfile(self.local)
+
+    def path(self) -> str:
+        if not self.has_copy:
+            with self._lock:
+                if not self.has_copy:
+                    self.refresh()   # raises if the download fails
+        elif time.time() >= self._next_check and self._lock.acquire(blocking=False):
+            # (if a revalidation is already running, there is nothing to start)
+            self._next_check = time.time() + self.refresh_s
+            threading.Thread(target=self._refresh_locked, name="remote-workbook", daemon=True).start()
+        return self.local
+
+    def _refresh_locked(self):
+        """Background revalidation; runs holding _lock (taken by path())."""
+        try:
+            self.refresh()
+        except Exception as e:   # e.g. the cache dir became unwritable: keep serving the copy
+            self.counts["errors"] += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+        finally:
+            self._lock.release()
+
+    def refresh(self) -> str:
+        """
+        One conditional GET. Returns "fetched", "not_modified" or "error";
+        an error only raises if there is no local copy to fall back to.
+        """
+        self._next_check = time.time() + self.refresh_s
+        req = urllib.request.Request(self.url)
+        if self.has_copy:
+            if self.meta.get("etag"):
+                req.add_header("If-None-Match", self.meta["etag"])
+            if self.meta.get("last_modified"):
+                req.add_header("If-Modified-Since", self.meta["last_modified"])
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout_s) as resp:
+                data = resp.read()
+                headers = resp.headers
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and self.has_copy:
+                self.counts["not_modified"] += 1
+                self.meta["checked_at"] = time.time()
+                self._write_meta()
+                return "not_modified"
+            return self._failed(e)
+        except (urllib.error.URLError, OSError) as e:   # offline, DNS, timeout, reset
+            return self._failed(e)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = self.local + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self.local)
+        now = time.time()
+        self.meta = {
+            "url": self.url, "etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified"),
+            "bytes": len(data), "fetched_at": now, "checked_at": now,
+        }
+        self._write_meta()
+        self.counts["fetched"] += 1
+        self.last_error = None
+        return "fetched"
+
+    def _failed(self, error) -> str:
+        self.counts["errors"] += 1
+        self.last_error = f"{type(error).__name__}: {error}"
+        if not self.has_copy:
+            raise OSError(f"{self.url}: {self.last_error}") from error
+        return "error"
+
+    def status(self) -> dict:
+        return {"url": self.url, "local": self.local, **self.counts, "last_error": self.last_error,
+                "etag": self.meta.get("etag"), "last_modified": self.meta.get("last_modified"),
+                "fetched_at": self.meta.get("fetched_at"), "checked_at": self.meta.get("checked_at")}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("url")
+    ap.add_argument("--cache-dir", default=CACHE_DIR)
+    args = ap.parse_args(argv)
+
+    remote = RemoteWorkbook(args.url, args.cache_dir)
+    try:
+        result = remote.refresh()
+    except OSError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"{result}: {remote.local}")
+    print(json.dumps(remote.status(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
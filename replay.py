@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Replay recorded free-text searches (see traffic.py) against a matcher build
+and workbook, and report result diffs and latency deltas.
+
+    python replay.py traffic.jsonl
+    python replay.py traffic.jsonl --engine my_matcher.py --workbook SymptomBotDB-3.xlsx --jobs 8
+    python replay.py traffic.jsonl --baseline-engine matcher --engine my_matcher.py --out report.json
+
+Without --baseline-engine the candidate is compared with what production
+returned at record time. With it, both engines run on the same corpus and
+workbook. An engine is a module name or .py path exposing
+MatcherIndex.from_db(db) and match_free_text(text, index), optionally
+normalize_free_text(raw, ft_map). Results are compared by condition name, so
+the corpus can be replayed against a different workbook version.
+"""
+
+import argparse
+import importlib
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from traffic import read_log
+
+
+def load_engine(spec: str):
+    if spec.endswith(".py") or os.sep in spec:
+        name = os.path.splitext(os.path.basename(spec))[0]
+        mod_spec = importlib.util.spec_from_file_location(f"replay_engine_{name}", spec)
+        module = importlib.util.module_from_spec(mod_spec)
+        mod_spec.loader.exec_module(module)
+        return module
+    return importlib.import_module(spec)
+
+
+# --- worker side (one snapshot + per-partition indexes per process) ---
+
+_worker = {}
+
+
+def _init_worker(workbook: str, engines: list):
+    from triage import build_partitions
+    from workbook import snapshot_from_file
+
+    snapshot = snapshot_from_file(workbook)
+    partitions = snapshot.derived("partitions", build_partitions)
+    _worker["snapshot"] = snapshot
+    _worker["engines"] = []
+    for spec in engines:
+        engine = load_engine(spec)
+        indexes = {key: engine.MatcherIndex.from_db(snapshot.db.loc[p["rows"]])
+                   for key, p in partitions.items()}
+        _worker["engines"].append((engine, indexes))
+
+
+def _run(engine, indexes, snapshot, rec):
+    from matcher import normalize_free_text as default_normalize
+
+    normalize = getattr(engine, "normalize_free_text", default_normalize)
+    key = (rec.get("g"), rec.get("b")) if rec.get("g") else None
+    index = indexes.get(key, indexes[None])
+    t0 = time.perf_counter()
+    text = normalize(rec["raw"], snapshot.ft_map)
+    rows = engine.match_free_text(text, index)
+    ms = (time.perf_counter() - t0) * 1000
+    conds = sorted(set(snapshot.db.loc[list(rows), "Condition"].astype(str)))
+    return conds, ms
+
+
+def _replay_chunk(records):
+    snapshot = _worker["snapshot"]
+    out = []
+    for rec in records:
+        results = [_run(engine, indexes, snapshot, rec) for engine, indexes in _worker["engines"]]
+        out.append(results)
+    return out
+
+
+# --- driver ---
+
+def _chunks(items, n):
+    size = max(1, len(items) // (n * 4) or 1)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def replay(log_path, workbook, engine, baseline_engine=None, jobs=None, limit=None):
+    records = []
+    for rec in read_log(log_path):
+        records.append(rec)
+        if limit and len(records) >= limit:
+            break
+
+    engines = [engine] + ([baseline_engine] if baseline_engine else [])
+    jobs = jobs or os.cpu_count() or 1
+    with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(workbook, engines)) as pool:
+        results = [r for chunk in pool.map(_replay_chunk, _chunks(records, jobs)) for r in chunk]
+
+    diffs, cand_ms, base_ms = [], [], []
+    for rec, res in zip(records, results):
+        cand_conds, c_ms = res[0]
+        if baseline_engine:
+            base_conds, b_ms = res[1]
+        else:
+            base_conds, b_ms = sorted(set(rec.get("conds", []))), rec.get("ms", 0.0)
+        cand_ms.append(c_ms)
+        base_ms.append(b_ms)
+        added   = sorted(set(cand_conds) - set(base_conds))
+        dropped = sorted(set(base_conds) - set(cand_conds))
+        if added or dropped:
+            diffs.append({"query": rec["raw"], "partition": [rec.get("g"), rec.get("b")],
+                          "added": added, "dropped": dropped,
+                          "baseline_ms": round(b_ms, 3), "candidate_ms": round(c_ms, 3)})
+
+    def pct(values, p):
+        if not values:
+            return 0.0
+        values = sorted(values)
+        return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+    return {
+        "queries": len(records),
+        "changed": len(diffs),
+        "unchanged_rate": (1 - len(diffs) / len(records)) if records else 1.0,
+        "latency_ms": {
+            "baseline":  {"p50": pct(base_ms, 50), "p95": pct(base_ms, 95), "mean": statistics.fmean(base_ms) if base_ms else 0.0},
+            "candidate": {"p50": pct(cand_ms, 50), "p95": pct(cand_ms, 95), "mean": statistics.fmean(cand_ms) if cand_ms else 0.0},
+        },
+        "baseline": baseline_engine or "recorded production results",
+        "candidate": engine,
+        "workbook": workbook,
+        "diffs": diffs,
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("log", help="traffic log written by traffic.TrafficRecorder")
+    ap.add_argument("--workbook", default="SymptomBotDB.xlsx")
+    ap.add_argument("--engine", default="matcher", help="candidate matcher (module or .py path)")
+    ap.add_argument("--baseline-engine", help="compare against this engine instead of the recorded results")
+    ap.add_argument("--jobs", type=int, help="worker processes (default: all cores)")
+    ap.add_argument("--limit", type=int, help="replay only the first N searches")
+    ap.add_argument("--out", help="write the full JSON report here")
+    ap.add_argument("--show", type=int, default=20, help="diffs to print")
+    args = ap.parse_args(argv)
+
+    report = replay(args.log, args.workbook, args.engine, args.baseline_engine, args.jobs, args.limit)
+    lat = report["latency_ms"]
+    print(f"{report['queries']} searches replayed, {report['changed']} changed "
+          f"({report['unchanged_rate']:.2%} unchanged)")
+    for side in ("baseline", "candidate"):
+        print(f"  {side:>9}: p50 {lat[side]['p50']:.2f} ms  p95 {lat[side]['p95']:.2f} ms  mean {lat[side]['mean']:.2f} ms")
+    for d in report["diffs"][:args.show]:
+        print(f"  {d['query']!r}: +{d['added']} -{d['dropped']}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 1 if report["changed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
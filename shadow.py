@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Shadow mode: run a candidate matcher engine next to production on live
+free-text searches, without changing what the patient sees.
+
+    LEXAI_SHADOW_ENGINE=my_matcher.py streamlit run app.py
+
+The engine is a module name or .py path with the same interface replay.py
+uses (MatcherIndex.from_db(db), match_free_text(text, index), optionally
+normalize_free_text(raw, ft_map)). After production has answered a search,
+submit() hands the raw text and the production rows to a small background
+pool (LEXAI_SHADOW_WORKERS, default 1) and returns at once. The worker runs
+the candidate on the same snapshot and demographic partition, and records
+whether the row sets agree, the added/dropped conditions and both latencies.
+
+Shadow work is bounded three ways, and skipped searches are only counted:
+  - sampling: LEXAI_SHADOW_SAMPLE percent of searches (default 10)
+  - a hard CPU budget: worker CPU time may use at most LEXAI_SHADOW_CPU_PCT
+    percent of wall time (default 5; a token bucket with a burst of
+    LEXAI_SHADOW_CPU_BURST_S seconds, default 2). Building the candidate's
+    indexes for a new workbook version is charged to it as well.
+  - a queue of at most 4 pending searches per worker
+The workers are threads of the server process, so they share its GIL; the
+CPU budget is what keeps them from slowing live reruns.
+
+Results go to a small SQLite file (LEXAI_SHADOW_DB, default shadow.sqlite):
+hourly rollups per engine and workbook version, a latency-ratio histogram,
+and the newest LEXAI_SHADOW_KEEP_DIFFS disagreements (default 200) with
+anonymized queries.
+"""
+
+import bisect
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from replay import load_engine
+from traffic import anonymize
+from triage import age_band, build_partitions
+
+
+SHADOW_DB = os.environ.get("LEXAI_SHADOW_DB", "shadow.sqlite")
+
+# candidate / production latency ratio bucket upper bounds
+RATIO_BUCKETS = (0.25, 0.5, 0.75, 0.9, 1.1, 1.25, 1.5, 2, 3, 5, 10, float("inf"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shadow_hourly (
+    engine TEXT, version TEXT, hour INTEGER, runs INTEGER, agreed INTEGER,
+    prod_ms REAL, cand_ms REAL, PRIMARY KEY (engine, version, hour)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS shadow_ratio_hist (
+    engine TEXT, version TEXT, bucket INTEGER, n INTEGER, PRIMARY KEY (engine, version, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS shadow_diffs (
+    t REAL, engine TEXT, version TEXT, query TEXT, added TEXT, dropped TEXT,
+    prod_ms REAL, cand_ms REAL
+);
+"""
+
+
+class ShadowRunner:
+    def __init__(self, engine: str = None, sample_pct: float = None, cpu_pct: float = None,
+                 workers: int = None, path: str = SHADOW_DB, keep_diffs: int = None):
+        env = os.environ.get
+        self.engine_spec = engine if engine is not None else env("LEXAI_SHADOW_ENGINE", "")
+        self.sample_pct  = sample_pct if sample_pct is not None else float(env("LEXAI_SHADOW_SAMPLE", 10))
+        self.cpu_pct     = cpu_pct if cpu_pct is not None else float(env("LEXAI_SHADOW_CPU_PCT", 5))
+        self.burst_s     = float(env("LEXAI_SHADOW_CPU_BURST_S", 2))
+        self.workers     = workers or int(env("LEXAI_SHADOW_WORKERS", 1))
+        self.keep_diffs  = keep_diffs or int(env("LEXAI_SHADOW_KEEP_DIFFS", 200))
+        self.path        = path
+        self.counts      = dict.fromkeys(("searches", "submitted", "skipped_sample", "skipped_budget",
+                                          "skipped_queue", "errors"), 0)
+        self.last_error  = None
+        self._engine     = None
+        self._lock       = threading.Lock()   # counters and budget (taken on the hot path)
+        self._db_lock    = threading.Lock()   # the SQLite connection, workers only
+        self._pending    = 0
+        self._allowance  = self.burst_s
+        self._refilled   = time.monotonic()
+        self._pool       = None
+        self._con        = None
+        if self.engine_spec:
+            self._engine = load_engine(self.engine_spec)
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="shadow-matcher")
+
+    @property
+    def enabled(self) -> bool:
+        return self._engine is not None
+
+    # --- hot path: after production answered ---
+
+    def submit(self, snapshot, gender, age, raw: str, normalized: str, prod_rows, prod_ms: float) -> bool:
+        """Queue a shadow run if sampling, the CPU budget and the queue allow it. Never blocks."""
+        if not self.enabled:
+            return False
+        with self._lock:
+            self.counts["searches"] += 1
+            if random.random() * 100 >= self.sample_pct:
+                self.counts["skipped_sample"] += 1
+                return False
+            self._refill()
+            if self._allowance <= 0:
+                self.counts["skipped_budget"] += 1
+                return False
+            if self._pending >= 4 * self.workers:
+                self.counts["skipped_queue"] += 1
+                return False
+            self._pending += 1
+            self.counts["submitted"] += 1
+        self._pool.submit(self._run, snapshot, gender, age, raw, normalized, list(prod_rows), prod_ms)
+        return True
+
+    def _refill(self):
+        now = time.monotonic()
+        self._allowance = min(self.burst_s, self._allowance + (now - self._refilled) * self.cpu_pct / 100)
+        self._refilled = now
+
+    # --- worker ---
+
+    def _indexes(self, snapshot) -> dict:
+        engine = self._engine
+
+        def build(snap):
+            partitions = snap.derived("partitions", build_partitions)
+            return {key: engine.MatcherIndex.from_db(snap.db.loc[p["rows"]]) for key, p in partitions.items()}
+
+        return snapshot.derived(f"shadow:{self.engine_spec}", build)
+
+    def _run(self, snapshot, gender, age, raw, normalized, prod_rows, prod_ms):
+        cpu0 = time.thread_time()
+        try:
+            indexes = self._indexes(snapshot)
+            key = (gender, age_band(age))
+            index = indexes.get(key, indexes[None])
+            normalize = getattr(self._engine, "normalize_free_text", None)
+            t0 = time.perf_counter()
+            text = normalize(raw, snapshot.ft_map) if normalize else normalized
+            rows = self._engine.match_free_text(text, index)
+            cand_ms = (time.perf_counter() - t0) * 1000
+            self._record(snapshot, normalized, set(prod_rows), set(rows), prod_ms, cand_ms)
+        except Exception as e:   # a broken candidate must never surface to patients
+            with self._lock:
+                self.counts["errors"] += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._refill()
+                self._allowance -= time.thread_time() - cpu0
+
+    def _connect(self):
+        if self._con is None:
+            self._con = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._con.execute("PRAGMA journal_mode=WAL")
+            self._con.executescript(SCHEMA)
+        return self._con
+
+    def _record(self, snapshot, query, prod, cand, prod_ms, cand_ms):
+        agreed = prod == cand
+        ratio = cand_ms / prod_ms if prod_ms > 0 else float("inf")
+        bucket = bisect.bisect_left(RATIO_BUCKETS, ratio)
+        key = (self.engine_spec, snapshot.version)
+        hour = int(time.time() // 3600)
+        with self._db_lock:
+            con = self._connect()
+            with con:
+                con.execute("INSERT OR IGNORE INTO shadow_hourly VALUES (?,?,?,0,0,0,0)", (*key, hour))
+                con.execute(
+                    "UPDATE shadow_hourly SET runs = runs + 1, agreed = agreed + ?, prod_ms = prod_ms + ?, "
+                    "cand_ms = cand_ms + ? WHERE engine = ? AND version = ? AND hour = ?",
+                    (int(agreed), prod_ms, cand_ms, *key, hour))
+                con.execute("INSERT OR IGNORE INTO shadow_ratio_hist VALUES (?,?,?,0)", (*key, bucket))
+                con.execute("UPDATE shadow_ratio_hist SET n = n + 1 WHERE engine = ? AND version = ? AND bucket = ?",
+                            (*key, bucket))
+                if not agreed:
+                    conds = snapshot.db["Condition"]
+                    con.execute("INSERT INTO shadow_diffs VALUES (?,?,?,?,?,?,?,?)", (
+                        time.time(), *key, anonymize(query),
+                        json.dumps(sorted({str(conds.at[r]) for r in cand - prod})),
+                        json.dumps(sorted({str(conds.at[r]) for r in prod - cand})),
+                        prod_ms, cand_ms))
+                    con.execute("DELETE FROM shadow_diffs WHERE rowid NOT IN "
+                                "(SELECT rowid FROM shadow_diffs ORDER BY t DESC LIMIT ?)", (self.keep_diffs,))
+
+    def flush(self, timeout: float = 5.0):
+        """Wait (up to timeout) for queued shadow runs to finish."""
+        deadline = time.time() + timeout
+        while self._pending and time.time() < deadline:
+            time.sleep(0.01)
+
+    # --- reporting ---
+
+    def summary(self) -> list:
+        """Per engine and workbook version: runs, agreement rate, mean latencies, latency ratio p50/p95."""
+        if not os.path.isfile(self.path):
+            return []
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            totals = con.execute(
+                "SELECT engine, version, SUM(runs), SUM(agreed), SUM(prod_ms), SUM(cand_ms) "
+                "FROM shadow_hourly GROUP BY engine, version").fetchall()
+            hist = {}
+            for engine, version, bucket, n in con.execute("SELECT engine, version, bucket, n FROM shadow_ratio_hist"):
+                hist.setdefault((engine, version), {})[bucket] = n
+        finally:
+            con.close()
+        rows = []
+        for engine, version, runs, agreed, prod_ms, cand_ms in totals:
+            counts = hist.get((engine, version), {})
+            rows.append({
+                "engine": engine, "version": version, "runs": runs,
+                "agreement": agreed / runs if runs else None,
+                "prod_ms_mean": prod_ms / runs if runs else None,
+                "cand_ms_mean": cand_ms / runs if runs else None,
+                "ratio_p50": _bucket_quantile(counts, 0.5),
+                "ratio_p95": _bucket_quantile(counts, 0.95),
+            })
+        return rows
+
+    def diffs(self, limit: int = 50) -> list:
+        if not os.path.isfile(self.path):
+            return []
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            cur = con.execute("SELECT t, engine, version, query, added, dropped, prod_ms, cand_ms "
+                              "FROM shadow_diffs ORDER BY t DESC LIMIT ?", (limit,))
+            return [{"time": t, "engine": e, "version": v, "query": q, "added": json.loads(a),
+                     "dropped": json.loads(d), "prod_ms": pm, "cand_ms": cm}
+                    for t, e, v, q, a, d, pm, cm in cur]
+        finally:
+            con.close()
+
+
+def _bucket_quantile(counts: dict, q: float):
+    """Upper bound of the ratio bucket holding quantile q."""
+    total = sum(counts.values())
+    if not total:
+        return None
+    seen = 0
+    for bucket in sorted(counts):
+        seen += counts[bucket]
+        if seen >= q * total:
+            return RATIO_BUCKETS[bucket]
+    return None
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Intra-query parallel free-text matching for very large workbooks.
+
+The matcher index of a snapshot is split round-robin into one shard per
+worker process. Each worker receives its shard (and the demographic
+partitions' row lists) once, when it starts, and keeps it resident; a query
+then only ships the normalized text and partition key out and the matched
+row labels back. Shard results are merged in row order, and their per-stage
+counters are added to matcher.STATS as if the query had run in-process.
+
+Small workbooks stay in-process: a sharded matcher is only built when the
+index has at least LEXAI_SHARD_MIN_PHRASES symptom phrases (default 5,000,
+about 1,300 rows or ~55 ms per query in-process, against ~1 ms of fan-out
+overhead) and more than one core is available (LEXAI_MATCH_WORKERS, default:
+all cores). Workers are spawned, not forked, since the Streamlit server is
+multi-threaded, and are shut down with the snapshot.
+
+A query waits for the shards at most its fuzzy budget plus
+LEXAI_SHARD_TIMEOUT_S (default 5 s). A shard that doesn't answer in time is
+treated like a dead worker: the worker processes are terminated, and the
+sharded matcher raises from then on, so triage.match_rows answers in-process.
+"""
+
+import multiprocessing
+import os
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from matcher import STATS, MatcherIndex, match_with_stages
+
+
+MIN_PHRASES = int(os.environ.get("LEXAI_SHARD_MIN_PHRASES", 5000))
+TIMEOUT_S   = float(os.environ.get("LEXAI_SHARD_TIMEOUT_S", 5))
+
+
+def available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def phrase_count(index: MatcherIndex) -> int:
+    return sum(len(phrases) for _, phrases in index.rows)
+
+
+# --- worker side ---
+
+_shard = {}
+
+
+def _load_shard(index: MatcherIndex, partitions: dict):
+    _shard[None] = index
+    for key, rows in partitions.items():
+        _shard[key] = index.slice(rows)
+
+
+def _match_shard(text: str, key, fuzzy: bool = True, budget_s: float = None):
+    return match_with_stages(text, _shard.get(key, _shard[None]), fuzzy, budget_s)
+
+
+# --- driver ---
+
+class ShardedMatcher:
+    """
+    index split over `workers` resident processes. match(text, key) fans the
+    query out to every shard and merges the row labels. partitions maps a
+    partition key to its row labels (see triage.build_partitions).
+    """
+
+    def __init__(self, index: MatcherIndex, partitions: dict = None, workers: int = None):
+        workers = workers or int(os.environ.get("LEXAI_MATCH_WORKERS", 0)) or available_cores()
+        partitions = partitions or {}
+        ctx = multiprocessing.get_context("spawn")
+        self.workers   = workers
+        self.rows      = len(index)
+        self.executors = []
+        self.failed    = None   # why the shards were given up on, if they were
+        for n in range(workers):
+            shard = MatcherIndex(index.rows[n::workers])
+            self.executors.append(ProcessPoolExecutor(
+                1, mp_context=ctx, initializer=_load_shard, initargs=(shard, partitions)))
+        weakref.finalize(self, _shutdown, list(self.executors))
+
+    def match(self, text: str, key=None) -> list:
+        return self.search(text, key)[0]
+
+    def search(self, text: str, key=None, fuzzy: bool = True, budget_s: float = None, record: bool = True) -> tuple:
+        """(sorted row labels, complete) – see matcher.match_with_stages."""
+        if self.failed:
+            raise RuntimeError(f"sharded matcher down: {self.failed}")
+        futures = [ex.submit(_match_shard, text, key, fuzzy, budget_s) for ex in self.executors]
+        deadline = time.monotonic() + (budget_s or 0) + TIMEOUT_S
+        rows, merged, complete = [], {}, True
+        for f in futures:
+            try:
+                shard_rows, per_stage, shard_complete = f.result(timeout=max(0.0, deadline - time.monotonic()))
+            except TimeoutError:
+                # a hung worker: give up on the shards like on a dead one
+                self.failed = f"shard timed out after {(budget_s or 0) + TIMEOUT_S:g} s"
+                self.close(terminate=True)
+                raise
+            rows.extend(shard_rows)
+            complete = complete and shard_complete
+            for stage, (n, checked, seconds) in per_stage.items():
+                m = merged.setdefault(stage, [0, 0, 0.0])
+                m[0] += n
+                m[1] += checked
+                m[2] += seconds
+        if record:
+            STATS.add(merged)
+        return sorted(rows), complete
+
+    def close(self, terminate: bool = False):
+        _shutdown(self.executors, terminate)
+        self.failed = self.failed or "closed"
+
+
+def _shutdown(executors, terminate: bool = False):
+    for ex in executors:
+        # shutdown() doesn't stop a worker stuck in a task; terminate() does
+        processes = list((getattr(ex, "_processes", None) or {}).values()) if terminate else []
+        ex.shutdown(wait=False, cancel_futures=True)
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+
+
+def build_sharded_matcher(index: MatcherIndex, partitions: dict = None, min_phrases: int = None):
+    """A ShardedMatcher for index, or None when it should stay in-process."""
+    min_phrases = MIN_PHRASES if min_phrases is None else min_phrases
+    workers = int(os.environ.get("LEXAI_MATCH_WORKERS", 0)) or available_cores()
+    if workers < 2 or phrase_count(index) < min_phrases:
+        return None
+    return ShardedMatcher(index, partitions, workers)
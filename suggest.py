@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+As-you-type symptom suggestions for the free-text input.
+
+The vocabulary is every distinct symptom in the workbook plus the
+FreeTextMap from_phrase keys, lowercased. Phrases are ranked by the number
+of rows they occur in, FreeTextMap keys after the workbook's own symptoms
+(ordered by their to_phrase's count). Each phrase is indexed under every
+word start, so "lower back pain" is found from "lo", "ba" and "pa". The
+keys are one sorted array: a prefix is a bisect range, and the best
+suggestions in it are the lowest phrase ranks (numpy, over a parallel int32
+array). The one- and two-character prefixes have the biggest ranges, so
+their suggestions are precomputed.
+
+When nothing starts with the typed prefix (3+ characters), it is retried
+with one edit: a character deleted, inserted, substituted or swapped with
+its neighbour. The prefix is walked like a trie path, stopping where the
+unedited head exists nowhere (edits further right can't help):
+  - near the start, where almost every character can follow the head,
+    substitutions and insertions at position i are two lookups in a copy
+    of the keys with their i-th character deleted (FUZZY_DEPTH positions)
+  - further in, only the characters that do follow the head are tried
+Each probe bisects only inside its head's range.
+
+Only the part after the last comma / semicolon is completed. Built once per
+workbook snapshot (snapshot.derived("suggest_index", build_suggest_index));
+`python bench.py suggest` times lookups at 1k..100k phrases.
+"""
+
+import bisect
+import re
+
+import numpy as np
+
+from matcher import _PHRASE_RE
+from triage import build_vocabularies
+
+
+MAX_SUGGESTIONS = 20     # precomputed per short prefix; suggest() limits are capped to this
+MIN_FUZZY_CHARS = 3      # shorter prefixes are too ambiguous to correct
+FUZZY_DEPTH     = 3      # leading positions with a deleted-character copy of the keys
+
+_SPACE_RE = re.compile(r"\s+")
+_WORD_START_RE = re.compile(r"(?<![\w'])\w")
+
+
+def _clean(text: str) -> str:
+    return _SPACE_RE.sub(" ", text.lower()).strip()
+
+
+class _SortedKeys:
+    """Sorted strings with the phrase rank each one stands for."""
+
+    def __init__(self, pairs: list):
+        pairs.sort()
+        self.keys = [k for k, _ in pairs]
+        self.ranks = np.fromiter((r for _, r in pairs), dtype=np.int32, count=len(pairs))
+
+    def range(self, prefix: str, lo: int = 0, hi: int = None) -> tuple:
+        """keys[lo:hi] that start with prefix; lo/hi narrow the search to a known enclosing range."""
+        hi = len(self.keys) if hi is None else hi
+        lo = bisect.bisect_left(self.keys, prefix, lo, hi)
+        if lo == hi or not self.keys[lo].startswith(prefix):
+            return lo, lo
+        return lo, bisect.bisect_left(self.keys, prefix + "\uffff", lo, hi)
+
+    def top(self, lo: int, hi: int, limit: int) -> list:
+        """Ranks of the `limit` best distinct phrases among keys[lo:hi]."""
+        ranks = self.ranks[lo:hi]
+        if len(ranks) > 4 * limit:
+            best = set(np.partition(ranks, 4 * limit)[:4 * limit].tolist())
+            if len(best) < limit:   # one phrase indexed under many word starts
+                best = np.unique(ranks).tolist()
+        else:
+            best = set(ranks.tolist())
+        return sorted(best)[:limit]
+
+    def children(self, head: str, lo: int, hi: int) -> list:
+        """[(char, lo, hi)] for each character that follows head in keys[lo:hi] (one bisect each)."""
+        n, children = len(head), []
+        while lo < hi:
+            key = self.keys[lo]
+            if len(key) == n:
+                lo += 1
+                continue
+            end = bisect.bisect_left(self.keys, head + key[n] + "\uffff", lo, hi)
+            children.append((key[n], lo, end))
+            lo = end
+        return children
+
+
+class SuggestIndex:
+    def __init__(self, weights: dict, aliases=()):
+        """weights: phrase → how many rows it occurs in; aliases rank after the rest."""
+        aliases = set(aliases)
+        self.phrases = sorted(weights, key=lambda p: (p in aliases, -weights[p], len(p), p))   # rank = position
+        pairs = [(phrase[m.start():], rank)
+                 for rank, phrase in enumerate(self.phrases) for m in _WORD_START_RE.finditer(phrase)]
+        self.words = _SortedKeys(pairs)
+        self.deleted = [_SortedKeys([(k[:i] + k[i + 1:], r) for k, r in pairs if len(k) > i])
+                        for i in range(FUZZY_DEPTH)]
+        self._short = {}
+        for prefix in {k[:n] for k in self.words.keys for n in (1, 2)}:
+            self._short[prefix] = self.words.top(*self.words.range(prefix), MAX_SUGGESTIONS)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        symptoms = snapshot.derived("vocabularies", build_vocabularies)["symptoms"]
+        weights, aliases = {}, []
+        for row_symptoms in symptoms.values():
+            for s in set(row_symptoms):
+                s = _clean(s)
+                if s:
+                    weights[s] = weights.get(s, 0) + 1
+        for source, target in snapshot.ft_map.items():
+            source = _clean(source)
+            if source and source not in weights:
+                weights[source] = weights.get(_clean(target), 0)
+                aliases.append(source)
+        return cls(weights, aliases)
+
+    def __len__(self):
+        return len(self.phrases)
+
+    def _prefix(self, prefix: str, limit: int) -> list:
+        if len(prefix) <= 2:
+            return self._short.get(prefix, [])[:limit]
+        return self.words.top(*self.words.range(prefix), limit)
+
+    def _one_edit(self, prefix: str, limit: int) -> list:
+        words, found, seen = self.words, set(), set()
+
+        def probe(table, variant, lo=0, hi=None):
+            if (id(table), variant) not in seen:
+                seen.add((id(table), variant))
+                lo, hi = table.range(variant, lo, hi)
+                if hi > lo:
+                    found.update(table.top(lo, hi, limit))
+
+        lo, hi = 0, len(words.keys)
+        for i in range(len(prefix)):
+            head, rest = prefix[:i], prefix[i:]
+            dropped = head + rest[1:]
+            probe(words, dropped, lo, hi)                                     # deletion
+            if len(rest) > 1:
+                probe(words, head + rest[1] + rest[0] + rest[2:], lo, hi)     # swap
+            if i < FUZZY_DEPTH:
+                probe(self.deleted[i], dropped)                               # substitution
+                probe(self.deleted[i], prefix)                                # insertion
+            else:
+                for c, clo, chi in words.children(head, lo, hi):
+                    probe(words, head + c + rest[1:], clo, chi)               # substitution
+                    probe(words, head + c + rest, clo, chi)                   # insertion
+            lo, hi = words.range(head + rest[0], lo, hi)
+            if lo == hi:
+                break
+        return sorted(found)[:limit]
+
+    def suggest(self, text: str, limit: int = 8) -> list:
+        """Completions for the last comma-separated part of text, best first."""
+        prefix = _clean(_PHRASE_RE.split(text)[-1])
+        if not prefix:
+            return []
+        limit = min(limit, MAX_SUGGESTIONS)
+        ranks = self._prefix(prefix, limit)
+        if not ranks and len(prefix) >= MIN_FUZZY_CHARS:
+            ranks = self._one_edit(prefix, limit)
+        return [self.phrases[r] for r in ranks]
+
+
+def build_suggest_index(snapshot) -> SuggestIndex:
+    return SuggestIndex.from_snapshot(snapshot)
+
+
+def complete(text: str, suggestion: str) -> str:
+    """text with its last comma-separated part replaced by suggestion."""
+    parts = [p.strip() for p in _PHRASE_RE.split(text)[:-1] if p.strip()]
+    return ", ".join(parts + [suggestion])
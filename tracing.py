@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Per-session funnel tracing.
+
+One span per page visit: session id, page, entry/exit timestamps, rerun count,
+the transition that led into the page and what ended it: the next page, or,
+once the session has been idle for LEXAI_TRACE_IDLE_S seconds, "completed"
+if complete() was called for the span (the triage reached its results) and
+"abandoned" otherwise.
+
+observe() is called once per rerun and only touches an in-memory dict; closed
+spans go through a queue to a background writer thread that appends them to
+a local SQLite file and updates the pre-aggregated funnel tables in the same
+transaction, so the analytics funnel never scans raw spans.
+"""
+
+import bisect
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+
+TRACE_DB = os.environ.get("LEXAI_TRACE_DB", "traces.sqlite")
+
+# Dwell-time histogram bucket upper bounds (seconds) used for median estimates
+DWELL_BUCKETS = (1, 2, 3, 5, 8, 13, 20, 30, 45, 60, 90, 120, 180, 300, 600, 1800, float("inf"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spans (
+    session TEXT, page TEXT, entered REAL, exited REAL,
+    reruns INTEGER, action TEXT, exit TEXT
+);
+CREATE TABLE IF NOT EXISTS session_steps (
+    session TEXT, page TEXT, PRIMARY KEY (session, page)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS funnel (
+    page TEXT PRIMARY KEY, visits INTEGER, sessions INTEGER,
+    abandoned INTEGER, reruns INTEGER
+);
+CREATE TABLE IF NOT EXISTS dwell_hist (
+    page TEXT, bucket INTEGER, n INTEGER, PRIMARY KEY (page, bucket)
+) WITHOUT ROWID;
+"""
+
+
+class FunnelTracer:
+    def __init__(self, path: str = TRACE_DB, steps: list = None, idle_seconds: float = None):
+        if idle_seconds is None:
+            idle_seconds = float(os.environ.get("LEXAI_TRACE_IDLE_S", 1800))
+        self.path         = path
+        self.steps        = steps or []
+        self.idle_seconds = idle_seconds
+        self._open        = {}   # session → open span dict
+        self._lock        = threading.Lock()
+        self._queue       = queue.Queue()
+        self._last_sweep  = time.time()
+        self._writer      = threading.Thread(target=self._write_loop, name="funnel-trace-writer", daemon=True)
+        self._writer.start()
+
+    # --- hot path: once per rerun ---
+
+    def observe(self, session: str, page: str):
+        now = time.time()
+        with self._lock:
+            span = self._open.get(session)
+            if span is None:
+                self._open[session] = self._new_span(session, page, now, "session_start")
+            elif span["page"] == page:
+                span["reruns"] += 1
+                span["last_seen"] = now
+            else:
+                self._close(span, now, page)
+                self._open[session] = self._new_span(session, page, now, self._action(span["page"], page))
+            if now - self._last_sweep > 60:
+                self._sweep(now)
+
+    def complete(self, session: str):
+        """The session's current page finished the triage: its idle exit is "completed", not a drop-off."""
+        with self._lock:
+            span = self._open.get(session)
+            if span is not None:
+                span["completed"] = True
+
+    def _new_span(self, session, page, now, action):
+        return {"session": session, "page": page, "entered": now, "last_seen": now,
+                "reruns": 1, "action": action}
+
+    def _action(self, prev: str, page: str) -> str:
+        """Label the transition: restart, forward or back along the funnel, else jump."""
+        if page == (self.steps[0] if self.steps else None):
+            return f"restart:{prev}"
+        if prev in self.steps and page in self.steps:
+            return f"{'forward' if self.steps.index(page) > self.steps.index(prev) else 'back'}:{prev}"
+        return f"jump:{prev}"
+
+    def _close(self, span, exited, exit_to):
+        self._queue.put((span["session"], span["page"], span["entered"], exited,
+                         span["reruns"], span["action"], exit_to))
+
+    def _sweep(self, now):
+        self._last_sweep = now
+        for session, span in list(self._open.items()):
+            if now - span["last_seen"] > self.idle_seconds:
+                self._close(span, span["last_seen"], "completed" if span.get("completed") else "abandoned")
+                del self._open[session]
+
+    # --- background writer ---
+
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=30)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.executescript(SCHEMA)
+        return con
+
+    def _write_loop(self):
+        con = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < 500:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                with con:
+                    for span in batch:
+                        self._record(con, span)
+            except sqlite3.Error:
+                pass
+            for _ in batch:
+                self._queue.task_done()
+
+    def _record(self, con, span):
+        session, page, entered, exited, reruns, action, exit_to = span
+        con.execute("INSERT INTO spans VALUES (?,?,?,?,?,?,?)", span)
+        first = con.execute("INSERT OR IGNORE INTO session_steps VALUES (?,?)", (session, page)).rowcount
+        con.execute("INSERT OR IGNORE INTO funnel VALUES (?,0,0,0,0)", (page,))
+        con.execute(
+            "UPDATE funnel SET visits = visits + 1, sessions = sessions + ?, "
+            "abandoned = abandoned + ?, reruns = reruns + ? WHERE page = ?",
+            (first, int(exit_to == "abandoned"), reruns, page),
+        )
+        bucket = bisect.bisect_left(DWELL_BUCKETS, max(0.0, exited - entered))
+        con.execute("INSERT OR IGNORE INTO dwell_hist VALUES (?,?,0)", (page, bucket))
+        con.execute("UPDATE dwell_hist SET n = n + 1 WHERE page = ? AND bucket = ?", (page, bucket))
+
+    def flush(self, timeout: float = 5.0):
+        """Wait (up to timeout) for queued spans to be written."""
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+    # --- reporting (pre-aggregated tables only) ---
+
+    def funnel(self) -> list:
+        """
+        Rows per funnel step: sessions reaching it, conversion from the previous
+        step and from the first, drop-offs, median dwell (bucket upper bound, s).
+        Pages outside `steps` are appended after the funnel.
+        """
+        if not os.path.isfile(self.path):
+            return []
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            totals = {r[0]: r[1:] for r in con.execute(
+                "SELECT page, visits, sessions, abandoned, reruns FROM funnel")}
+            hist = {}
+            for page, bucket, n in con.execute("SELECT page, bucket, n FROM dwell_hist"):
+                hist.setdefault(page, {})[bucket] = n
+        finally:
+            con.close()
+
+        order = [p for p in self.steps if p in totals] + sorted(p for p in totals if p not in self.steps)
+        rows, first, prev = [], None, None
+        for page in order:
+            visits, sessions, abandoned, reruns = totals[page]
+            in_funnel = page in self.steps
+            if in_funnel and first is None:
+                first = sessions
+            rows.append({
+                "step": page,
+                "sessions": sessions,
+                "conversion_from_prev": (sessions / prev) if (in_funnel and prev) else None,
+                "conversion_from_start": (sessions / first) if (in_funnel and first) else None,
+                "abandoned_here": abandoned,
+                "median_dwell_s": _median_bucket(hist.get(page, {})),
+                "reruns_per_visit": reruns / visits if visits else 0,
+            })
+            if in_funnel:
+                prev = sessions
+        return rows
+
+
+def _median_bucket(counts: dict):
+    total = sum(counts.values())
+    if not total:
+        return None
+    seen = 0
+    for bucket in sorted(counts):
+        seen += counts[bucket]
+        if seen * 2 >= total:
+            return DWELL_BUCKETS[bucket]
+    return None
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in recording of production free-text searches, for replay.py.
+
+A sampled share of searches (LEXAI_RECORD_SAMPLE, 0–100; off by default) is
+appended to a JSON-lines log (LEXAI_RECORD_PATH, default traffic.jsonl), one
+compact line per search:
+
+    {"t": 1760860800.1, "v": "a36051f2af25", "g": "Female", "b": "adult",
+     "raw": "back pain since #", "norm": "back pain since #",
+     "rows": [47, 59], "conds": ["Pancreatitis", "Tension Headache"], "ms": 2.41}
+
+Inputs are anonymized before they are written: no session or patient ids are
+kept, digit runs become "#" and e-mail addresses "<email>". The log rolls to
+traffic.jsonl.1, .2, … once it reaches LEXAI_RECORD_MAX_MB.
+"""
+
+import json
+import os
+import random
+import re
+import threading
+import time
+
+
+RECORD_PATH = os.environ.get("LEXAI_RECORD_PATH", "traffic.jsonl")
+
+_EMAIL_RE  = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+_DIGITS_RE = re.compile(r"\d+")
+
+
+def anonymize(text: str) -> str:
+    return _DIGITS_RE.sub("#", _EMAIL_RE.sub("<email>", text or ""))
+
+
+class TrafficRecorder:
+    def __init__(self, path: str = RECORD_PATH, sample_pct: float = None, max_mb: float = None):
+        if sample_pct is None:
+            sample_pct = float(os.environ.get("LEXAI_RECORD_SAMPLE", 0))
+        if max_mb is None:
+            max_mb = float(os.environ.get("LEXAI_RECORD_MAX_MB", 256))
+        self.path       = path
+        self.sample_pct = sample_pct
+        self.max_bytes  = int(max_mb * 1024 * 1024)
+        self._lock      = threading.Lock()
+
+    def should_record(self) -> bool:
+        return self.sample_pct > 0 and random.random() * 100 < self.sample_pct
+
+    def record(self, version: str, gender, band, raw: str, normalized: str,
+               rows: list, conditions: list, ms: float):
+        line = json.dumps({
+            "t": round(time.time(), 3), "v": version, "g": gender, "b": band,
+            "raw": anonymize(raw), "norm": anonymize(normalized),
+            "rows": [int(r) for r in rows], "conds": [str(c) for c in conditions],
+            "ms": round(ms, 3),
+        }, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            if os.path.isfile(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                self._roll()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def _roll(self):
+        n = 1
+        while os.path.exists(f"{self.path}.{n}"):
+            n += 1
+        os.replace(self.path, f"{self.path}.{n}")
+
+
+def read_log(path: str):
+    """Yield recorded searches from a log file, skipping torn/partial lines."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Triage logic shared by the Streamlit pages and the JSON API: demographic
+gating, the per-snapshot partitions and menus, and condition selection.
+Nothing here imports streamlit.
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+from admission import ADMISSION
+from matcher import MatcherIndex, match_with_stages
+from shards import build_sharded_matcher
+
+
+WOMEN_SPECIFIC = {
+    "Women's Health", "Pelvic Inflammatory Disease", "Breast Lump",
+    "Cervical Cancer", "Menopause", "Fibroids", "Heavy Menstrual Bleeding",
+    "Yeast Infection", "Bacterial Vaginosis", "Endometriosis", "PCOS",
+    "Pelvic Organ Prolapse", "Ovarian Cyst", "Ectopic Pregnancy"
+}
+MEN_SPECIFIC = {
+    "Men's Health", "Prostatitis", "Testicular Torsion",
+    "Benign Prostatic Hyperplasia", "Varicocele", "Balanitis"
+}
+
+
+def gender_allowed(primary_category, gender) -> bool:
+    primary_category = primary_category.replace("’", "'")
+    if gender == "Male" and primary_category in WOMEN_SPECIFIC:
+        return False
+    if gender == "Female" and primary_category in MEN_SPECIFIC:
+        return False
+    return True
+
+
+def age_band(age) -> str:
+    """Pediatrics is hidden from 15+; an unknown age keeps it visible."""
+    return "adult" if (age is not None) and (age >= 15) else "pediatric"
+
+
+def build_matcher_index(snapshot) -> MatcherIndex:
+    return MatcherIndex.from_db(snapshot.db)
+
+
+def build_partitions(snapshot) -> dict:
+    """
+    Per (gender, age band) view of the workbook, built once per snapshot:
+      rows        – row labels whose Primary Category this patient may see
+      categories  – those categories in sheet order (the category menu)
+      index       – the free-text matcher index sliced to those rows
+    Key None holds the unfiltered view (demographics unknown).
+    """
+    df = snapshot.db
+    full_index = snapshot.derived("matcher_index", build_matcher_index)
+    cats = list(df["Primary Category"].dropna().unique())
+    partitions = {None: {"rows": list(df.index), "categories": cats, "index": full_index}}
+    for gender in ("Male", "Female"):
+        for band in ("pediatric", "adult"):
+            allowed = [
+                cat for cat in cats
+                if not (band == "adult" and str(cat).strip().lower() == "pediatrics")
+                and gender_allowed(cat, gender)
+            ]
+            rows = list(df.index[df["Primary Category"].isin(allowed)])
+            partitions[(gender, band)] = {
+                "rows": rows, "categories": allowed, "index": full_index.slice(rows),
+            }
+    return partitions
+
+
+def build_sharded(snapshot):
+    """Resident shard workers for the snapshot's matcher, or None for small workbooks (see shards.py)."""
+    partitions = snapshot.derived("partitions", build_partitions)
+    return build_sharded_matcher(partitions[None]["index"],
+                                 {key: p["rows"] for key, p in partitions.items() if key is not None})
+
+
+def match_rows(snapshot, text: str, gender=None, age=None, fuzzy: bool = True, budget_s: float = None,
+               record: bool = True) -> tuple:
+    """
+    (row labels, complete) matching the normalized free text within the
+    patient's partition; fanned out to the shard workers when the workbook is
+    large. fuzzy/budget_s as in matcher.match_with_stages; record=False keeps
+    the query out of matcher.STATS.
+    """
+    partitions = snapshot.derived("partitions", build_partitions)
+    key = (gender, age_band(age))
+    if key not in partitions:
+        key = None
+    sharded = snapshot.derived("sharded_matcher", build_sharded)
+    if sharded is not None:
+        try:
+            return sharded.search(text, key, fuzzy, budget_s, record)
+        except Exception:
+            pass   # a dead or hung worker: answer in-process rather than fail the search
+    rows, _, complete = match_with_stages(text, partitions[key]["index"], fuzzy, budget_s, record)
+    return rows, complete
+
+
+def admitted_match(snapshot, text: str, gender=None, age=None) -> tuple:
+    """
+    match_rows() behind the process-wide admission controller (admission.py).
+    Returns (row labels, status): "ok", "degraded" (fuzzy skipped or cut
+    short, so a miss may be a false negative) or "shed" (nothing was run).
+    """
+    with ADMISSION.slot() as mode:
+        if mode == "shed":
+            return [], "shed"
+        if mode == "full":
+            rows, complete = match_rows(snapshot, text, gender, age, budget_s=ADMISSION.budget_s)
+            if complete:
+                return rows, "ok"
+            ADMISSION.count("degraded_budget")
+            return rows, "degraded"
+        rows, _ = match_rows(snapshot, text, gender, age, fuzzy=False)
+        return rows, "degraded"
+
+
+def build_subcategories(snapshot) -> dict:
+    """Primary category → sorted subcategories (the subcategory menu)."""
+    return {
+        primary: sorted(group["SubCategory"].dropna().unique())
+        for primary, group in snapshot.db.groupby("Primary Category", sort=False, observed=True)
+    }
+
+
+def _split_interned(raw) -> tuple:
+    return tuple(sys.intern(s.strip()) for s in str(raw).split(",") if s.strip())
+
+
+def build_vocabularies(snapshot) -> dict:
+    """
+    Row label → the row's symptoms and risk flags, split once per snapshot.
+    Every distinct symptom / flag string is interned, so rows share one copy.
+    """
+    db = snapshot.db
+    vocab = {"symptoms": {}, "risk_flags": {}}
+    for key, col in (("symptoms", "Symptoms"), ("risk_flags", "RiskFlags")):
+        if col in db.columns:
+            vocab[key] = {idx: _split_interned(raw) for idx, raw in db[col].dropna().items()}
+    return vocab
+
+
+def symptom_options(snapshot, rows) -> list:
+    """Sorted distinct symptoms across the given row labels (the symptom menu)."""
+    symptoms = snapshot.derived("vocabularies", build_vocabularies)["symptoms"]
+    return sorted({s for idx in rows for s in symptoms.get(idx, ())})
+
+
+def partition_for(snapshot, gender=None, age=None) -> dict:
+    partitions = snapshot.derived("partitions", build_partitions)
+    return partitions.get((gender, age_band(age)), partitions[None])
+
+
+def pathway_rows(source: pd.DataFrame, primary, subcategory) -> pd.DataFrame:
+    """
+    Candidate condition rows for a (Primary Category, SubCategory) pathway.
+    On the categorical key columns (see workbook.py) both comparisons run on codes.
+    """
+    mask = _equals(source["Primary Category"], primary) & _equals(source["SubCategory"], subcategory)
+    return source.iloc[np.flatnonzero(mask)]
+
+
+def _equals(column: pd.Series, value) -> np.ndarray:
+    values = column.array
+    if isinstance(values, pd.Categorical):
+        code = values.categories.get_indexer([value])[0] if value is not None else -1
+        return (values.codes == code) if code >= 0 else np.zeros(len(values), dtype=bool)
+    return (column == value).to_numpy()
+
+
+def build_symptom_masks(snapshot) -> dict:
+    """
+    (primary, subcategory) → {"bits": {symptom: bit}, "rows": (row label, …), "masks": (int, …),
+    "sizes": (symptom count, …)}. Each pathway's distinct symptoms get one bit;
+    a row's mask has the bits of its own symptoms.
+    """
+    symptoms = snapshot.derived("vocabularies", build_vocabularies)["symptoms"]
+    return {key: pathway_masks(group.index.tolist(), symptoms)
+            for key, group in snapshot.db.groupby(["Primary Category", "SubCategory"], sort=False, observed=True)}
+
+
+def pathway_masks(rows: list, symptoms: dict) -> dict:
+    """One pathway's build_symptom_masks entry; symptoms is the "vocabularies" row → symptoms map."""
+    bits, row_masks = {}, []
+    for idx in rows:
+        mask = 0
+        for s in symptoms.get(idx, ()):
+            mask |= 1 << bits.setdefault(s, len(bits))
+        row_masks.append(mask)
+    return {"bits": bits, "rows": tuple(rows), "masks": tuple(row_masks),
+            "sizes": tuple(m.bit_count() for m in row_masks)}
+
+
+def symptom_scores(entry: dict, selected) -> dict:
+    """
+    Row label → (overlap, Jaccard) of the row's symptoms with the selected ones,
+    for every row of the pathway; {} if nothing selected is in its vocabulary.
+    """
+    if not entry:
+        return {}
+    bits, wanted = entry["bits"], 0
+    for s in selected or ():
+        if s in bits:
+            wanted |= 1 << bits[s]
+    if not wanted:
+        return {}
+    n = wanted.bit_count()
+    scores = {}
+    for row, mask, size in zip(entry["rows"], entry["masks"], entry["sizes"]):
+        overlap = (mask & wanted).bit_count()
+        scores[row] = (overlap, overlap / (size + n - overlap))
+    return scores
+
+
+def rank_candidates(candidates: list, scores: dict = None):
+    """
+    Row label among candidates [(row, acuity)] (sheet order): the highest
+    Acuity Level, always. Symptom scores only break a tie within it (the
+    better Jaccard wins); otherwise the first row wins it. So selecting
+    symptoms can never report a lower-acuity row.
+    """
+    if scores:
+        return max(candidates, key=lambda c: (c[1], scores.get(c[0], (0, 0.0))[1]))[0]
+    return max(candidates, key=lambda c: c[1])[0]
+
+
+def choose_condition(subset: pd.DataFrame, answers: dict, scores: dict = None):
+    """
+    Row label of the condition to report for this pathway:
+      - exactly one row whose CQ2 was answered "Yes" → that row
+      - several → the highest Acuity Level among them
+      - none → the highest Acuity Level in the pathway
+    scores (see symptom_scores) break acuity ties in the last two cases; see
+    rank_candidates.
+    """
+    flagged = []
+    for idx, q2 in subset["Clarifying Questions2"].items():
+        if pd.notna(q2) and answers.get(q2) == "Yes":
+            flagged.append(idx)
+
+    if len(flagged) == 1:
+        return flagged[0]
+    candidates = subset.loc[flagged] if flagged else subset
+    acuity = candidates["Acuity Level"].astype(int)
+    return rank_candidates(list(zip(acuity.index.tolist(), acuity.tolist())), scores)
+
+
+def risk_flags_of(condition) -> list:
+    raw = str(condition.get("RiskFlags", "") or "")
+    return [f.strip() for f in raw.split(",") if f.strip()]
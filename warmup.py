@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Boot-time warmup, so the first patient on a fresh worker doesn't pay for
+parsing the workbook, compiling the rules and building the indexes.
+
+    python warmup.py [streamlit run options…]   # warm, mark ready, then serve app.py
+    python warmup.py --check                     # warm, print timings, exit
+
+The launcher builds every cached artifact in the same process the Streamlit
+server then runs in, for the default tenant and every tenant in
+tenants.json: the workbook snapshot (main sheet + FreeTextMap), the matcher
+index (and its shard workers, for large workbooks), the demographic
+partitions, the subcategory and symptom menus, the per-pathway symptom
+bitmasks, the compiled recommendations, the triage decision table, the
+symptom autocomplete index and the logo. Per-artifact timings are printed
+and written as JSON to the readiness file (LEXAI_READY_FILE, default
+.lexai_ready), which exists only while the caches are hot — point the load
+balancer's readiness probe at it (e.g. `test -f .lexai_ready`). api.py warms
+the same way in its lifespan hook and answers GET /readyz.
+"""
+
+import atexit
+import functools
+import io
+import json
+import os
+import sys
+import time
+
+from decisions import build_decision_table
+from recommend import build_recommendations
+from suggest import build_suggest_index
+from triage import (build_matcher_index, build_partitions, build_sharded, build_subcategories, build_symptom_masks,
+                    build_vocabularies)
+from workbook import DEFAULT_TENANT, default_registry
+
+
+READY_FILE = os.environ.get("LEXAI_READY_FILE", ".lexai_ready")
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+LOGO_PATH  = "logo.png"
+
+# Snapshot artifacts in dependency order (names shared with app.py / api.py)
+ARTIFACTS = [
+    ("matcher_index",   build_matcher_index),
+    ("partitions",      build_partitions),
+    ("sharded_matcher", build_sharded),
+    ("subcategories",   build_subcategories),
+    ("vocabularies",    build_vocabularies),
+    ("symptom_masks",   build_symptom_masks),
+    ("recommendations", build_recommendations),
+    ("decision_table",  build_decision_table),
+    ("suggest_index",   build_suggest_index),
+]
+
+REPORT = []   # rows of the last warm() in this process, for the analytics page
+
+
+@functools.lru_cache(maxsize=None)
+def load_logo(path: str = LOGO_PATH) -> bytes:
+    """
+    The logo as encoded PNG bytes, read once per process. st.image() serves
+    bytes as-is instead of re-encoding a PIL image on every rerun.
+    """
+    from PIL import Image
+
+    with open(path, "rb") as f:
+        data = f.read()
+    Image.open(io.BytesIO(data)).verify()
+    return data
+
+
+def warm(registry=None) -> list:
+    """Build everything for every configured tenant; [{tenant, version, artifact, seconds}]."""
+    registry = registry or default_registry()
+    rows = []
+
+    def timed(tenant, version, artifact, fn):
+        t0 = time.perf_counter()
+        value = fn()
+        rows.append({"tenant": tenant, "version": version, "artifact": artifact,
+                     "seconds": round(time.perf_counter() - t0, 4)})
+        return value
+
+    # default last, so it is the most recently used snapshot if the budget is tight
+    for tenant in [t for t in registry.tenants if t != DEFAULT_TENANT] + [DEFAULT_TENANT]:
+        snapshot = timed(tenant, None, "workbook", lambda: registry.snapshot(tenant))
+        rows[-1]["version"] = snapshot.version
+        for name, builder in ARTIFACTS:
+            timed(tenant, snapshot.version, name, lambda: snapshot.derived(name, builder))
+    timed(None, None, "logo", load_logo)
+
+    REPORT[:] = rows
+    return rows
+
+
+def mark_ready(rows: list):
+    tmp = READY_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"pid": os.getpid(), "ready_at": time.time(), "artifacts": rows}, f, indent=2)
+    os.replace(tmp, READY_FILE)
+
+
+def clear_ready():
+    try:
+        os.remove(READY_FILE)
+    except FileNotFoundError:
+        pass
+
+
+def print_report(rows: list):
+    print(f"{'tenant':>12} {'version':>13} {'artifact':>16} {'seconds':>9}")
+    for r in rows:
+        print(f"{r['tenant'] or '-':>12} {r['version'] or '-':>13} {r['artifact']:>16} {r['seconds']:>9.3f}")
+    print(f"{'total':>43} {sum(r['seconds'] for r in rows):>9.3f}")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    clear_ready()
+    rows = warm()
+    print_report(rows)
+    if "--check" in argv:
+        return 0
+
+    mark_ready(rows)
+    atexit.register(clear_ready)
+    from streamlit.web import cli as stcli
+
+    sys.argv = ["streamlit", "run", APP_SCRIPT, *argv]
+    return stcli.main()
+
+
+if __name__ == "__main__":
+    # Run main() from the importable module rather than __main__, so app.py's
+    # `import warmup` sees the same logo cache and REPORT.
+    import warmup
+
+    sys.exit(warmup.main())
@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+"""
+Workbook snapshots and the per-tenant registry.
+
+Each embedding partner (tenant) can have its own symptom workbook. A tenant
+is resolved from the iframe params or the embedding origin and mapped to a
+workbook file; the parsed workbook plus everything derived from it lives in
+a Snapshot. Snapshots are loaded lazily, shared between tenants whose files
+are byte-identical (keyed by content hash), and kept in an LRU bounded by
+total bytes rather than entry count.
+
+Tenant config (JSON, path from LEXAI_TENANTS, default tenants.json):
+    {
+      "default":  {"workbook": "SymptomBotDB.xlsx"},
+      "tenants": {
+        "acme": {"workbook": "workbooks/acme.xlsx",
+                 "origins":  ["https://portal.acme.example"],
+                 "api_keys": ["..."]}
+      }
+    }
+Without a config file every session uses SymptomBotDB.xlsx, or the URL in
+LEXAI_WORKBOOK_URL if that is set. A workbook may be an http(s) URL: it is
+served from a local copy that is revalidated with conditional GETs (remote.py).
+"""
+
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+import pandas as pd
+
+from remote import RemoteWorkbook, is_remote
+
+
+DEFAULT_WORKBOOK = os.environ.get("LEXAI_WORKBOOK_URL") or "SymptomBotDB.xlsx"
+DEFAULT_TENANT   = "default"
+DEFAULT_BUDGET_MB = 512
+
+# Repetitive text columns stored as pandas categoricals: filters compare small
+# integer codes instead of Python strings, and row slices (the per-session
+# matched_conditions copies) share one dictionary of the values.
+CATEGORICAL_COLUMNS = [
+    "Primary Category", "SubCategory", "Labeling Confidence",
+    "Clarifying Questions 1", "Clarifying Questions2", "RiskFlags",
+]
+
+
+def read_freetext_map(xls) -> dict:
+    """
+    Reads sheet 'FreeTextMap' with columns:
+      from_phrase, to_phrase  (case-insensitive)
+    Returns dict {from_phrase_lower: to_phrase_lower}.
+    If the sheet is missing, returns {} (no-op).
+    """
+    try:
+        df_map = pd.read_excel(xls, sheet_name="FreeTextMap")
+        df_map.columns = df_map.columns.str.strip().str.lower()
+        if not {"from_phrase","to_phrase"}.issubset(df_map.columns):
+            return {}
+        # build lowercase map, drop blanks
+        m = {}
+        for _, r in df_map.iterrows():
+            fp = str(r["from_phrase"]).strip().lower()
+            tp = str(r["to_phrase"]).strip().lower()
+            if fp and tp and fp != "nan" and tp != "nan":
+                m[fp] = tp
+        return m
+    except Exception:
+        return {}
+
+
+def read_workbook(data: bytes):
+    """Parse workbook bytes once into (db, ft_map)."""
+    xls = pd.ExcelFile(io.BytesIO(data))
+    df = pd.read_excel(xls, sheet_name=0)
+    # ── Normalize every header: remove leading/trailing whitespace ──
+    df.columns = df.columns.str.strip()
+    return encode_columns(df), read_freetext_map(xls)
+
+
+def encode_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert the CATEGORICAL_COLUMNS present in df to category dtype, in place."""
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns and df[col].dtype == object:
+            df[col] = df[col].astype("category")
+    return df
+
+
+def snapshot_from_file(path: str) -> "Snapshot":
+    """Parse a workbook file into a standalone Snapshot (for offline tools, outside the registry)."""
+    with open(path, "rb") as f:
+        data = f.read()
+    t0 = time.perf_counter()
+    db, ft_map = read_workbook(data)
+    return Snapshot(hashlib.sha256(data).hexdigest(), path, db, ft_map, time.perf_counter() - t0)
+
+
+def approx_size(obj, _seen=None) -> int:
+    """Rough deep size in bytes (DataFrames via memory_usage, containers recursively)."""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        usage = obj.memory_usage(deep=True)
+        return int(usage.sum() if hasattr(usage, "sum") else usage)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_size(k, _seen) + approx_size(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approx_size(v, _seen) for v in obj)
+    elif hasattr(obj, "__dict__"):
+        size += approx_size(vars(obj), _seen)
+    elif hasattr(obj, "__slots__"):
+        size += sum(approx_size(getattr(obj, s), _seen) for s in obj.__slots__ if hasattr(obj, s))
+    return size
+
+
+class Snapshot:
+    """
+    One parsed workbook version. Derived indexes are built on first use via
+    derived(name, builder) and counted towards the snapshot's byte size.
+    """
+
+    def __init__(self, digest: str, source: str, db: pd.DataFrame, ft_map: dict, load_seconds: float):
+        self.digest       = digest
+        self.version      = digest[:12]
+        self.source       = source
+        self.db           = db
+        self.ft_map       = ft_map
+        self.load_seconds = load_seconds
+        self._derived     = {}
+        self._derived_sizes = {}
+        self._derived_seconds = {}
+        self._lock        = threading.RLock()   # builders may depend on other derived artifacts
+        self.base_bytes   = approx_size(db) + approx_size(ft_map)
+
+    @property
+    def nbytes(self) -> int:
+        return self.base_bytes + sum(self._derived_sizes.values())
+
+    def derived(self, name: str, builder):
+        """Return the derived artifact `name`, building it with builder(self) once."""
+        try:
+            return self._derived[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._derived:
+                t0 = time.perf_counter()
+                value = builder(self)
+                self._derived_seconds[name] = time.perf_counter() - t0
+                self._derived_sizes[name] = approx_size(value)
+                self._derived[name] = value
+        return self._derived[name]
+
+    def artifacts(self) -> list:
+        """[{artifact, bytes, build_seconds}] for the snapshot and each built index."""
+        rows = [{"artifact": "workbook", "bytes": self.base_bytes, "build_seconds": self.load_seconds}]
+        for name, nbytes in self._derived_sizes.items():
+            rows.append({"artifact": name, "bytes": nbytes,
+                         "build_seconds": self._derived_seconds.get(name, 0.0)})
+        return rows
+
+
+def _origin_of(url: str):
+    """Lowercased "scheme://host[:port]" of a URL, or None if it has none."""
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return None
+    if not parts.scheme or not parts.hostname:
+        return None
+    return f"{parts.scheme.lower()}://{parts.hostname}" + (f":{port}" if port is not None else "")
+
+
+class WorkbookRegistry:
+    """
+    Tenant → workbook → Snapshot, with snapshots shared by content hash and
+    evicted least-recently-used once their total size exceeds max_bytes.
+    The snapshot just requested is never evicted, even if it alone is over budget.
+
+    Hashing, parsing and reindexing run outside the registry lock, under a
+    lock per file / digest: concurrent callers of one workbook share a single
+    load, and a cold or edited workbook doesn't hold up other tenants.
+    """
+
+    def __init__(self, tenants: dict = None, default_workbook: str = DEFAULT_WORKBOOK,
+                 max_bytes: int = DEFAULT_BUDGET_MB * 1024 * 1024):
+        self.tenants   = tenants or {}
+        self.default_workbook = default_workbook
+        self.max_bytes = max_bytes
+        self._lock     = threading.RLock()
+        self._lru      = OrderedDict()   # digest → Snapshot
+        self._file_digests = {}          # path → ((mtime, size), digest)
+        self._remotes  = {}              # url → RemoteWorkbook
+        self._latest   = {}              # source → digest of its newest snapshot
+        self._metrics  = {}              # tenant → counters
+        self._key_locks = {}             # path / digest → lock held while hashing / loading it
+
+    @classmethod
+    def from_config(cls, path: str = None):
+        path = path or os.environ.get("LEXAI_TENANTS", "tenants.json")
+        budget_mb = float(os.environ.get("LEXAI_SNAPSHOT_BUDGET_MB", DEFAULT_BUDGET_MB))
+        cfg = {}
+        if os.path.isfile(path):
+            with open(path, encoding="utf-8") as f:
+                cfg = json.load(f)
+        default = (cfg.get("default") or {}).get("workbook", DEFAULT_WORKBOOK)
+        return cls(cfg.get("tenants", {}), default, int(budget_mb * 1024 * 1024))
+
+    # --- Tenant resolution ---
+
+    def resolve_tenant(self, params: dict = None, headers: dict = None) -> str:
+        """
+        Pick the tenant for a session:
+          1) explicit ?tenant=… if it is configured
+          2) the tenant owning ?api_key=…
+          3) the tenant whose origins include the Origin/Referer header's exact
+             scheme://host[:port] (no prefix matching)
+          4) "default"
+        """
+        params  = params or {}
+        headers = headers or {}
+        tenant = params.get("tenant")
+        if tenant in self.tenants:
+            return tenant
+
+        api_key = params.get("api_key")
+        if api_key:
+            for name, t in self.tenants.items():
+                if api_key in t.get("api_keys", []):
+                    return name
+
+        origin = _origin_of(headers.get("Origin") or headers.get("origin")
+                            or headers.get("Referer") or headers.get("referer") or "")
+        if origin:
+            for name, t in self.tenants.items():
+                if origin in {_origin_of(o) for o in t.get("origins", [])}:
+                    return name
+        return DEFAULT_TENANT
+
+    def tenant_for_api_key(self, api_key: str):
+        for name, t in self.tenants.items():
+            if api_key and api_key in t.get("api_keys", []):
+                return name
+        return None
+
+    def workbook_for(self, tenant: str) -> str:
+        return (self.tenants.get(tenant) or {}).get("workbook", self.default_workbook)
+
+    def local_path(self, source: str) -> str:
+        """source itself for a file, the revalidated local copy for a URL."""
+        if not is_remote(source):
+            return source
+        with self._lock:
+            remote = self._remotes.get(source)
+            if remote is None:
+                remote = self._remotes[source] = RemoteWorkbook(source)
+        return remote.path()
+
+    def remotes(self) -> list:
+        """[RemoteWorkbook.status()] for every URL-sourced workbook used so far."""
+        with self._lock:
+            return [r.status() for r in self._remotes.values()]
+
+    # --- Snapshots ---
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _digest(self, path: str):
+        """Content hash for a workbook file, re-hashed only when mtime/size change."""
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            known = self._file_digests.get(path)
+        if known and known[0] == stamp:
+            return known[1], None
+        with self._key_lock(path):
+            with self._lock:
+                known = self._file_digests.get(path)
+            if known and known[0] == stamp:   # hashed by a concurrent caller
+                return known[1], None
+            with open(path, "rb") as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()
+            with self._lock:
+                self._file_digests[path] = (stamp, digest)
+            return digest, data
+
+    def _resident(self, digest: str, m: dict):
+        """The resident snapshot for digest (counted as a hit), or None. Called holding _lock."""
+        snap = self._lru.get(digest)
+        if snap is not None:
+            self._lru.move_to_end(digest)
+            m["hits"] += 1
+        return snap
+
+    def snapshot(self, tenant: str = DEFAULT_TENANT) -> Snapshot:
+        source = self.workbook_for(tenant)
+        # outside the registry lock: a first download waits on the network (revalidations run in the background)
+        path = self.local_path(source)
+        digest, data = self._digest(path)
+        with self._lock:
+            m = self._metrics.setdefault(tenant, {
+                "tenant": tenant, "workbook": source, "version": None,
+                "hits": 0, "loads": 0, "load_seconds": 0.0,
+            })
+            snap = self._resident(digest, m)
+        if snap is None:
+            with self._key_lock(digest):
+                with self._lock:
+                    snap = self._resident(digest, m)   # loaded by a concurrent caller
+                    previous = self._lru.get(self._latest.get(source))
+                if snap is None:
+                    snap = self._load(digest, source, path, data, previous, m)
+        with self._lock:
+            m["version"] = snap.version
+            self._latest[source] = digest
+            self._evict(keep=digest)
+            return snap
+
+    def _load(self, digest: str, source: str, path: str, data, previous, m: dict) -> Snapshot:
+        """Parse (and reindex from previous) outside _lock; the caller holds digest's key lock."""
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+        t0 = time.perf_counter()
+        db, ft_map = read_workbook(data)
+        snap = Snapshot(digest, source, db, ft_map, time.perf_counter() - t0)
+        error = None
+        if previous is not None:
+            # an edited workbook: carry over what the edit didn't touch (reindex.py)
+            import reindex
+            try:
+                reindex.reindex(previous, snap)
+            except Exception as e:   # the artifacts still build from scratch on first use
+                error = f"{type(e).__name__}: {e}"
+        with self._lock:
+            if error:
+                m["reindex_error"] = error
+            self._lru[digest] = snap
+            m["loads"] += 1
+            m["load_seconds"] += snap.load_seconds
+        return snap
+
+    def _evict(self, keep: str):
+        total = sum(s.nbytes for s in self._lru.values())
+        for digest in list(self._lru):
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            total -= self._lru.pop(digest).nbytes
+            self._key_locks.pop(digest, None)
+
+    def snapshots(self) -> list:
+        with self._lock:
+            return list(self._lru.values())
+
+    def metrics(self) -> list:
+        """Per-tenant rows: workbook, version, resident bytes, hits, loads, load time."""
+        with self._lock:
+            resident = {s.version: s for s in self._lru.values()}
+            sharers = {}
+            for m in self._metrics.values():
+                sharers[m["version"]] = sharers.get(m["version"], 0) + 1
+            rows = []
+            for m in self._metrics.values():
+                snap = resident.get(m["version"])
+                rows.append({
+                    **m,
+                    "resident": snap is not None,
+                    "bytes": snap.nbytes if snap else 0,
+                    "shared_by": sharers.get(m["version"], 0),
+                })
+            return rows
+
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+def default_registry() -> WorkbookRegistry:
+    """
+    The process-wide registry from config. Shared by app.py, api.py and
+    warmup.py, so a warmup run before the server starts is what sessions see.
+    """
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = WorkbookRegistry.from_config()
+        return _default_registry